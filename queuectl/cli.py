@@ -3,12 +3,17 @@ import click
 import json
 import time
 import logging
+import signal
 import threading
 from tabulate import tabulate
 
-from queuectl.core.storage import JobStorage
+from queuectl.core.storage import BACKENDS, open_storage, migrate_storage
 from queuectl.core.queue import JobQueue
+from queuectl.core.job import TASK, JobState, format_timestamp
+from queuectl.core.dag import ON_PARENT_FAILURE, order_dag
 from queuectl.core.worker import WorkerManager
+from queuectl.core.executor import EXECUTORS, build_argv
+from queuectl.core.tasks import check_task_ref
 from queuectl.utils.config import Config
 
 # Configure logging
@@ -18,12 +23,13 @@ logging.basicConfig(
 )
 
 @click.group()
-@click.option('--storage-path', default='queuectl_data', help='Path to storage directory')
+@click.option('--storage-path', default='queuectl_data',
+              help='Path to storage directory (prefix with "sqlite:" to force a backend)')
 @click.pass_context
 def cli(ctx, storage_path):
     """QueueCTL - Background Job Queue System"""
     ctx.ensure_object(dict)
-    ctx.obj['storage'] = JobStorage(storage_path)
+    ctx.obj['storage'] = open_storage(storage_path)
     ctx.obj['queue'] = JobQueue(ctx.obj['storage'])
     ctx.obj['config'] = Config(ctx.obj['storage'])
     ctx.obj['worker_manager'] = None
@@ -33,31 +39,227 @@ def cli(ctx, storage_path):
 @click.option('--max-retries', default=3, help='Maximum retry attempts')
 @click.option('--timeout', default=30, help='Job timeout in seconds')
 @click.option('--backoff-base', default=2, help='Exponential backoff base')
+@click.option('--delay', type=float, help='Run no sooner than N seconds from now')
+@click.option('--run-at', type=click.DateTime(), help='Run no sooner than this local time')
+@click.option('--queue', 'queue_name', default='default', help='Named queue to put the job on')
+@click.option('--priority', default=0, help='Higher runs first within its queue')
+@click.option('--shell/--no-shell', default=True, help='Run through /bin/sh, or exec the split command directly')
+@click.option('--task', is_flag=True, help='COMMAND is a Python "module:function" run in the task pool')
+@click.option('--args', 'task_args', help='JSON array or object of arguments for --task')
+@click.option('--concurrency-key', help='Share concurrency and rate limits with other jobs of this key')
+@click.option('--concurrency-limit', type=click.IntRange(min=1), help='Set the key\'s limit on jobs running at once')
+@click.option('--rate', help='Set the key\'s limit on job starts, e.g. 50/m or 5/10s')
+@click.option('--after', help='Comma-separated job ids that must complete first')
+@click.option('--on-parent-failure', type=click.Choice(ON_PARENT_FAILURE), default='cascade',
+              help='When a parent dies: cancel this job too (cascade) or run it anyway')
+@click.option('--idempotency-key', help='Return the job already enqueued with this key instead of adding one')
+@click.option('--cache-ttl', type=click.FloatRange(min=0, min_open=True),
+              help='Cache this job\'s output for N seconds; reuse a cached output of an identical job')
 @click.pass_context
-def enqueue(ctx, command, max_retries, timeout, backoff_base):
+def enqueue(ctx, command, max_retries, timeout, backoff_base, delay, run_at, queue_name, priority, shell,
+            task, task_args, concurrency_key, concurrency_limit, rate, after, on_parent_failure,
+            idempotency_key, cache_ttl):
     """Enqueue a new job"""
+    parents = [job_id.strip() for job_id in after.split(',') if job_id.strip()] if after else []
+    for job_id in parents:
+        if not ctx.obj['queue'].storage.get_job(job_id) and not ctx.obj['queue'].archive.find(job_id):
+            raise click.BadParameter(f"no job {job_id}", param_hint="'--after'")
+
+    if concurrency_limit is not None or rate is not None:
+        if not concurrency_key:
+            raise click.BadParameter("needs --concurrency-key", param_hint="'--concurrency-limit/--rate'")
+        # Flags given here update the key's limits; the others stay as they were
+        current = ctx.obj['queue'].storage.get_limits().get(concurrency_key, {})
+        _set_limit(ctx.obj['queue'], concurrency_key,
+                   concurrency_limit if concurrency_limit is not None else current.get("concurrency"),
+                   rate if rate is not None else current.get("rate"))
+
+    extra = {"concurrency_key": concurrency_key} if concurrency_key else {}
+    if idempotency_key:
+        extra["idempotency_key"] = idempotency_key
+    if cache_ttl:
+        extra["cache_ttl"] = cache_ttl
+    if parents:
+        extra.update(depends_on=parents, on_parent_failure=on_parent_failure)
+    if task:
+        extra.update(kind=TASK, args=_parse_task_args(task_args))
+        try:
+            check_task_ref(command)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'COMMAND'")
+    elif task_args is not None:
+        raise click.BadParameter("only applies with --task", param_hint="'--args'")
+    else:
+        _check_argv(command, shell)
+    next_run_at = None
+    if delay is not None:
+        next_run_at = time.time() + delay
+    elif run_at is not None:
+        next_run_at = run_at.timestamp()
+
+    enqueued_at = time.time()
     job = ctx.obj['queue'].enqueue(
         command,
         max_retries=max_retries,
         timeout=timeout,
-        backoff_base=backoff_base
+        backoff_base=backoff_base,
+        next_run_at=next_run_at,
+        queue=queue_name,
+        priority=priority,
+        shell=shell,
+        **extra
     )
+    _retire_metrics(ctx)
     
-    if job:
+    if job and idempotency_key and job.created_at < enqueued_at:
+        click.echo(f"Job already enqueued with key {idempotency_key}")
+        click.echo(f"   ID: {job.id}")
+        click.echo(f"   State: {job.state.value}")
+    elif job:
         click.echo(f"Job enqueued successfully!")
         click.echo(f"   ID: {job.id}")
         click.echo(f"   Command: {job.command}")
+        if job.next_run_at:
+            click.echo(f"   Runs at: {format_timestamp(job.next_run_at)} UTC")
+        if job.state == JobState.BLOCKED:
+            click.echo(f"   Waiting on: {job.pending_parents} parent job(s)")
+        elif job.state == JobState.DEAD:
+            click.echo(f"   {job.last_error}")
+        elif job.state == JobState.COMPLETED:
+            click.echo("   Completed from the result cache")
     else:
         click.echo("Failed to enqueue job")
 
+@cli.command(name='enqueue-batch')
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--batch-size', default=1000, help='Jobs written per storage commit')
+@click.pass_context
+def enqueue_batch(ctx, source, batch_size):
+    """Enqueue jobs from a JSONL file (or stdin), one job spec per line"""
+    queue = ctx.obj['queue']
+    errors = 0
+
+    def specs():
+        nonlocal errors
+        for line_no, line in enumerate(source, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                yield queue.build_job(json.loads(line))
+            except ValueError as e:
+                errors += 1
+                click.echo(f"Line {line_no}: {e}", err=True)
+
+    start_time = time.time()
+    count = queue.enqueue_many(specs(), batch_size=batch_size)
+    elapsed = time.time() - start_time
+    _retire_metrics(ctx)
+
+    rate = count / elapsed if elapsed > 0 else float(count)
+    click.echo(f"Enqueued {count} job(s) in {elapsed:.2f}s ({rate:.0f} jobs/sec)")
+    if errors:
+        click.echo(f"Skipped {errors} invalid line(s)")
+
+def _retire_metrics(ctx):
+    """Hand this short-lived process's enqueue counts and storage timings
+    to the metrics store, since no publisher runs here"""
+    from queuectl.core.metrics import MetricsStore
+
+    if not ctx.obj['config'].get("metrics_enabled"):
+        return
+    try:
+        MetricsStore(ctx.obj['storage'].storage_path).retire()
+    except Exception as e:
+        click.echo(f"Failed to record metrics: {e}", err=True)
+
+def _check_argv(command, shell):
+    if not shell:
+        try:
+            build_argv(command, shell=False)
+        except ValueError as e:
+            raise click.BadParameter(f"cannot split command without a shell: {e}", param_hint="'COMMAND'")
+
+def _set_limit(queue, key, concurrency, rate):
+    try:
+        if not queue.set_limit(key, concurrency, rate):
+            raise click.ClickException(f"Failed to save the limits of {key!r}")
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'--rate'")
+
+def _parse_task_args(value):
+    if value is None:
+        return None
+    try:
+        args = json.loads(value)
+    except ValueError as e:
+        raise click.BadParameter(f"not valid JSON: {e}", param_hint="'--args'")
+    if not isinstance(args, (list, dict)):
+        raise click.BadParameter("must be a JSON array or object", param_hint="'--args'")
+    return args
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def _format_bytes(size: int) -> str:
+    for unit in ("B", "K", "M", "G"):
+        if size < 1024 or unit == "G":
+            return f"{size}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+def _parse_queues(ctx, param, value):
+    """'high:3,default' -> (['high', 'default'], {'high': 3})"""
+    if not value:
+        return None, None
+    names, weights = [], {}
+    for part in value.split(','):
+        name, _, weight = part.strip().partition(':')
+        if not name:
+            raise click.BadParameter(f"empty queue name in {value!r}")
+        if weight:
+            if not weight.isdigit() or int(weight) < 1:
+                raise click.BadParameter(f"weight for {name!r} must be a positive integer")
+            weights[name] = int(weight)
+        names.append(name)
+    return names, weights
+
 @cli.command()
-@click.option('--count', default=1, help='Number of workers to start')
+@click.option('--count', default=1, help='Number of workers to start (per process with --processes)')
+@click.option('--processes', default=0, help='Run workers in N supervised child processes')
 @click.option('--timeout', type=int, help='Auto-stop after N seconds (optional)')
+@click.option('--batch-size', default=1, help='Jobs each worker claims per storage transaction')
+@click.option('--concurrency', default=0, help='Run each worker on asyncio with up to N jobs in flight')
+@click.option('--queues', callback=_parse_queues,
+              help='Queues to work on, optionally weighted (e.g. "high:3,default"); default all')
+@click.option('--gc-interval', type=float, help='Archive expired finished jobs every N seconds')
+@click.option('--executor', type=click.Choice(EXECUTORS),
+              help='How jobs are launched (default: the "executor" config key, else subprocess)')
+@click.option('--metrics-port', type=click.IntRange(0, 65535),
+              help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
 @click.pass_context
-def start(ctx, count, timeout):
+def start(ctx, count, processes, timeout, batch_size, concurrency, queues, gc_interval, executor, metrics_port):
     """Start worker processes"""
-    ctx.obj['worker_manager'] = WorkerManager(ctx.obj['queue'])
-    ctx.obj['worker_manager'].start_workers(count)
+    queue_names, weights = queues
+    ctx.obj['worker_manager'] = WorkerManager(ctx.obj['queue'], executor=executor)
+    ctx.obj['worker_manager'].start_metrics(metrics_port)
+    if metrics_port is not None and ctx.obj['worker_manager'].metrics:
+        click.echo(f"Metrics at http://127.0.0.1:{ctx.obj['worker_manager'].metrics.port}/metrics")
+    if processes:
+        ctx.obj['worker_manager'].start_processes(processes, workers_per_process=count,
+                                                  batch_size=batch_size, concurrency=concurrency,
+                                                  queues=queue_names, weights=weights)
+        count *= processes
+    else:
+        ctx.obj['worker_manager'].start_workers(count, batch_size=batch_size, concurrency=concurrency,
+                                                queues=queue_names, weights=weights)
+    ctx.obj['worker_manager'].start_scheduler()
+    ctx.obj['worker_manager'].start_reaper()
+    if gc_interval:
+        ctx.obj['worker_manager'].start_sweeper(gc_interval)
+
+    # Ctrl+C and SIGTERM both stop the workers (and any child processes) cleanly
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
     
     if timeout:
         click.echo(f"Started {count} worker(s) for {timeout} seconds")
@@ -83,6 +285,14 @@ def start(ctx, count, timeout):
             ctx.obj['worker_manager'].stop_workers()
             click.echo("Returning to command prompt...")
 
+    if processes:
+        stats = ctx.obj['worker_manager'].get_worker_stats()
+        table_data = [[s['worker_id'], s['pid'], s['processed'], s['failed'], s['restarts'],
+                       s['spawn_avg_ms'], s['spawn_max_ms']] for s in stats]
+        table_data.append(["total", "", sum(s['processed'] for s in stats), sum(s['failed'] for s in stats), "", "", ""])
+        click.echo(tabulate(table_data, headers=["Worker", "PID", "Processed", "Failed", "Restarts",
+                                                 "Spawn avg ms", "Spawn max ms"], tablefmt="simple"))
+
 @cli.command()
 @click.pass_context
 def stop(ctx):
@@ -94,16 +304,26 @@ def stop(ctx):
         click.echo("No workers running")
 
 @cli.command()
+@click.option('--recount', is_flag=True, help='Rebuild the state counters from the job records')
 @click.pass_context  
-def status(ctx):
+def status(ctx, recount):
     """Show system status"""
     stats = ctx.obj['queue'].get_stats()
+    if recount:
+        counted = ctx.obj['queue'].get_stats(recount=True)
+        drift = [f"{key} {stats[key]} -> {counted[key]}" for key in counted if stats.get(key) != counted[key]]
+        if drift:
+            click.echo(f"Counters corrected: {', '.join(drift)}")
+        else:
+            click.echo("Counters verified")
+        stats = counted
     
     click.echo("QueueCTL System Status")
     click.echo("=" * 40)
     
     table_data = [
         ["Pending", stats["pending"]],
+        ["Blocked", stats["blocked"]],
         ["Processing", stats["processing"]],
         ["Completed", stats["completed"]],
         ["Failed", stats["failed"]],
@@ -111,6 +331,28 @@ def status(ctx):
         ["Total", stats["total_jobs"]]
     ]
     click.echo(tabulate(table_data, tablefmt="simple"))
+
+    queue_stats = ctx.obj['queue'].get_queue_stats()
+    if queue_stats:
+        now = time.time()
+        queue_rows = [
+            [name, entry["pending"], f"{now - entry['oldest_created_at']:.0f}s"]
+            for name, entry in sorted(queue_stats.items())
+        ]
+        click.echo("")
+        click.echo(tabulate(queue_rows, headers=["Queue", "Pending", "Oldest"], tablefmt="simple"))
+
+    limits = ctx.obj['queue'].get_limit_stats()
+    if limits:
+        click.echo("")
+        click.echo(_limit_table(limits))
+
+    cache = ctx.obj['queue'].get_cache_stats()
+    if cache["hits"] or cache["misses"] or cache["entries"]:
+        lookups = cache["hits"] + cache["misses"]
+        hit_rate = f"{cache['hits'] / lookups:.0%}" if lookups else "-"
+        click.echo(f"\nResult cache: {cache['entries']} entries, {cache['hits']} hits, "
+                   f"{cache['misses']} misses ({hit_rate} hit rate), {cache['evictions']} evictions")
     
     if ctx.obj['worker_manager']:
         worker_stats = ctx.obj['worker_manager'].get_worker_stats()
@@ -125,7 +367,7 @@ def status(ctx):
         click.echo("\nNo worker manager running")
 
 @cli.command(name='list')
-@click.option('--state', type=click.Choice(['pending', 'processing', 'completed', 'failed', 'dead']))
+@click.option('--state', type=click.Choice(['pending', 'blocked', 'processing', 'completed', 'failed', 'dead']))
 @click.option('--limit', default=10, help='Limit number of jobs to show')
 @click.pass_context
 def list_jobs(ctx, state, limit):
@@ -133,13 +375,12 @@ def list_jobs(ctx, state, limit):
     try:
         from queuectl.core.job import JobState
         
-        all_jobs = ctx.obj['queue'].storage.get_all_jobs()
+        storage = ctx.obj['queue'].storage
         
-        # BUG FIX: Use consistent variable name
         if state:
-            job_list = [job for job in all_jobs.values() if job.state.value == state]
+            job_list = storage.get_jobs_by_state(JobState(state), lazy=True)
         else:
-            job_list = list(all_jobs.values())
+            job_list = list(storage.get_all_jobs(lazy=True).values())
         
         job_list.sort(key=lambda x: x.created_at, reverse=True)
         job_list = job_list[:limit]
@@ -160,16 +401,401 @@ def list_jobs(ctx, state, limit):
                 str(job.id)[:8],
                 command_display,
                 str(job.state.value),
+                job.queue,
                 job.attempts,
                 job.max_retries,
+                f"{_format_bytes(job.output_bytes)}/{_format_bytes(job.error_bytes)}",
+                format_timestamp(job.created_at),
             ])
         
-        headers = ["ID", "Command", "State", "Attempts", "Max Retries"]
+        headers = ["ID", "Command", "State", "Queue", "Attempts", "Max Retries", "Out/Err", "Created (UTC)"]
         click.echo(tabulate(table_data, headers=headers, tablefmt="simple"))
         
     except Exception as e:
         click.echo(f"Error listing jobs: {e}")
 
+@cli.command()
+@click.argument('job_id')
+@click.option('--tail', type=int, help='Only show the last N lines')
+@click.option('--stderr', is_flag=True, help='Show stderr instead of stdout')
+@click.pass_context
+def logs(ctx, job_id, tail, stderr):
+    """Show the captured output of a job"""
+    queue = ctx.obj['queue']
+    job = queue.storage.get_job(job_id)
+    if not job:
+        click.echo(f"Job {job_id} not found")
+        return
+
+    ref = job.error_ref if stderr else job.output_ref
+    out = click.get_binary_stream('stdout')
+    if ref is None:
+        # Jobs finished before output moved to the blob store keep it inline
+        inline = job.last_error if stderr else job.output
+        if inline:
+            lines = inline.splitlines(keepends=True)
+            click.echo(''.join(lines[-tail:] if tail else lines), nl=False)
+        return
+
+    try:
+        if tail is not None:
+            out.write(queue.blobs.tail(ref, tail))
+        else:
+            with queue.blobs.open(ref) as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    out.write(chunk)
+        out.flush()
+    except FileNotFoundError:
+        click.echo(f"Output for job {job_id} is no longer available")
+        return
+
+    size = job.error_bytes if stderr else job.output_bytes
+    limit = queue.blobs.max_bytes
+    if limit is not None and size > limit:
+        click.echo(f"[output truncated: kept last {limit} of {size} bytes]", err=True)
+
+@cli.group()
+def schedule():
+    """Manage recurring jobs"""
+    pass
+
+@schedule.command(name='add')
+@click.argument('cron')
+@click.argument('command')
+@click.option('--max-retries', default=3, help='Maximum retry attempts')
+@click.option('--timeout', default=30, help='Job timeout in seconds')
+@click.option('--queue', 'queue_name', default='default', help='Named queue to put the jobs on')
+@click.option('--priority', default=0, help='Higher runs first within its queue')
+@click.option('--shell/--no-shell', default=True, help='Run through /bin/sh, or exec the split command directly')
+@click.pass_context
+def schedule_add(ctx, cron, command, max_retries, timeout, queue_name, priority, shell):
+    """Run COMMAND on a cron schedule, e.g. "*/5 * * * *" (needs running workers)"""
+    from queuectl.core.schedule import ScheduleRegistry
+
+    _check_argv(command, shell)
+    try:
+        entry = ScheduleRegistry(ctx.obj['storage'].storage_path).add(
+            cron, command, max_retries=max_retries, timeout=timeout, queue=queue_name, priority=priority,
+            shell=shell
+        )
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'CRON'")
+    click.echo(f"Schedule {entry['id']} added; next run at {format_timestamp(entry['next_run_at'])} UTC")
+
+@schedule.command(name='list')
+@click.pass_context
+def schedule_list(ctx):
+    """List recurring jobs"""
+    from queuectl.core.schedule import ScheduleRegistry
+
+    schedules = ScheduleRegistry(ctx.obj['storage'].storage_path).load()
+    if not schedules:
+        click.echo("No schedules")
+        return
+
+    table_data = [
+        [entry['id'], entry['cron'], entry['command'][:30],
+         format_timestamp(entry['next_run_at']), format_timestamp(entry['last_run_at'])]
+        for entry in sorted(schedules.values(), key=lambda entry: entry['next_run_at'])
+    ]
+    click.echo(tabulate(table_data, headers=["ID", "Cron", "Command", "Next Run (UTC)", "Last Run (UTC)"],
+                        tablefmt="simple"))
+
+@schedule.command(name='remove')
+@click.argument('schedule_id')
+@click.pass_context
+def schedule_remove(ctx, schedule_id):
+    """Delete a recurring job"""
+    from queuectl.core.schedule import ScheduleRegistry
+
+    if ScheduleRegistry(ctx.obj['storage'].storage_path).remove(schedule_id):
+        click.echo(f"Schedule {schedule_id} removed")
+    else:
+        click.echo(f"Schedule {schedule_id} not found")
+
+@cli.group()
+def dag():
+    """Submit groups of dependent jobs"""
+    pass
+
+@dag.command(name='submit')
+@click.argument('source', type=click.File('r'), default='-')
+@click.pass_context
+def dag_submit(ctx, source):
+    """Enqueue a DAG from a JSON file (or stdin) mapping job names to specs.
+
+    Each spec is an enqueue-batch spec whose "after" lists the names of the
+    jobs it waits for, e.g. {"build": "make", "test": {"command": "make
+    test", "after": ["build"]}}.
+    """
+    queue = ctx.obj['queue']
+    try:
+        specs = json.load(source)
+        if not isinstance(specs, dict) or not specs:
+            raise ValueError("expected a JSON object mapping job names to specs")
+        specs = {name: spec if isinstance(spec, dict) else {"command": spec} for name, spec in specs.items()}
+        for name, spec in specs.items():
+            after = spec.get("after", [])
+            if not isinstance(after, list):
+                raise ValueError(f"'{name}': 'after' must be a list of job names")
+
+        ids, jobs = {}, []
+        # Parents are built first, so each job can name its parents' ids
+        for name in order_dag({name: spec.get("after", []) for name, spec in specs.items()}):
+            spec = dict(specs[name])
+            if spec.get("after"):
+                spec["after"] = [ids[parent] for parent in spec["after"]]
+            try:
+                job = queue.build_job(spec)
+            except ValueError as e:
+                raise ValueError(f"'{name}': {e}")
+            ids[name] = job.id
+            jobs.append(job)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'SOURCE'")
+
+    # One batch, so no job can run before its whole graph is stored
+    count = queue.enqueue_many(jobs, batch_size=len(jobs))
+    _retire_metrics(ctx)
+    if count != len(jobs):
+        raise click.ClickException(f"Failed to enqueue the DAG ({count} of {len(jobs)} jobs stored)")
+    click.echo(tabulate([[name, job_id] for name, job_id in ids.items()], headers=["Name", "ID"],
+                        tablefmt="simple"))
+
+@cli.group()
+def limit():
+    """Manage per-key concurrency and rate limits"""
+    pass
+
+@limit.command(name='set')
+@click.argument('key')
+@click.option('--concurrency', type=click.IntRange(min=1), help='Most jobs of KEY running at once')
+@click.option('--rate', help='Most job starts of KEY per period, e.g. 50/m or 5/10s')
+@click.pass_context
+def limit_set(ctx, key, concurrency, rate):
+    """Limit the jobs enqueued with --concurrency-key KEY"""
+    if concurrency is None and rate is None:
+        raise click.UsageError("give --concurrency, --rate or both")
+    _set_limit(ctx.obj['queue'], key, concurrency, rate)
+    click.echo(f"Limits for {key} set")
+
+@limit.command(name='list')
+@click.pass_context
+def limit_list(ctx):
+    """Show limits, running jobs and how often each key was throttled"""
+    limits = ctx.obj['queue'].get_limit_stats()
+    if not limits:
+        click.echo("No limits")
+        return
+    click.echo(_limit_table(limits))
+
+@limit.command(name='remove')
+@click.argument('key')
+@click.pass_context
+def limit_remove(ctx, key):
+    """Lift the limits of KEY"""
+    if ctx.obj['queue'].remove_limit(key):
+        click.echo(f"Limits for {key} removed")
+    else:
+        click.echo(f"No limits for {key}")
+
+def _limit_table(limits):
+    rows = [
+        [key, entry["running"], entry.get("concurrency") or "-", entry.get("rate") or "-",
+         "-" if entry["tokens"] is None else f"{entry['tokens']:.1f}",
+         entry.get("throttled_concurrency", 0), entry.get("throttled_rate", 0)]
+        for key, entry in sorted(limits.items())
+    ]
+    return tabulate(rows, headers=["Key", "Running", "Limit", "Rate", "Tokens", "Throttled (conc.)",
+                                   "Throttled (rate)"], tablefmt="simple")
+
+@cli.command()
+@click.option('--dry-run', is_flag=True, help='Only report what would be archived')
+@click.pass_context
+def gc(ctx, dry_run):
+    """Archive finished jobs that fall outside the retention policy"""
+    from queuectl.core.retention import RetentionPolicy
+
+    policy = RetentionPolicy.from_config(ctx.obj['config'])
+    if not policy.enabled:
+        click.echo("No retention policy configured (see retention.* config keys)")
+        return
+
+    expired = ctx.obj['queue'].collect_garbage(policy, dry_run=dry_run)
+    verb = "Would archive" if dry_run else "Archived"
+    click.echo(f"{verb} {len(expired)} job(s)")
+
+@cli.command()
+@click.option('--format', 'output_format', type=click.Choice(['table', 'prometheus', 'json']), default='table')
+@click.option('--reset', is_flag=True, help='Delete the recorded metrics')
+@click.pass_context
+def metrics(ctx, output_format, reset):
+    """Show counters and latency histograms recorded by the workers"""
+    from queuectl.core.metrics import MetricsStore, render_prometheus, quantile
+
+    store = MetricsStore(ctx.obj['storage'].storage_path)
+    if reset:
+        click.echo(f"Removed {store.clear()} metrics file(s)")
+        return
+    snapshot = store.load()
+    if output_format == 'prometheus':
+        click.echo(render_prometheus(snapshot), nl=False)
+        return
+    if output_format == 'json':
+        click.echo(json.dumps(snapshot, indent=2))
+        return
+    if not snapshot["counters"] and not snapshot["histograms"]:
+        click.echo("No metrics recorded yet (workers publish them while running)")
+        return
+
+    def labels(values):
+        return ",".join(f"{k}={v}" for k, v in sorted(values.items())) or "-"
+
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.2f}"
+
+    if snapshot["counters"]:
+        rows = [[name, labels(values), int(value) if value == int(value) else value]
+                for name, values, value in snapshot["counters"]]
+        click.echo(tabulate(rows, headers=["Counter", "Labels", "Value"], tablefmt="simple"))
+    if snapshot["histograms"]:
+        rows = [[name, labels(values), sum(counts), ms(total / sum(counts) if sum(counts) else None),
+                 ms(quantile(counts, 0.5)), ms(quantile(counts, 0.95)), ms(quantile(counts, 0.99))]
+                for name, values, counts, total in snapshot["histograms"]]
+        click.echo("")
+        click.echo(tabulate(rows, headers=["Histogram", "Labels", "Count", "Avg ms", "p50 ms", "p95 ms",
+                                           "p99 ms"], tablefmt="simple"))
+
+def _parse_list(ctx, param, value):
+    from queuectl.core.bench import parse_size
+
+    try:
+        parse = parse_size if param.name == 'sizes' else (int if param.name == 'workers' else str)
+        return [parse(item.strip()) for item in value.split(',') if item.strip()]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+@cli.command()
+@click.option('--backends', default=','.join(BACKENDS), callback=_parse_list, help='Comma-separated storage backends')
+@click.option('--sizes', default='1k', callback=_parse_list, help='Comma-separated queue sizes, e.g. 1k,10k,100k')
+@click.option('--workers', default='1,4', callback=_parse_list, help='Comma-separated worker counts')
+@click.option('--batch-size', default=100, help='Jobs per enqueue commit and per claim')
+@click.option('--latency-jobs', default=100, help='Jobs timed end to end per worker count (0 to skip)')
+@click.option('--latency-rate', default=100.0, help='Jobs/s enqueued during the end-to-end run (0 for a burst)')
+@click.option('--repeat', default=20, help='Samples of the status and list reads')
+@click.option('--output', help='Write the JSON results to this file ("-" for stdout)')
+@click.option('--baseline', type=click.File('r'), help='Compare against the JSON results of an earlier run')
+@click.option('--threshold', default=0.2, help='Relative change for the worse that counts as a regression')
+@click.pass_context
+def bench(ctx, backends, sizes, workers, batch_size, latency_jobs, latency_rate, repeat, output, baseline,
+          threshold):
+    """Measure queue throughput and latency on scratch storage"""
+    from queuectl.core.bench import BenchmarkSuite, compare
+
+    try:
+        suite = BenchmarkSuite(backends=backends, sizes=sizes, workers=workers, batch_size=batch_size,
+                               latency_jobs=latency_jobs, latency_rate=latency_rate, repeat=repeat)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'--backends'")
+    previous = json.load(baseline) if baseline else None
+
+    # Per-job log lines would swamp the output and skew the timings
+    root_logger = logging.getLogger()
+    level = root_logger.level
+    root_logger.setLevel(logging.WARNING)
+    try:
+        results = suite.run(progress=lambda case: click.echo(f"Benchmarking {case}...", err=True))
+    finally:
+        root_logger.setLevel(level)
+
+    if output == '-':
+        click.echo(json.dumps(results, indent=2))
+    else:
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+            click.echo(f"Wrote results to {output}", err=True)
+        rows = [[key, value["value"], value["unit"]] for key, value in results["results"].items()]
+        click.echo(tabulate(rows, headers=["Metric", "Value", "Unit"], tablefmt="simple"))
+
+    if previous is None:
+        return
+    try:
+        rows = compare(results, previous, threshold)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    regressions = [row for row in rows if row["regression"]]
+    err = output == '-'  # keep stdout pure JSON
+    click.echo("", err=err)
+    click.echo(tabulate([[row["metric"], row["baseline"], row["current"], f"{row['change']:+.1%}",
+                          "REGRESSION" if row["regression"] else ""] for row in rows],
+                        headers=["Metric", "Baseline", "Current", "Change", ""], tablefmt="simple"), err=err)
+    if regressions:
+        click.echo(f"{len(regressions)} metric(s) regressed by more than {threshold:.0%}", err=err)
+        ctx.exit(1)
+    click.echo(f"No regressions beyond {threshold:.0%}", err=err)
+
+@cli.command()
+@click.pass_context
+def reclaim(ctx):
+    """Reclaim jobs whose worker lease has expired"""
+    reclaimed = ctx.obj['queue'].reclaim_expired_leases()
+    for job in reclaimed:
+        click.echo(f"Reclaimed {job.id} ({job.state.value}, attempt {job.attempts})")
+    click.echo(f"Reclaimed {len(reclaimed)} job(s)")
+
+@cli.group()
+def archive():
+    """Browse archived jobs"""
+    pass
+
+@archive.command(name='list')
+@click.option('--day', help='Only this day (YYYY-MM-DD)')
+@click.option('--jobs', 'show_jobs', is_flag=True, help='List archived jobs instead of segments')
+@click.option('--limit', default=10, help='Limit number of jobs to show')
+@click.pass_context
+def archive_list(ctx, day, show_jobs, limit):
+    """List archive segments or archived jobs"""
+    job_archive = ctx.obj['queue'].archive
+    if show_jobs:
+        table_data = []
+        for job in job_archive.iter_jobs(day, newest_first=True):
+            table_data.append([job.id, job.command[:30], job.state.value, format_timestamp(job.finished_at)])
+            if len(table_data) >= limit:
+                break
+        if not table_data:
+            click.echo("No archived jobs found")
+            return
+        click.echo(tabulate(table_data, headers=["ID", "Command", "State", "Finished (UTC)"], tablefmt="simple"))
+        return
+
+    segments = job_archive.segments(day)
+    if not segments:
+        click.echo("No archive segments found")
+        return
+
+    table_data = [
+        [path.parent.name, path.name, job_archive.segment_count(path), path.stat().st_size]
+        for path in segments
+    ]
+    click.echo(tabulate(table_data, headers=["Day", "Segment", "Jobs", "Bytes"], tablefmt="simple"))
+
+@archive.command(name='show')
+@click.argument('job_id')
+@click.option('--day', help='Only search this day (YYYY-MM-DD)')
+@click.pass_context
+def archive_show(ctx, job_id, day):
+    """Show an archived job"""
+    job = ctx.obj['queue'].archive.find(job_id, day)
+    if not job:
+        click.echo(f"Job {job_id} not found in archive")
+        return
+
+    for key, value in job.to_dict().items():
+        if key.endswith("_at"):
+            value = format_timestamp(value)
+        click.echo(f"{key} = {value}")
+
 @cli.group()
 def dlq():
     """Manage Dead Letter Queue"""
@@ -241,6 +867,8 @@ def config(ctx, key, value, reset):
                 value = int(value)
             elif value.lower() in ('true', 'false'):
                 value = value.lower() == 'true'
+            else:
+                value = float(value)
         except:
             pass
         
@@ -255,5 +883,39 @@ def config(ctx, key, value, reset):
         for k, v in ctx.obj['config'].get_all().items():
             click.echo(f"{k} = {v}")
 
+@cli.command()
+@click.option('--to', 'backend', required=True, type=click.Choice(BACKENDS), help='Target storage backend')
+@click.pass_context
+def migrate(ctx, backend):
+    """Migrate jobs and locks to another storage backend"""
+    source = ctx.obj['storage']
+    if source.backend_name == backend:
+        click.echo(f"Storage already uses the {backend} backend")
+        return
+
+    target = open_storage(str(source.storage_path), backend=backend)
+    try:
+        count = migrate_storage(source, target)
+    except Exception as e:
+        click.echo(f"Migration failed: {e}")
+        return
+
+    config = source.load_config()
+    config['storage_backend'] = backend
+    target.save_config(config)
+    click.echo(f"Migrated {count} job(s) to the {backend} backend")
+
+@cli.command()
+@click.pass_context
+def compact(ctx):
+    """Fold the storage journal into a fresh snapshot"""
+    storage = ctx.obj['storage']
+    if not hasattr(storage, 'compact'):
+        click.echo(f"The {storage.backend_name} backend has no journal to compact")
+        return
+
+    generation = storage.compact()
+    click.echo(f"Journal compacted (generation {generation})")
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
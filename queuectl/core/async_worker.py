@@ -0,0 +1,313 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple, Union
+from .job import Job, TASK
+from .queue import JobQueue
+from .capture import StreamCapture, READ_CHUNK, kill_group
+from .executor import SpawnStats, build_argv
+from .tasks import TaskPool, TaskError, TaskTimeout
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Fallback poll interval while idle or saturated; enqueues wake workers sooner
+IDLE_POLL_SECONDS = 1.0
+# How long finished jobs may wait before their results are written together
+FLUSH_INTERVAL = 0.05
+
+
+class AsyncJobWorker:
+    """Worker that keeps up to ``concurrency`` subprocess jobs in flight.
+
+    Jobs run under one event loop with ``asyncio.create_subprocess_shell``;
+    storage calls go through a single helper thread so claims and results
+    are written in batches rather than once per job.
+    """
+
+    def __init__(self, worker_id: str, queue: JobQueue, concurrency: int = 100,
+                 batch_size: Optional[int] = None, queues: Optional[List[str]] = None,
+                 weights: Optional[Dict[str, int]] = None, launcher=None,
+                 tasks: Optional[TaskPool] = None):
+        self.worker_id = worker_id
+        # None runs jobs with asyncio's own subprocess support
+        self.launcher = launcher
+        self._own_tasks = tasks is None
+        self.tasks = tasks or TaskPool(1)
+        self.spawn_stats = SpawnStats()
+        self.queue = queue
+        self.queues = queues
+        self.weights = weights
+        self.concurrency = max(concurrency, 1)
+        self.batch_size = max(batch_size or self.concurrency, 1)
+        self.running = False
+        self.processed_count = 0
+        self.failed_count = 0
+        self._in_flight: Set[asyncio.Task] = set()
+        # Ids of claimed jobs whose results are not saved yet; their leases need renewing
+        self._held: Set[str] = set()
+        # (job, completed?, error, stderr, stdout) waiting to be written;
+        # task jobs carry plain text instead of captures
+        self._results: List[Tuple[Job, bool, Optional[str], Union[StreamCapture, str, None],
+                                  Union[StreamCapture, str, None]]] = []
+
+    def start(self):
+        self.running = True
+        logger.info(f"Worker {self.worker_id} started (concurrency {self.concurrency})")
+        asyncio.run(self._run())
+        if self._own_tasks:
+            self.tasks.close()
+        logger.info(f"Worker {self.worker_id} stopped")
+
+    def stop(self):
+        self.running = False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        wakeup = self.queue.notifier.listen()
+        woken = asyncio.Event()
+        if wakeup:
+            loop.add_reader(wakeup.fileno(), self._on_wakeup, wakeup, woken)
+        try:
+            await self._loop(loop, woken)
+        finally:
+            if wakeup:
+                loop.remove_reader(wakeup.fileno())
+                wakeup.close()
+
+    @staticmethod
+    def _on_wakeup(wakeup, woken: asyncio.Event):
+        wakeup.drain()
+        woken.set()
+
+    async def _loop(self, loop, woken: asyncio.Event):
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.worker_id) as storage_thread:
+            last_flush = last_heartbeat = time.monotonic()
+            while self.running:
+                free = self.concurrency - len(self._in_flight)
+                claimed = []
+                woken.clear()
+                if free > 0:
+                    try:
+                        claimed = await loop.run_in_executor(
+                            storage_thread, self.queue.claim_batch, self.worker_id,
+                            min(free, self.batch_size), self.queues, self.weights)
+                    except Exception as e:
+                        logger.error(f"Worker {self.worker_id} error: {e}")
+                for job in claimed:
+                    self._held.add(job.id)
+                    task = asyncio.create_task(self._run_job(job))
+                    self._in_flight.add(task)
+                    task.add_done_callback(functools.partial(self._job_done, job.id))
+
+                if self._results and time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    await self._flush(loop, storage_thread)
+                    last_flush = time.monotonic()
+
+                if self._held and time.monotonic() - last_heartbeat >= self.queue.lease_seconds / 3:
+                    await self._heartbeat(loop, storage_thread)
+                    last_heartbeat = time.monotonic()
+
+                if claimed and len(self._in_flight) < self.concurrency:
+                    continue  # there may be more work waiting
+                waiters = set(self._in_flight)
+                if len(self._in_flight) < self.concurrency:
+                    waiters.add(asyncio.ensure_future(woken.wait()))
+                timeout = FLUSH_INTERVAL if self._results else IDLE_POLL_SECONDS
+                if self._held:
+                    timeout = min(timeout, max(last_heartbeat + self.queue.lease_seconds / 3 - time.monotonic(), 0))
+                _, pending = await asyncio.wait(waiters, timeout=timeout,
+                                                return_when=asyncio.FIRST_COMPLETED)
+                for waiter in pending - self._in_flight:
+                    waiter.cancel()
+
+            # Let running jobs finish, as the threaded worker does, with the
+            # heartbeat going so a long job is not reclaimed and run twice
+            while self._in_flight:
+                timeout = max(last_heartbeat + self.queue.lease_seconds / 3 - time.monotonic(), 0)
+                await asyncio.wait(set(self._in_flight), timeout=timeout)
+                if self._in_flight and time.monotonic() - last_heartbeat >= self.queue.lease_seconds / 3:
+                    await self._flush(loop, storage_thread)
+                    await self._heartbeat(loop, storage_thread)
+                    last_heartbeat = time.monotonic()
+            await self._flush(loop, storage_thread)
+
+    def _job_done(self, job_id: str, task: asyncio.Task):
+        self._in_flight.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # No result was queued; stop renewing so the reaper takes it back
+            self._held.discard(job_id)
+            logger.error(f"Worker {self.worker_id} lost job {job_id}: {task.exception()}")
+
+    async def _heartbeat(self, loop, storage_thread):
+        """Renew the leases on claimed jobs whose results are not saved yet"""
+        if not self._held:
+            return
+        try:
+            await loop.run_in_executor(storage_thread, self.queue.renew_leases, self.worker_id, list(self._held))
+        except Exception as e:
+            logger.error(f"Worker {self.worker_id} heartbeat failed: {e}")
+
+    async def _flush(self, loop, storage_thread):
+        results, self._results = self._results, []
+        if results:
+            try:
+                await loop.run_in_executor(storage_thread, self._record_results, results)
+            finally:
+                self._held.difference_update(result[0].id for result in results)
+
+    def _record_results(self, results):
+        jobs = []
+        for job, completed, error, stderr, stdout in results:
+            try:
+                if completed:
+                    self.queue.prepare_completion(job, stdout, stderr)
+                else:
+                    self.queue.prepare_failure(job, error, stderr, stdout)
+                jobs.append(job)
+            except Exception as e:
+                logger.error(f"Failed to record result of job {job.id}: {e}")
+        if jobs and not self.queue.finish_jobs(jobs):
+            logger.error(f"Worker {self.worker_id} could not save {len(jobs)} results")
+
+    async def _run_job(self, job: Job):
+        logger.info(f"Worker {self.worker_id} processing job {job.id}: {job.command}")
+        if job.kind == TASK:
+            await self._run_task(job)
+            return
+        start_time = time.time()
+        stdout = stderr = None
+        try:
+            stdout, stderr = self.queue.open_capture(job)
+            argv = build_argv(job.command, job.shell)
+            if self.launcher:
+                pid, streams, exited, transports = await self._spawn_with_launcher(argv)
+            else:
+                started = time.perf_counter()
+                # Own process group, so a timeout kills the shell's children too
+                process = await asyncio.create_subprocess_exec(
+                    *argv,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True
+                )
+                self.spawn_stats.record(time.perf_counter() - started)
+                pid, streams, exited, transports = process.pid, (process.stdout, process.stderr), process.wait, ()
+            try:
+                _, _, returncode = await asyncio.wait_for(asyncio.gather(
+                    self._pump(streams[0], stdout),
+                    self._pump(streams[1], stderr),
+                    exited()
+                ), timeout=job.timeout)
+            except asyncio.TimeoutError:
+                kill_group(pid)
+                await exited()
+                METRICS.observe("job_run_seconds", time.time() - start_time, queue=job.queue, outcome="timeout")
+                self._results.append((job, False, f"Timeout after {job.timeout}s", stderr, stdout))
+                self.failed_count += 1
+                logger.error(f"Job {job.id} timeout")
+                return
+            finally:
+                for transport in transports:
+                    transport.close()
+
+            METRICS.observe("job_run_seconds", time.time() - start_time, queue=job.queue,
+                            outcome="completed" if returncode == 0 else "failed")
+            if returncode == 0:
+                self._results.append((job, True, None, stderr, stdout))
+                self.processed_count += 1
+                logger.info(f"Job {job.id} completed in {time.time() - start_time:.2f}s")
+            else:
+                error_msg = f"Exit code {returncode}"
+                self._results.append((job, False, error_msg, stderr, stdout))
+                self.failed_count += 1
+                logger.warning(f"Job {job.id} failed: {error_msg}")
+
+        except Exception as e:
+            error_msg = f"System error: {str(e)}"
+            if stdout is not None:
+                stdout.discard()
+                stderr.discard()
+            self._results.append((job, False, error_msg, None, None))
+            self.failed_count += 1
+            logger.error(f"Job {job.id} system error: {error_msg}")
+
+    async def _run_task(self, job: Job):
+        start_time = time.time()
+        try:
+            # Blocks on a pool process, so it runs on the loop's default executor
+            output = await asyncio.get_running_loop().run_in_executor(
+                None, self.tasks.run, job.command, job.args, job.timeout)
+            METRICS.observe("job_run_seconds", time.time() - start_time, queue=job.queue, outcome="completed")
+            self._results.append((job, True, None, None, output))
+            self.processed_count += 1
+            logger.info(f"Job {job.id} completed in {time.time() - start_time:.2f}s")
+        except TaskTimeout:
+            METRICS.observe("job_run_seconds", time.time() - start_time, queue=job.queue, outcome="timeout")
+            self._results.append((job, False, f"Timeout after {job.timeout}s", None, None))
+            self.failed_count += 1
+            logger.error(f"Job {job.id} timeout")
+        except TaskError as e:
+            METRICS.observe("job_run_seconds", time.time() - start_time, queue=job.queue, outcome="failed")
+            error_msg = f"Task error: {e}"
+            self._results.append((job, False, error_msg, e.traceback, None))
+            self.failed_count += 1
+            logger.warning(f"Job {job.id} failed: {error_msg}")
+        except Exception as e:
+            error_msg = f"System error: {str(e)}"
+            self._results.append((job, False, error_msg, None, None))
+            self.failed_count += 1
+            logger.error(f"Job {job.id} system error: {error_msg}")
+
+    async def _spawn_with_launcher(self, argv):
+        """Start a job through ``self.launcher`` and attach its pipes to the loop"""
+        loop = asyncio.get_running_loop()
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        try:
+            started = time.perf_counter()
+            process = self.launcher.spawn(argv, stdout_w, stderr_w)
+            self.spawn_stats.record(time.perf_counter() - started)
+        except BaseException:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            raise
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+
+        streams, transports = [], []
+        for fd in (stdout_r, stderr_r):
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", buffering=0))
+            streams.append(reader)
+            transports.append(transport)
+
+        def exited():
+            # Shielded: a timeout must not cancel the future the fork server resolves
+            return asyncio.shield(asyncio.wrap_future(process.exit_future))
+        return process.pid, streams, exited, transports
+
+    @staticmethod
+    async def _pump(stream: asyncio.StreamReader, capture: StreamCapture):
+        while True:
+            data = await stream.read(READ_CHUNK)
+            if not data:
+                return
+            capture.write(data)
+
+    def get_stats(self) -> Dict:
+        return {
+            "worker_id": self.worker_id,
+            "processed": self.processed_count,
+            "failed": self.failed_count,
+            "current_job": None,
+            "in_flight": len(self._in_flight),
+            "running": self.running,
+            **self.spawn_stats.as_dict()
+        }
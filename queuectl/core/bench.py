@@ -0,0 +1,250 @@
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+from .job import JobState
+from .queue import JobQueue
+from .storage import BACKENDS, open_storage
+
+logger = logging.getLogger(__name__)
+
+# Bump when the meaning of a metric changes, so old baselines are not compared
+BENCH_VERSION = 1
+
+# Queue sizes may be written as 1k, 10k, 1m
+SIZE_SUFFIXES = {"k": 1000, "m": 1000000}
+
+# How long the end-to-end run may take before the missing jobs count as lost
+LATENCY_TIMEOUT = 120.0
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    multiplier = SIZE_SUFFIXES.get(text[-1:], 1)
+    digits = text[:-1] if text[-1:] in SIZE_SUFFIXES else text
+    if not digits.isdigit() or int(digits) < 1:
+        raise ValueError(f"queue size must look like 1000 or 10k, got {text!r}")
+    return int(digits) * multiplier
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max of ``values`` (seconds) in milliseconds, nearest rank"""
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+
+    def rank(q: float) -> float:
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000
+
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99), "max": ordered[-1] * 1000}
+
+
+class BenchmarkSuite:
+    """Throughput and latency of the queue over each storage backend.
+
+    Every case runs against a fresh storage directory under ``work_dir``
+    with deterministic job specs, and records:
+
+    - ``enqueue_rate``: jobs/s through ``enqueue_many`` (one commit per
+      ``batch_size`` jobs), and ``enqueue_single_rate`` through
+      ``enqueue``, one commit per job;
+    - ``status_ms`` and ``list_ms``: what the ``status`` and ``list``
+      commands read, from a freshly opened storage as a new CLI process
+      would, with the queue full;
+    - ``claim_complete_rate``: jobs/s drained by N threads that claim
+      ``batch_size`` jobs at a time and complete them without running
+      anything, i.e. the queue's own overhead;
+    - ``e2e_ms``: enqueue-to-completion percentiles of ``latency_jobs``
+      ``true`` commands run by N real workers, enqueued at
+      ``latency_rate`` jobs/s.
+
+    Results are flat: ``"<backend>/<size>/<metric>"`` (with ``/w<N>`` for
+    per-worker metrics) maps to a value, its unit and which direction is
+    better, so runs can be compared key by key.
+    """
+
+    def __init__(self, backends: Optional[List[str]] = None, sizes: Optional[List[int]] = None,
+                 workers: Optional[List[int]] = None, batch_size: int = 100, latency_jobs: int = 100,
+                 latency_rate: float = 100.0, repeat: int = 20, work_dir: Optional[str] = None):
+        self.backends = list(backends or BACKENDS)
+        for backend in self.backends:
+            if backend not in BACKENDS:
+                raise ValueError(f"unknown backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+        self.sizes = list(sizes or [1000])
+        self.workers = list(workers or [1, 4])
+        self.batch_size = max(batch_size, 1)
+        self.latency_jobs = latency_jobs
+        self.latency_rate = latency_rate
+        self.repeat = max(repeat, 1)
+        self.work_dir = work_dir
+        self.results: Dict[str, Dict] = {}
+
+    def params(self) -> Dict:
+        return {"backends": self.backends, "sizes": self.sizes, "workers": self.workers,
+                "batch_size": self.batch_size, "latency_jobs": self.latency_jobs,
+                "latency_rate": self.latency_rate, "repeat": self.repeat}
+
+    def _record(self, key: str, value: float, unit: str, better: str):
+        self.results[key] = {"value": round(value, 3), "unit": unit, "better": better}
+        logger.info(f"bench {key} = {value:.3f} {unit}")
+
+    def run(self, progress=None) -> Dict:
+        """Run every case and return the results document"""
+        root = tempfile.mkdtemp(prefix="queuectl-bench-", dir=self.work_dir)
+        started_at = time.time()
+        try:
+            for backend in self.backends:
+                for size in self.sizes:
+                    if progress:
+                        progress(f"{backend}, {size} jobs")
+                    self._run_case(os.path.join(root, f"{backend}-{size}"), backend, size)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        return {
+            "version": BENCH_VERSION,
+            "started_at": started_at,
+            "duration": round(time.time() - started_at, 3),
+            "environment": {
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "params": self.params(),
+            "results": self.results,
+        }
+
+    def _open(self, path: str, backend: str) -> JobQueue:
+        return JobQueue(open_storage(path, backend=backend))
+
+    @staticmethod
+    def _specs(size: int) -> List[Dict]:
+        return [{"command": f"echo {i}", "queue": ("default", "high")[i % 2], "priority": i % 3}
+                for i in range(size)]
+
+    def _run_case(self, path: str, backend: str, size: int):
+        prefix = f"{backend}/{size}"
+        os.makedirs(path)
+
+        queue = self._open(os.path.join(path, "enqueue"), backend)
+        started = time.perf_counter()
+        queue.enqueue_many(self._specs(size), batch_size=self.batch_size)
+        self._record(f"{prefix}/enqueue_rate", size / (time.perf_counter() - started), "jobs/s", "higher")
+
+        singles = min(size, 500)
+        single_queue = self._open(os.path.join(path, "single"), backend)
+        started = time.perf_counter()
+        for i in range(singles):
+            single_queue.enqueue(f"echo {i}")
+        self._record(f"{prefix}/enqueue_single_rate", singles / (time.perf_counter() - started), "jobs/s", "higher")
+
+        self._time_reads(prefix, os.path.join(path, "enqueue"), backend)
+
+        for position, count in enumerate(self.workers):
+            # The first drain takes the jobs enqueued above; the others refill
+            drain_queue = queue
+            if position:
+                drain_queue = self._open(os.path.join(path, f"drain-{position}"), backend)
+                drain_queue.enqueue_many(self._specs(size), batch_size=1000)
+            rate = self._drain(drain_queue, count, size)
+            self._record(f"{prefix}/claim_complete_rate/w{count}", rate, "jobs/s", "higher")
+
+            if not self.latency_jobs:
+                continue
+            latencies = self._end_to_end(os.path.join(path, f"e2e-{position}"), backend, count)
+            for name, value in percentiles(latencies).items():
+                self._record(f"{prefix}/e2e_{name}_ms/w{count}", value, "ms", "lower")
+
+    def _time_reads(self, prefix: str, path: str, backend: str):
+        status, listing = [], []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            queue = self._open(path, backend)
+            queue.get_stats()
+            queue.get_queue_stats()
+            queue.get_limit_stats()
+            queue.get_cache_stats()
+            status.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            jobs = self._open(path, backend).storage.get_jobs_by_state(JobState.PENDING, lazy=True)
+            jobs.sort(key=lambda job: job.created_at, reverse=True)
+            listing.append(time.perf_counter() - started)
+
+        for name, timings in (("status", status), ("list", listing)):
+            for stat, value in percentiles(timings).items():
+                if stat in ("p50", "p95"):
+                    self._record(f"{prefix}/{name}_{stat}_ms", value, "ms", "lower")
+
+    def _drain(self, queue: JobQueue, count: int, size: int) -> float:
+        """Claim and complete every job with ``count`` threads; returns jobs/s"""
+        done = [0] * count
+
+        def work(index: int):
+            while True:
+                jobs = queue.claim_batch(f"bench-{index}", self.batch_size)
+                if not jobs:
+                    return
+                for job in jobs:
+                    queue.prepare_completion(job)
+                queue.finish_jobs(jobs)
+                done[index] += len(jobs)
+
+        threads = [threading.Thread(target=work, args=(i,), daemon=True) for i in range(count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if sum(done) != size:
+            logger.warning(f"bench drained {sum(done)} of {size} jobs")
+        return sum(done) / elapsed
+
+    def _end_to_end(self, path: str, backend: str, count: int) -> List[float]:
+        """Enqueue-to-completion seconds of jobs paced into running workers"""
+        from .worker import WorkerManager
+
+        queue = self._open(path, backend)
+        manager = WorkerManager(queue)
+        manager.start_workers(count, handle_signals=False)
+        try:
+            interval = 1.0 / self.latency_rate if self.latency_rate else 0
+            next_at = time.perf_counter()
+            for _ in range(self.latency_jobs):
+                queue.enqueue("true")
+                next_at += interval
+                time.sleep(max(next_at - time.perf_counter(), 0))
+
+            deadline = time.time() + LATENCY_TIMEOUT
+            while queue.get_stats()["completed"] < self.latency_jobs and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            manager.stop_workers()
+
+        completed = queue.storage.get_jobs_by_state(JobState.COMPLETED, lazy=True)
+        if len(completed) < self.latency_jobs:
+            logger.warning(f"bench: only {len(completed)} of {self.latency_jobs} jobs completed")
+        return [job.finished_at - job.created_at for job in completed]
+
+
+def compare(results: Dict, baseline: Dict, threshold: float = 0.2) -> List[Dict]:
+    """Each metric present in both runs, with its relative change; a
+    change for the worse beyond ``threshold`` (0.2 = 20%) is a regression"""
+    if baseline.get("version") != results.get("version"):
+        raise ValueError(f"baseline is from bench version {baseline.get('version')}, "
+                         f"this run is version {results.get('version')}")
+    rows = []
+    for key, current in results["results"].items():
+        previous = baseline["results"].get(key)
+        if previous is None or not previous["value"]:
+            continue
+        change = (current["value"] - previous["value"]) / previous["value"]
+        worse = -change if current["better"] == "higher" else change
+        rows.append({"metric": key, "baseline": previous["value"], "current": current["value"],
+                     "unit": current["unit"], "change": round(change, 4), "regression": worse > threshold})
+    return rows
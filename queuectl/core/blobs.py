@@ -0,0 +1,147 @@
+import gzip
+import os
+import logging
+from collections import deque
+from pathlib import Path
+from typing import IO, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """Per-job output files kept outside the job records.
+
+    Blobs live at ``<root>/<id[:2]>/<id>.<stream>`` (``.gz`` when
+    compressed) and are spooled there as the job writes them. Only the
+    last ``max_bytes`` of a stream are retained; the job record keeps the
+    relative path and the original byte count.
+    """
+
+    def __init__(self, root: Path, compress: bool = False, max_bytes: Optional[int] = 1024 * 1024):
+        self.root = Path(root)
+        self.compress = compress
+        self.max_bytes = max_bytes
+
+    def _relative_path(self, job_id: str, stream: str) -> str:
+        suffix = ".gz" if self.compress else ""
+        return f"{job_id[:2]}/{job_id}.{stream}{suffix}"
+
+    def write(self, job_id: str, stream: str, data: Union[str, bytes]) -> Tuple[Optional[str], int]:
+        """Store ``data`` and return ``(ref, original byte count)``; empty
+        data stores nothing and has no ref"""
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        spool = self.spool(job_id, stream)
+        spool.write(data)
+        return spool.commit(), spool.size
+
+    def spool(self, job_id: str, stream: str) -> 'BlobSpool':
+        """A blob written chunk by chunk while the job runs"""
+        return BlobSpool(self, job_id, stream)
+
+    def open(self, ref: str) -> IO[bytes]:
+        path = self.root / ref
+        return gzip.open(path, "rb") if ref.endswith(".gz") else open(path, "rb")
+
+    def tail(self, ref: str, lines: int, block_size: int = 8192) -> bytes:
+        """Last ``lines`` lines of a blob, reading backwards from the end"""
+        if lines <= 0:
+            return b""
+        if ref.endswith(".gz"):
+            # gzip streams cannot be read backwards; keep only a window
+            with self.open(ref) as f:
+                return b"".join(deque(f, maxlen=lines))
+
+        with open(self.root / ref, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            buffer = b""
+            while position > 0 and buffer.count(b"\n") <= lines:
+                step = min(block_size, position)
+                position -= step
+                f.seek(position)
+                buffer = f.read(step) + buffer
+        return b"".join(buffer.splitlines(keepends=True)[-lines:])
+
+    def delete(self, job_id: str) -> int:
+        removed = 0
+        for path in (self.root / job_id[:2]).glob(f"{job_id}.*"):
+            try:
+                path.unlink()
+                removed += 1
+            except OSError as e:
+                logger.error(f"Failed to remove blob {path}: {e}")
+        return removed
+
+
+class BlobSpool:
+    """One stream of a running job, appended to a ``.part`` file.
+
+    ``commit`` trims it to the store's ``max_bytes`` (and compresses it)
+    with bounded reads, so a job's output never has to fit in memory.
+    """
+
+    COPY_CHUNK = 65536
+
+    def __init__(self, store: BlobStore, job_id: str, stream: str):
+        self.store = store
+        self.ref = store._relative_path(job_id, stream)
+        self.path = store.root / self.ref
+        self.part = self.path.with_name(self.path.name + ".part")
+        self.size = 0
+        self._file: Optional[IO[bytes]] = None
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.part, "wb")
+        self._file.write(data)
+        self.size += len(data)
+
+    def _keep_from(self, f: IO[bytes]) -> int:
+        """Offset of the retained tail: the last ``max_bytes``, minus the
+        partial first line left by the cut"""
+        max_bytes = self.store.max_bytes
+        if max_bytes is None or self.size <= max_bytes:
+            return 0
+        start = self.size - max_bytes
+        f.seek(start)
+        position = start
+        for chunk in iter(lambda: f.read(self.COPY_CHUNK), b""):
+            newline = chunk.find(b"\n")
+            if newline >= 0:
+                cut = position + newline + 1
+                return cut if cut < self.size else start
+            position += len(chunk)
+        return start
+
+    def commit(self) -> Optional[str]:
+        """Publish the blob and return its ref (None when nothing was written)"""
+        if self._file is None:
+            return None
+        self._file.close()
+        with open(self.part, "rb") as source:
+            keep_from = self._keep_from(source)
+            if keep_from == 0 and not self.store.compress:
+                os.replace(self.part, self.path)
+                return self.ref
+            source.seek(keep_from)
+            temp_file = self.path.with_name(self.path.name + ".tmp")
+            opener = gzip.open if self.store.compress else open
+            with opener(temp_file, "wb") as f:
+                for chunk in iter(lambda: source.read(self.COPY_CHUNK), b""):
+                    f.write(chunk)
+        os.replace(temp_file, self.path)
+        os.unlink(self.part)
+        return self.ref
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            try:
+                os.unlink(self.part)
+            except FileNotFoundError:
+                pass
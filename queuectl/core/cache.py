@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from .job import Job
+from ..utils.filelock import FileLock
+
+# Entries kept when ``result_cache_entries`` is not configured
+DEFAULT_CACHE_ENTRIES = 1000
+
+
+def cache_key(job: Job) -> str:
+    """What makes two jobs identical for the result cache: the idempotency
+    key when there is one, otherwise what the job runs"""
+    if job.idempotency_key:
+        return f"key:{job.idempotency_key}"
+    spec = json.dumps([job.kind, job.command, job.args, job.shell], sort_keys=True)
+    return "run:" + hashlib.sha256(spec.encode()).hexdigest()
+
+
+class ResultCache:
+    """Outputs of completed jobs, kept in ``results.json`` in the storage
+    directory so identical jobs can reuse them.
+
+    An entry points at the completed job's stdout blob (or holds its inline
+    tail) and expires ``cache_ttl`` seconds after the job finished. The
+    registry holds at most ``max_entries``; the least recently used entry
+    is evicted first. Hit, miss and eviction counters live in the same
+    file, and changes go through a lock file like the schedule registry.
+    """
+
+    def __init__(self, storage_path: Path, max_entries: Optional[int] = None):
+        self.path = Path(storage_path) / "results.json"
+        self.lock = FileLock(Path(storage_path) / "results.lock")
+        self.max_entries = max(max_entries or DEFAULT_CACHE_ENTRIES, 1)
+
+    def load(self) -> Dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"entries": {}, "hits": 0, "misses": 0, "evictions": 0}
+
+    def _save(self, registry: Dict):
+        temp_file = self.path.with_suffix(".tmp")
+        with open(temp_file, "w") as f:
+            json.dump(registry, f)
+        os.replace(temp_file, self.path)
+
+    def store(self, job: Job, now: Optional[float] = None):
+        """Remember a job that just completed, evicting the least recently
+        used entries beyond ``max_entries``"""
+        now = now or time.time()
+        with self.lock:
+            registry = self.load()
+            entries = registry["entries"]
+            for key in [key for key, entry in entries.items() if entry["expires_at"] <= now]:
+                del entries[key]
+            entries[cache_key(job)] = {
+                "job_id": job.id,
+                "output": job.output,
+                "output_ref": job.output_ref,
+                "output_bytes": job.output_bytes,
+                "stored_at": now,
+                "expires_at": now + job.cache_ttl,
+                "used_at": now,
+            }
+            excess = len(entries) - self.max_entries
+            if excess > 0:
+                for key in sorted(entries, key=lambda key: entries[key]["used_at"])[:excess]:
+                    del entries[key]
+                registry["evictions"] += excess
+            self._save(registry)
+
+    def lookup(self, job: Job, serve: Callable[[Dict], bool], now: Optional[float] = None) -> bool:
+        """Offer ``serve`` the live entry for a job identical to ``job``.
+
+        ``serve(entry)`` returns False when it cannot use the entry (its
+        output is gone, say), which drops the entry. Counts a hit or a
+        miss and returns whether the job was served.
+        """
+        now = now or time.time()
+        with self.lock:
+            registry = self.load()
+            key = cache_key(job)
+            entry = registry["entries"].get(key)
+            hit = False
+            if entry is not None:
+                if entry["expires_at"] > now and serve(entry):
+                    entry["used_at"] = now
+                    hit = True
+                else:
+                    del registry["entries"][key]
+            registry["hits" if hit else "misses"] += 1
+            self._save(registry)
+            return hit
+
+    def stats(self) -> Dict[str, int]:
+        registry = self.load()
+        return {"entries": len(registry["entries"]), "hits": registry["hits"],
+                "misses": registry["misses"], "evictions": registry["evictions"]}
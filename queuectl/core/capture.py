@@ -0,0 +1,149 @@
+import os
+import selectors
+import signal
+import subprocess
+import time
+import logging
+from typing import Optional
+from .blobs import BlobSpool
+from .executor import PopenLauncher, SpawnStats, build_argv
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from a job's pipe at a time
+READ_CHUNK = 65536
+
+DEFAULT_LAUNCHER = PopenLauncher()
+
+
+class TailBuffer:
+    """Ring buffer holding the last ``capacity`` bytes written to it"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(capacity, 0)
+        self._buffer = bytearray(self.capacity)
+        self._end = 0  # total bytes ever written
+
+    def write(self, data: bytes):
+        if not self.capacity:
+            self._end += len(data)
+            return
+        if len(data) > self.capacity:
+            self._end += len(data) - self.capacity
+            data = data[-self.capacity:]
+        start = self._end % self.capacity
+        first = min(len(data), self.capacity - start)
+        self._buffer[start:start + first] = data[:first]
+        self._buffer[:len(data) - first] = data[first:]
+        self._end += len(data)
+
+    def getvalue(self) -> bytes:
+        if self._end <= self.capacity:
+            return bytes(self._buffer[:self._end])
+        start = self._end % self.capacity
+        return bytes(self._buffer[start:] + self._buffer[:start])
+
+
+class StreamCapture:
+    """One output stream of a running job.
+
+    Counts every byte, keeps the last ``tail_bytes`` in memory and, given
+    a ``spool``, appends the stream to the job's blob as it arrives, so
+    capturing costs the same memory however much the job writes.
+    """
+
+    def __init__(self, tail_bytes: int, spool: Optional[BlobSpool] = None):
+        self.tail = TailBuffer(tail_bytes)
+        self.spool = spool
+        self.size = 0
+        self.ref: Optional[str] = None
+        self._closed = False
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        self.tail.write(data)
+        if self.spool:
+            self.spool.write(data)
+
+    def close(self) -> Optional[str]:
+        """Publish the spooled blob; returns its ref"""
+        if not self._closed:
+            self._closed = True
+            if self.spool:
+                self.ref = self.spool.commit()
+        return self.ref
+
+    def discard(self):
+        self._closed = True
+        if self.spool:
+            self.spool.discard()
+
+    def text(self) -> str:
+        return self.tail.getvalue().decode("utf-8", errors="replace")
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+
+def kill_group(pid: int) -> None:
+    """SIGKILL a job started in its own session, shell children included"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_captured(command: str, timeout: Optional[float], stdout: StreamCapture,
+                 stderr: StreamCapture, shell: bool = True, launcher=None,
+                 spawn_stats: Optional[SpawnStats] = None) -> int:
+    """Run ``command`` (through ``/bin/sh`` unless ``shell`` is False),
+    streaming its output into the captures.
+
+    Returns the exit code; raises ``subprocess.TimeoutExpired`` after
+    killing the job's process group when it outlives ``timeout``.
+    """
+    argv = build_argv(command, shell)
+    launcher = launcher or DEFAULT_LAUNCHER
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    try:
+        started = time.perf_counter()
+        process = launcher.spawn(argv, stdout_w, stderr_w)
+        if spawn_stats is not None:
+            spawn_stats.record(time.perf_counter() - started)
+    except BaseException:
+        for fd in (stdout_r, stderr_r):
+            os.close(fd)
+        raise
+    finally:
+        # The job holds the write ends now; we see EOF once it exits
+        os.close(stdout_w)
+        os.close(stderr_w)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with selectors.DefaultSelector() as selector:
+        selector.register(stdout_r, selectors.EVENT_READ, stdout)
+        selector.register(stderr_r, selectors.EVENT_READ, stderr)
+        try:
+            while selector.get_map():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    kill_group(process.pid)
+                    process.wait()
+                    raise subprocess.TimeoutExpired(command, timeout)
+                for key, _ in selector.select(remaining):
+                    data = os.read(key.fd, READ_CHUNK)
+                    if data:
+                        key.data.write(data)
+                    else:
+                        selector.unregister(key.fileobj)
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                return process.wait(remaining)
+            except subprocess.TimeoutExpired:
+                kill_group(process.pid)
+                process.wait()
+                raise subprocess.TimeoutExpired(command, timeout) from None
+        finally:
+            os.close(stdout_r)
+            os.close(stderr_r)
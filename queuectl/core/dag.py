@@ -0,0 +1,134 @@
+import time
+from typing import Callable, Dict, List, Optional
+from .job import JobState
+
+BLOCKED = JobState.BLOCKED.value
+COMPLETED = JobState.COMPLETED.value
+DEAD = JobState.DEAD.value
+
+# What a blocked job does when a parent dies: die too, or run regardless
+ON_PARENT_FAILURE = ("cascade", "run")
+
+
+def resolve_dependencies(changes: Dict[str, Optional[Dict]], lookup: Callable[[str], Optional[Dict]],
+                         now: Optional[float] = None) -> Dict[str, Dict]:
+    """Dependency bookkeeping for a set of job writes.
+
+    ``changes`` maps job ids to the records about to be written (``None``
+    deletes) and ``lookup`` returns a job's record as stored before them.
+    New blocked jobs in ``changes`` are linked in place: each unfinished
+    parent lists them as a dependent and they count their unfinished
+    parents. Jobs that complete or die in ``changes`` update their
+    dependents' counters; a dependent whose count reaches zero becomes
+    pending, and one whose parent died is cancelled (marked dead, which
+    cascades further) unless it was enqueued to run regardless.
+
+    Only the dependents of jobs in ``changes`` are touched, never a scan
+    of every blocked job. Returns the extra records to write with the
+    changes, which take precedence over the originals.
+    """
+    now = time.time() if now is None else now
+    extra: Dict[str, Dict] = {}
+    # States as submitted; linking below may change them in place
+    submitted = {job_id: record["state"] for job_id, record in changes.items() if record}
+
+    def current(job_id: str) -> Optional[Dict]:
+        if job_id in extra:
+            return extra[job_id]
+        if job_id in changes:
+            return changes[job_id]
+        return lookup(job_id)
+
+    def update(job_id: str, record: Dict, **fields) -> Dict:
+        record = dict(record, **fields)
+        extra[job_id] = record
+        return record
+
+    for job_id in list(changes):
+        # A parent linked earlier in this loop may already have a fresh copy
+        record = current(job_id)
+        if record and record["state"] == BLOCKED and record.get("pending_parents") is None:
+            _link(job_id, record, current, update, now)
+
+    # Jobs reaching a final state now, whose dependents need telling. A
+    # record written in that state (a migration, say) is no transition:
+    # its dependents were counted down when it first finished.
+    finished: List[str] = []
+    for job_id in dict.fromkeys(list(changes) + list(extra)):
+        record = current(job_id)
+        if record and record.get("dependents") and record["state"] in (COMPLETED, DEAD):
+            before = lookup(job_id)
+            previous = before["state"] if before is not None else submitted.get(job_id)
+            if previous != record["state"]:
+                finished.append(job_id)
+
+    while finished:
+        parent_id = finished.pop()
+        parent = current(parent_id)
+        for child_id in parent.get("dependents") or []:
+            child = current(child_id)
+            if not child or child["state"] != BLOCKED:
+                continue
+            if parent["state"] == DEAD and child.get("on_parent_failure", "cascade") == "cascade":
+                update(child_id, child, state=DEAD, pending_parents=0, updated_at=now, finished_at=now,
+                       last_error=f"Cancelled: parent {parent_id} failed")
+                finished.append(child_id)
+                continue
+            remaining = max((child.get("pending_parents") or 0) - 1, 0)
+            if remaining:
+                update(child_id, child, pending_parents=remaining)
+            else:
+                update(child_id, child, pending_parents=0, state=JobState.PENDING.value, updated_at=now)
+    return extra
+
+
+def _link(job_id: str, record: Dict, current, update, now: float):
+    """Attach a newly written blocked job to its parents (in place)"""
+    remaining, dead_parent = 0, None
+    for parent_id in record.get("depends_on") or []:
+        parent = current(parent_id)
+        if parent is None or parent["state"] == DEAD:
+            dead_parent = dead_parent or parent_id
+        elif parent["state"] != COMPLETED:
+            update(parent_id, parent, dependents=list(parent.get("dependents") or []) + [job_id])
+            remaining += 1
+
+    record["pending_parents"] = remaining
+    if dead_parent and record.get("on_parent_failure", "cascade") == "cascade":
+        record.update(state=DEAD, pending_parents=0, updated_at=now, finished_at=now,
+                      last_error=f"Cancelled: parent {dead_parent} failed")
+    elif not remaining:
+        record["state"] = JobState.PENDING.value
+
+
+def order_dag(nodes: Dict[str, List[str]]) -> List[str]:
+    """Node names with every node after the nodes it depends on.
+
+    ``nodes`` maps a name to the names it runs after; raises
+    ``ValueError`` on an unknown name or a cycle.
+    """
+    for name, after in nodes.items():
+        for parent in after:
+            if parent not in nodes:
+                raise ValueError(f"'{name}' runs after unknown job '{parent}'")
+
+    ordered: List[str] = []
+    state: Dict[str, int] = {}  # 1 while being visited, 2 once placed
+    for root in nodes:
+        stack = [(root, iter(nodes[root]))]
+        if state.get(root):
+            continue
+        state[root] = 1
+        while stack:
+            name, parents = stack[-1]
+            parent = next(parents, None)
+            if parent is None:
+                stack.pop()
+                state[name] = 2
+                ordered.append(name)
+            elif state.get(parent) == 1:
+                raise ValueError(f"dependency cycle through '{parent}'")
+            elif not state.get(parent):
+                state[parent] = 1
+                stack.append((parent, iter(nodes[parent])))
+    return ordered
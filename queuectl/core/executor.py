@@ -0,0 +1,276 @@
+import json
+import os
+import selectors
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ("subprocess", "forkserver")
+
+# How long to wait for the fork server to answer a launch request
+LAUNCH_TIMEOUT = 10.0
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_argv(command: str, shell: bool = True) -> List[str]:
+    """The argv a job runs: ``sh -c command``, or the command split like a shell would"""
+    if shell:
+        return ["/bin/sh", "-c", command]
+    argv = shlex.split(command)
+    if not argv:
+        raise ValueError("empty command")
+    return argv
+
+
+class SpawnStats:
+    """Launch cost of the jobs a worker started: the time from asking for
+    a process to having its pid"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "spawns": self.count,
+            "spawn_avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "spawn_max_ms": round(self.max * 1000, 3),
+        }
+
+
+class SpawnedProcess:
+    """A job process started by a launcher; its output goes to the pipes
+    the caller passed in"""
+
+    def __init__(self, pid: int, exit_future: Optional[Future] = None, popen=None):
+        self.pid = pid
+        self.exit_future = exit_future
+        self._popen = popen
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        """Exit code; raises ``subprocess.TimeoutExpired`` when still running"""
+        if self._popen is not None:
+            return self._popen.wait(timeout)
+        try:
+            return self.exit_future.result(timeout)
+        except FutureTimeout:
+            raise subprocess.TimeoutExpired(str(self.pid), timeout) from None
+
+
+class PopenLauncher:
+    """Starts each job with ``subprocess.Popen`` from the worker process"""
+
+    name = "subprocess"
+
+    def start(self):
+        pass
+
+    def spawn(self, argv: List[str], stdout_fd: int, stderr_fd: int) -> SpawnedProcess:
+        popen = subprocess.Popen(
+            argv,
+            stdin=subprocess.DEVNULL,
+            stdout=stdout_fd,
+            stderr=stderr_fd,
+            start_new_session=True
+        )
+        return SpawnedProcess(popen.pid, popen=popen)
+
+    def close(self):
+        pass
+
+
+class ForkServer:
+    """Launches jobs from a small pre-started helper process.
+
+    A worker process carries threads, an event loop and its caches, all
+    of which make forking it slower. The helper is a bare interpreter that
+    receives launch requests (argv plus the output pipes, passed as file
+    descriptors) over a Unix socket, starts each job with
+    ``os.posix_spawnp`` and reports pids and exit codes back.
+    """
+
+    name = "forkserver"
+
+    def __init__(self):
+        self._process: Optional[subprocess.Popen] = None
+        self._sock: Optional[socket.socket] = None
+        self._reader: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._replies: Dict[int, Future] = {}
+        self._exits: Dict[int, Future] = {}
+        self._ready = threading.Event()
+
+    def start(self):
+        """Start the helper now and wait until it is ready, rather than
+        on the first launch"""
+        with self._lock:
+            self._ensure_started()
+            ready = self._ready
+        if not ready.wait(LAUNCH_TIMEOUT):
+            logger.warning("Fork server is slow to start")
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.poll() is None:
+            return
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        env = dict(os.environ)
+        # The helper imports this module, wherever queuectl is installed
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get("PYTHONPATH")]))
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "queuectl.core.executor", str(child.fileno())],
+            pass_fds=[child.fileno()],
+            stdin=subprocess.DEVNULL,
+            env=env,
+            start_new_session=True  # Ctrl+C goes to the workers, not the helper
+        )
+        child.close()
+        self._sock = parent
+        self._ready = threading.Event()
+        self._reader = threading.Thread(target=self._read_replies, args=(parent, self._ready), daemon=True)
+        self._reader.start()
+        logger.info(f"Started fork server (pid {self._process.pid})")
+
+    def _read_replies(self, sock: socket.socket, ready: threading.Event):
+        while True:
+            try:
+                data = sock.recv(4096)
+            except OSError:
+                data = b""
+            if not data:
+                break
+            reply = json.loads(data)
+            if "ready" in reply:
+                ready.set()
+            elif "id" in reply:
+                if "pid" in reply:
+                    # Registered before the launch returns, as the exit may be next
+                    reply["exit"] = self._exits[reply["pid"]] = Future()
+                future = self._replies.pop(reply["id"], None)
+                if future:
+                    future.set_result(reply)
+            else:
+                future = self._exits.pop(reply["pid"], None)
+                if future:
+                    future.set_result(reply["returncode"])
+
+        # The helper is gone: nothing it started can be waited for any more
+        with self._lock:
+            pending = list(self._replies.values()) + list(self._exits.values())
+            self._replies.clear()
+            self._exits.clear()
+        for future in pending:
+            future.set_exception(RuntimeError("fork server exited"))
+
+    def spawn(self, argv: List[str], stdout_fd: int, stderr_fd: int) -> SpawnedProcess:
+        future = Future()
+        with self._lock:
+            self._ensure_started()
+            self._next_id += 1
+            request_id = self._next_id
+            self._replies[request_id] = future
+            socket.send_fds(self._sock, [json.dumps({"id": request_id, "argv": argv}).encode()],
+                            [stdout_fd, stderr_fd])
+        reply = future.result(LAUNCH_TIMEOUT)
+        if "error" in reply:
+            raise OSError(reply["error"])
+        return SpawnedProcess(reply["pid"], exit_future=reply["exit"])
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                # Wakes our reader; the helper exits when it sees EOF
+                self._sock.shutdown(socket.SHUT_RDWR)
+                self._sock.close()
+                self._sock = None
+            if self._process is not None:
+                try:
+                    self._process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+                self._process = None
+
+
+def make_launcher(executor: Optional[str] = None):
+    if executor in (None, "subprocess"):
+        return PopenLauncher()
+    if executor == "forkserver":
+        return ForkServer()
+    raise ValueError(f"unknown executor '{executor}' (expected one of {', '.join(EXECUTORS)})")
+
+
+def _serve(sock: socket.socket):
+    """Fork server main loop: spawn on request, report exits as they happen"""
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    sock.send(json.dumps({"ready": True}).encode())
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(wake_r, selectors.EVENT_READ)
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj is sock:
+                message, fds, _, _ = socket.recv_fds(sock, 65536, 2)
+                if not message:
+                    return  # the worker process went away
+                request = json.loads(message)
+                for fd in fds:
+                    os.set_inheritable(fd, False)
+                try:
+                    pid = os.posix_spawnp(request["argv"][0], request["argv"], os.environ, file_actions=[
+                        (os.POSIX_SPAWN_DUP2, devnull, 0),
+                        (os.POSIX_SPAWN_DUP2, fds[0], 1),
+                        (os.POSIX_SPAWN_DUP2, fds[1], 2),
+                    ], setsid=True)
+                    reply = {"id": request["id"], "pid": pid}
+                except OSError as e:
+                    reply = {"id": request["id"], "error": f"{request['argv'][0]}: {e.strerror}"}
+                finally:
+                    for fd in fds:
+                        os.close(fd)
+                sock.send(json.dumps(reply).encode())
+            else:
+                try:
+                    while os.read(wake_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            sock.send(json.dumps({"pid": pid, "returncode": os.waitstatus_to_exitcode(status)}).encode())
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server_sock = socket.socket(fileno=int(sys.argv[1]))
+    server_sock.set_inheritable(False)
+    try:
+        _serve(server_sock)
+    except (BrokenPipeError, ConnectionResetError):
+        pass
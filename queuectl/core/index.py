@@ -0,0 +1,225 @@
+import heapq
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from .job import JobState, to_epoch, DEFAULT_QUEUE
+
+PENDING = JobState.PENDING.value
+
+
+def ready_at(job_data: Dict) -> float:
+    """When a pending job may run: its retry/schedule time, else its creation time"""
+    return to_epoch(job_data.get("next_run_at")) or to_epoch(job_data["created_at"])
+
+
+def pending_key(job_data: Dict) -> Tuple[str, int, float]:
+    """(queue, priority, ready time) of a pending job"""
+    return (job_data.get("queue") or DEFAULT_QUEUE, job_data.get("priority") or 0, ready_at(job_data))
+
+
+def weighted_fair_merge(sources: Dict[str, Iterator], limit: int, weights: Optional[Dict[str, int]],
+                        credit: Dict[str, int], accept: Optional[Callable[[object], bool]] = None) -> list:
+    """Take up to ``limit`` items from per-queue iterators by smooth
+    weighted round-robin.
+
+    Each queue is served in proportion to its weight (default 1) while it
+    has items, so a busy queue cannot starve the others. ``credit`` carries
+    the round-robin state between calls. ``accept`` is asked about an item
+    only once it is picked, so admission control (see throttle.py) is only
+    charged for items actually taken; a refused item is skipped as if its
+    queue had not offered it.
+    """
+    weights = weights or {}
+    heads = {}
+    for name, source in sources.items():
+        item = next(source, None)
+        if item is not None:
+            heads[name] = item
+
+    taken = []
+    while heads and len(taken) < limit:
+        total = 0
+        for name in heads:
+            weight = max(weights.get(name, 1), 1)
+            credit[name] = credit.get(name, 0) + weight
+            total += weight
+        chosen = max(heads, key=lambda name: credit[name])
+        if accept is None or accept(heads[chosen]):
+            credit[chosen] -= total
+            taken.append(heads[chosen])
+        else:
+            for name in heads:
+                credit[name] -= max(weights.get(name, 1), 1)
+        if len(taken) >= limit:
+            break
+        item = next(sources[chosen], None)
+        if item is None:
+            del heads[chosen]
+        else:
+            heads[chosen] = item
+    return taken
+
+
+class JobIndex:
+    """Secondary indexes over a map of serialized jobs.
+
+    Keeps the set of job ids in each state and, per named queue, two heaps
+    of pending jobs: one ordered by the time they become runnable
+    (``next_run_at``, or ``created_at`` for jobs that can run at once) and
+    one of runnable jobs ordered by priority, then age. Claims move due
+    jobs from the first heap to the second, so finding work costs
+    O(result) rather than a scan of every job ever enqueued, and jobs
+    waiting out a delay are never visited early. Heap entries are
+    invalidated lazily: an entry whose job is no longer pending, or was
+    rescheduled, is dropped the next time it reaches the top.
+
+    It also keeps each queue's pending count and a heap of its pending
+    jobs by age, so ``queue_stats`` never visits every pending job, and
+    maps idempotency keys to the job holding them.
+    """
+
+    def __init__(self, jobs: Optional[Dict[str, Dict]] = None):
+        self._states: Dict[str, str] = {}
+        self.by_state: Dict[str, Set[str]] = {state.value: set() for state in JobState}
+        self._keys: Dict[str, Tuple[str, int, float]] = {}
+        self._waiting: Dict[str, List[tuple]] = {}
+        self._ready: Dict[str, List[tuple]] = {}
+        self._pending_counts: Dict[str, int] = {}
+        self._created: Dict[str, float] = {}
+        self._oldest: Dict[str, List[tuple]] = {}
+        self._idempotency: Dict[str, str] = {}
+        # Weighted round-robin state per set of queues being claimed from
+        self._credit: Dict[tuple, Dict[str, int]] = {}
+        for job_data in (jobs or {}).values():
+            self.put(job_data)
+
+    def put(self, job_data: Dict):
+        job_id = job_data["id"]
+        state = job_data["state"]
+        previous = self._states.get(job_id)
+        if previous is None and job_data.get("idempotency_key"):
+            self._idempotency[job_data["idempotency_key"]] = job_id
+        if state == PENDING:
+            key = pending_key(job_data)
+            if previous == state and self._keys.get(job_id) == key:
+                return
+        elif previous == state:
+            return
+
+        if previous is not None:
+            self.by_state[previous].discard(job_id)
+        self.by_state.setdefault(state, set()).add(job_id)
+        self._states[job_id] = state
+
+        old_queue = self._keys[job_id][0] if previous == PENDING else None
+        if state == PENDING:
+            self._keys[job_id] = key
+            heapq.heappush(self._waiting.setdefault(key[0], []), (key[2], job_id))
+            if old_queue != key[0]:
+                self._leave_queue(job_id, old_queue)
+                self._enter_queue(job_id, key[0], to_epoch(job_data["created_at"]))
+            self._maybe_rebuild_heaps()
+        else:
+            self._keys.pop(job_id, None)
+            self._leave_queue(job_id, old_queue)
+
+    def remove(self, job_id: str):
+        state = self._states.pop(job_id, None)
+        key = self._keys.pop(job_id, None)
+        if state is not None:
+            self.by_state[state].discard(job_id)
+        if state == PENDING:
+            self._leave_queue(job_id, key[0])
+
+    def _enter_queue(self, job_id: str, queue: str, created_at: float):
+        self._pending_counts[queue] = self._pending_counts.get(queue, 0) + 1
+        self._created[job_id] = created_at
+        heapq.heappush(self._oldest.setdefault(queue, []), (created_at, job_id))
+
+    def _leave_queue(self, job_id: str, queue: Optional[str]):
+        if queue is None:
+            return
+        self._created.pop(job_id, None)
+        self._pending_counts[queue] -= 1
+        if not self._pending_counts[queue]:
+            del self._pending_counts[queue]
+            self._oldest.pop(queue, None)
+
+    def idempotent_job(self, key: str) -> Optional[str]:
+        """Id of the stored job holding idempotency ``key``, if any"""
+        job_id = self._idempotency.get(key)
+        if job_id is not None and job_id not in self._states:
+            # Deleted since; the key is free again
+            del self._idempotency[key]
+            return None
+        return job_id
+
+    def ids(self, state: JobState) -> Set[str]:
+        return self.by_state.get(state.value, set())
+
+    def count(self, state: JobState) -> int:
+        return len(self.ids(state))
+
+    def queue_stats(self) -> Dict[str, Dict[str, float]]:
+        """Pending depth and oldest pending ``created_at`` per named queue"""
+        stats = {}
+        for queue, count in self._pending_counts.items():
+            oldest = self._oldest[queue]
+            while (self._key_if_pending(oldest[0][1]) or (None,))[0] != queue:
+                heapq.heappop(oldest)  # stale entry
+            stats[queue] = {"pending": count, "oldest_created_at": oldest[0][0]}
+        return stats
+
+    def _key_if_pending(self, job_id: str) -> Optional[Tuple[str, int, float]]:
+        return self._keys.get(job_id) if self._states.get(job_id) == PENDING else None
+
+    def _promote(self, queue: str, now: float):
+        waiting = self._waiting.get(queue)
+        ready = self._ready.setdefault(queue, [])
+        while waiting and waiting[0][0] <= now:
+            run_at, job_id = heapq.heappop(waiting)
+            key = self._key_if_pending(job_id)
+            if key and key[0] == queue and key[2] == run_at:
+                heapq.heappush(ready, (-key[1], run_at, job_id))
+
+    def _candidates(self, queue: str, seen: Set[str], popped: List[tuple]) -> Iterator[str]:
+        ready = self._ready.get(queue, [])
+        while ready:
+            entry = heapq.heappop(ready)
+            priority, run_at, job_id = entry
+            if job_id in seen or self._key_if_pending(job_id) != (queue, -priority, run_at):
+                continue  # stale entry
+            seen.add(job_id)
+            popped.append((queue, entry))
+            yield job_id
+
+    def ready_pending(self, limit: int, accept: Optional[Callable[[str], bool]] = None,
+                      now: Optional[float] = None, queues: Optional[List[str]] = None,
+                      weights: Optional[Dict[str, int]] = None) -> List[str]:
+        """Up to ``limit`` pending job ids that are due by ``now``, filtered by
+        ``accept``: highest priority (then earliest) first within a queue,
+        weighted round-robin across ``queues`` (default: every queue)"""
+        now = time.time() if now is None else now
+        names = list(queues) if queues else sorted(set(self._waiting) | set(self._ready))
+        for name in names:
+            self._promote(name, now)
+
+        seen: Set[str] = set()
+        popped: List[tuple] = []
+        sources = {name: self._candidates(name, seen, popped) for name in names}
+        found = weighted_fair_merge(sources, limit, weights, self._credit.setdefault(tuple(names), {}), accept)
+
+        for name, entry in popped:
+            heapq.heappush(self._ready[name], entry)
+        return found
+
+    def _maybe_rebuild_heaps(self):
+        # Jobs bouncing between states leave stale entries behind; drop
+        # them once they outnumber the live ones
+        live = len(self.by_state[PENDING])
+        stored = sum(map(len, self._waiting.values())) + sum(map(len, self._ready.values()))
+        if stored <= 2 * live + 64 and sum(map(len, self._oldest.values())) <= 2 * live + 64:
+            return
+        self._waiting, self._ready, self._oldest = {}, {}, {}
+        for job_id, key in self._keys.items():
+            heapq.heappush(self._waiting.setdefault(key[0], []), (key[2], job_id))
+            heapq.heappush(self._oldest.setdefault(key[0], []), (self._created[job_id], job_id))
@@ -1,37 +1,105 @@
+import time
 import uuid
-from datetime import datetime
-from typing import Dict, Any, Optional
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Callable
 from enum import Enum
 
 class JobState(Enum):
     PENDING = "pending"
-    PROCESSING = "processing" 
+    PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
     DEAD = "dead"
+    BLOCKED = "blocked"
+
+# Queue for jobs enqueued without one
+DEFAULT_QUEUE = "default"
+
+# Job kinds: a shell command, or a Python "module:function" run in a task pool
+COMMAND = "command"
+TASK = "task"
+
+# Large free-form fields that LazyJob loads on demand
+HEAVY_FIELDS = ("output", "last_error")
+
+_STATES = {state.value: state for state in JobState}
+
+
+def to_epoch(value) -> Optional[float]:
+    """Normalize a stored timestamp (epoch seconds or legacy ISO-8601 UTC string)"""
+    if value is None or isinstance(value, float):
+        return value
+    if isinstance(value, int):
+        return float(value)
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+def format_timestamp(value: Optional[float]) -> str:
+    """ISO-8601 UTC rendering of an epoch timestamp, for display"""
+    if value is None:
+        return "-"
+    return datetime.fromtimestamp(value, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
 
 class Job:
+    __slots__ = (
+        "id", "command", "state", "attempts", "max_retries",
+        "created_at", "updated_at", "started_at", "finished_at",
+        "last_error", "output", "backoff_base", "timeout",
+        "output_ref", "output_bytes", "error_ref", "error_bytes", "next_run_at",
+        "queue", "priority", "shell", "kind", "args", "concurrency_key",
+        "depends_on", "dependents", "pending_parents", "on_parent_failure",
+        "idempotency_key", "cache_ttl", "runnable_at",
+    )
+
     def __init__(
         self,
         command: str,
         job_id: Optional[str] = None,
         max_retries: int = 3,
-        created_at: Optional[str] = None,
+        created_at: Optional[float] = None,
         **kwargs
     ):
+        now = time.time()
         self.id = job_id or str(uuid.uuid4())
         self.command = command
         self.state = JobState.PENDING
         self.attempts = 0
         self.max_retries = max_retries
-        self.created_at = created_at or datetime.utcnow().isoformat()
-        self.updated_at = datetime.utcnow().isoformat()
+        self.created_at = to_epoch(created_at) or now
+        self.updated_at = now
         self.started_at = None
         self.finished_at = None
         self.last_error = None
         self.output = None
         self.backoff_base = kwargs.get('backoff_base', 2)
         self.timeout = kwargs.get('timeout', 30)
+        self.output_ref = None
+        self.output_bytes = 0
+        self.error_ref = None
+        self.error_bytes = 0
+        self.next_run_at = to_epoch(kwargs.get('next_run_at'))
+        self.queue = kwargs.get('queue') or DEFAULT_QUEUE
+        self.priority = kwargs.get('priority', 0)
+        self.shell = kwargs.get('shell', True)
+        self.kind = kwargs.get('kind') or COMMAND
+        # JSON arguments of a task: a list is passed positionally, a dict by keyword
+        self.args = kwargs.get('args')
+        # Jobs sharing a key share its concurrency and rate limits
+        self.concurrency_key = kwargs.get('concurrency_key')
+        # A job with parents is blocked until storage links it to them (see dag.py)
+        self.depends_on = list(kwargs.get('depends_on') or [])
+        self.dependents = []
+        self.pending_parents = None
+        self.on_parent_failure = kwargs.get('on_parent_failure') or "cascade"
+        if self.depends_on:
+            self.state = JobState.BLOCKED
+        # At most one stored job per idempotency key; enqueueing again returns it
+        self.idempotency_key = kwargs.get('idempotency_key')
+        # Seconds a completed run's output may stand in for an identical job
+        self.cache_ttl = kwargs.get('cache_ttl')
+        # When the attempt being claimed became runnable; not persisted
+        self.runnable_at = None
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -47,24 +115,62 @@ class Job:
             "last_error": self.last_error,
             "output": self.output,
             "backoff_base": self.backoff_base,
-            "timeout": self.timeout
+            "timeout": self.timeout,
+            "output_ref": self.output_ref,
+            "output_bytes": self.output_bytes,
+            "error_ref": self.error_ref,
+            "error_bytes": self.error_bytes,
+            "next_run_at": self.next_run_at,
+            "queue": self.queue,
+            "priority": self.priority,
+            "shell": self.shell,
+            "kind": self.kind,
+            "args": self.args,
+            "concurrency_key": self.concurrency_key,
+            "depends_on": self.depends_on,
+            "dependents": self.dependents,
+            "pending_parents": self.pending_parents,
+            "on_parent_failure": self.on_parent_failure,
+            "idempotency_key": self.idempotency_key,
+            "cache_ttl": self.cache_ttl
         }
 
+    def _load_light_fields(self, data: Dict[str, Any]):
+        # Bypasses __init__, which would mint a uuid and read the clock
+        self.id = data['id']
+        self.command = data['command']
+        self.state = _STATES[data['state']]
+        self.attempts = data.get('attempts', 0)
+        self.max_retries = data.get('max_retries', 3)
+        self.created_at = to_epoch(data.get('created_at'))
+        self.updated_at = to_epoch(data.get('updated_at')) or self.created_at
+        self.started_at = to_epoch(data.get('started_at'))
+        self.finished_at = to_epoch(data.get('finished_at'))
+        self.backoff_base = data.get('backoff_base', 2)
+        self.timeout = data.get('timeout', 30)
+        self.output_ref = data.get('output_ref')
+        self.output_bytes = data.get('output_bytes', 0)
+        self.error_ref = data.get('error_ref')
+        self.error_bytes = data.get('error_bytes', 0)
+        self.next_run_at = to_epoch(data.get('next_run_at'))
+        self.queue = data.get('queue') or DEFAULT_QUEUE
+        self.priority = data.get('priority', 0)
+        self.shell = data.get('shell', True)
+        self.kind = data.get('kind') or COMMAND
+        self.args = data.get('args')
+        self.concurrency_key = data.get('concurrency_key')
+        self.depends_on = data.get('depends_on') or []
+        self.dependents = data.get('dependents') or []
+        self.pending_parents = data.get('pending_parents')
+        self.on_parent_failure = data.get('on_parent_failure') or "cascade"
+        self.idempotency_key = data.get('idempotency_key')
+        self.cache_ttl = data.get('cache_ttl')
+        self.runnable_at = None
+
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Job':
-        job = cls(
-            command=data['command'],
-            job_id=data['id'],
-            max_retries=data.get('max_retries', 3),
-            created_at=data.get('created_at'),
-            backoff_base=data.get('backoff_base', 2),
-            timeout=data.get('timeout', 30)
-        )
-        job.state = JobState(data['state'])
-        job.attempts = data.get('attempts', 0)
-        job.updated_at = data.get('updated_at', job.created_at)
-        job.started_at = data.get('started_at')
-        job.finished_at = data.get('finished_at')
+        job = cls.__new__(cls)
+        job._load_light_fields(data)
         job.last_error = data.get('last_error')
         job.output = data.get('output')
         return job
@@ -72,33 +178,96 @@ class Job:
     def mark_processing(self):
         self.state = JobState.PROCESSING
         self.attempts += 1
-        self.started_at = datetime.utcnow().isoformat()
+        self.started_at = time.time()
         self.updated_at = self.started_at
+        self.runnable_at = self.next_run_at or self.created_at
+        self.next_run_at = None
+        # Output references describe the latest attempt only
+        self.output_ref = None
+        self.output_bytes = 0
+        self.error_ref = None
+        self.error_bytes = 0
 
     def mark_completed(self, output: str = None):
         self.state = JobState.COMPLETED
-        self.finished_at = datetime.utcnow().isoformat()
+        self.finished_at = time.time()
         self.updated_at = self.finished_at
         self.output = output
 
     def mark_failed(self, error: str = None):
         self.state = JobState.FAILED
-        self.finished_at = datetime.utcnow().isoformat()
+        self.finished_at = time.time()
         self.updated_at = self.finished_at
         self.last_error = error
 
+    def schedule_retry(self, delay: float):
+        """Return a failed job to the queue, runnable ``delay`` seconds from now"""
+        self.state = JobState.PENDING
+        self.updated_at = time.time()
+        self.next_run_at = self.updated_at + delay
+
     def mark_dead(self):
         self.state = JobState.DEAD
-        self.finished_at = datetime.utcnow().isoformat()
+        self.finished_at = time.time()
         self.updated_at = self.finished_at
 
     def should_retry(self) -> bool:
-        return (self.state == JobState.FAILED and 
+        return (self.state == JobState.FAILED and
                 self.attempts <= self.max_retries)
 
     def get_retry_delay(self) -> float:
         return self.backoff_base ** self.attempts
 
     def is_expired(self) -> bool:
-        return (self.state == JobState.FAILED and 
-                self.attempts >= self.max_retries)
\ No newline at end of file
+        return (self.state == JobState.FAILED and
+                self.attempts >= self.max_retries)
+
+
+def _lazy_field(name: str) -> property:
+    slot = Job.__dict__[name]
+
+    def getter(self):
+        try:
+            return slot.__get__(self, type(self))
+        except AttributeError:
+            self._materialize()
+            return slot.__get__(self, type(self))
+
+    def setter(self, value):
+        slot.__set__(self, value)
+
+    return property(getter, setter)
+
+
+class LazyJob(Job):
+    """Job whose heavy fields are only loaded when first accessed.
+
+    ``loader(job_id)`` must return a mapping holding ``HEAVY_FIELDS``; it
+    is called at most once.
+    """
+
+    __slots__ = ("_loader",)
+
+    output = _lazy_field("output")
+    last_error = _lazy_field("last_error")
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], loader: Optional[Callable[[str], Dict[str, Any]]] = None) -> 'LazyJob':
+        job = cls.__new__(cls)
+        job._load_light_fields(data)
+        if loader is None or any(name in data for name in HEAVY_FIELDS):
+            # The heavy fields are already at hand
+            job._loader = lambda job_id: data
+        else:
+            job._loader = loader
+        return job
+
+    def _materialize(self):
+        heavy = self._loader(self.id) or {}
+        self._loader = None
+        for name in HEAVY_FIELDS:
+            slot = Job.__dict__[name]
+            try:
+                slot.__get__(self, type(self))  # assigned since loading; keep it
+            except AttributeError:
+                slot.__set__(self, heavy.get(name))
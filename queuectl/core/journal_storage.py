@@ -0,0 +1,543 @@
+import json
+import os
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional
+from .job import Job, JobState, LazyJob
+from .storage import (JobStorage, DEFAULT_LEASE_SECONDS, lease_expires_at, running_by_key, split_duplicates,
+                      unchanged)
+from .index import JobIndex
+from .throttle import Throttle
+from .dag import resolve_dependencies
+from .metrics import count_bytes
+from ..utils.filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+
+class JournalJobStorage(JobStorage):
+    """Log-structured file storage.
+
+    State is the latest ``snapshot.json`` plus the records appended to the
+    journal segment of the same generation. Each mutation appends one JSON
+    line; once the segment passes ``compact_threshold`` bytes a background
+    thread folds it into a new snapshot and starts the next generation.
+
+    The last record of every append also carries the counters it leaves
+    behind under ``stats``, and compaction writes them to ``stats.json`` for
+    the empty segment it starts, so status reads the tail of one file
+    instead of replaying the journal.
+    """
+
+    backend_name = "journal"
+    compact_threshold = 4 * 1024 * 1024
+    stats_tail_bytes = 64 * 1024
+
+    def __init__(self, storage_path: str = "queuectl_data", compact_threshold: Optional[int] = None,
+                 fsync: Optional[bool] = None):
+        super().__init__(storage_path)
+        self.snapshot_file = self.storage_path / "snapshot.json"
+        self._lock = FileLock(self.storage_path / "journal.lock")
+        self._mutex = threading.RLock()
+        self._jobs: Dict[str, Dict] = {}
+        self._locks: Dict[str, Dict] = {}
+        self._limits: Dict[str, Dict] = {}
+        self._index = JobIndex()
+        self._generation = 0
+        self._offset = 0
+        self._snapshot_stat = False  # never loaded; None means no snapshot yet
+        self._compacting = False
+
+        config = self.load_config()
+        if compact_threshold is None:
+            compact_threshold = config.get("journal_compact_bytes", self.compact_threshold)
+        if fsync is None:
+            fsync = config.get("journal_fsync", False)
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+
+    def _initialize_files(self):
+        if not self.config_file.exists():
+            with open(self.config_file, 'w') as f:
+                json.dump({}, f)
+
+    def _segment_file(self, generation: int):
+        return self.storage_path / f"journal.{generation}.log"
+
+    def _load_snapshot(self):
+        try:
+            stat = os.stat(self.snapshot_file)
+        except FileNotFoundError:
+            stat = None
+
+        key = (stat.st_ino, stat.st_mtime_ns) if stat else None
+        if key == self._snapshot_stat:
+            return
+
+        if stat:
+            with open(self.snapshot_file, 'r') as f:
+                snapshot = json.load(f)
+            count_bytes(read=stat.st_size)
+        else:
+            snapshot = {}
+
+        self._generation = snapshot.get("generation", 0)
+        self._jobs = snapshot.get("jobs", {})
+        self._locks = snapshot.get("locks", {})
+        self._limits = snapshot.get("limits", {})
+        self._index = JobIndex(self._jobs)
+        self._offset = 0
+        self._snapshot_stat = key
+
+    def _apply(self, record: Dict):
+        op = record["op"]
+        if op == "put":
+            self._jobs[record["job"]["id"]] = record["job"]
+            self._index.put(record["job"])
+        elif op == "del":
+            self._jobs.pop(record["id"], None)
+            self._index.remove(record["id"])
+        elif op == "lock":
+            self._locks[record["id"]] = {"worker_id": record["worker_id"], "locked_at": record["locked_at"],
+                                         "expires_at": record.get("expires_at")}
+        elif op == "unlock":
+            self._locks.pop(record["id"], None)
+        elif op == "limit":
+            self._limits[record["key"]] = record["limit"]
+        elif op == "unlimit":
+            self._limits.pop(record["key"], None)
+
+    def _refresh(self):
+        """Catch up with snapshots and records written by other processes"""
+        with self._mutex:
+            self._load_snapshot()
+            try:
+                with open(self._segment_file(self._generation), 'rb') as f:
+                    f.seek(self._offset)
+                    data = f.read()
+            except FileNotFoundError:
+                # Either nothing has been written to this generation yet, or
+                # it was compacted away between the snapshot check and the read
+                generation = self._generation
+                self._load_snapshot()
+                if self._generation != generation:
+                    self._refresh()
+                return
+
+            # A writer may be midway through a record; stop at the last newline
+            end = data.rfind(b"\n") + 1
+            count_bytes(read=end)
+            for line in data[:end].splitlines():
+                if line:
+                    self._apply(json.loads(line))
+            self._offset += end
+
+    def _append(self, records: List[Dict]):
+        """Apply records and append them to the segment, the last one carrying
+        the counters they leave; caller holds the file lock"""
+        for record in records:
+            self._apply(record)
+        # Leading key, so readers can spot it at the start of a line
+        last = records[-1] if records else {"op": "stats"}
+        records = records[:-1] + [{"stats": self._stats_document(self._index), **last}]
+        payload = b"".join(
+            json.dumps(record, separators=(",", ":")).encode() + b"\n" for record in records
+        )
+        try:
+            with open(self._segment_file(self._generation), 'ab') as f:
+                f.write(payload)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                size = f.tell()
+        except Exception:
+            # The records were applied but never reached the journal; reload
+            self._snapshot_stat = False
+            raise
+        count_bytes(written=len(payload))
+        self._offset += len(payload)
+
+        if size > self.compact_threshold and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._background_compact, daemon=True).start()
+
+    def _mutate(self, build_records):
+        """Run ``build_records`` against up-to-date state and append its output"""
+        with self._lock, self._mutex:
+            self._refresh()
+            records, result = build_records()
+            if records:
+                puts = {record["job"]["id"]: record["job"] for record in records if record["op"] == "put"}
+                if puts:
+                    # Dependency updates go into the same append
+                    records += [{"op": "put", "job": job}
+                                for job in resolve_dependencies(puts, self._jobs.get).values()]
+                self._append(records)
+            return result
+
+    def recount_stats(self) -> Dict[str, int]:
+        with self._lock, self._mutex:
+            # Replay the snapshot and journal from scratch
+            self._snapshot_stat = False
+            self._refresh()
+            self._append([])
+            return self._format_stats({state.value: self._index.count(state) for state in JobState})
+
+    def _persisted_stats(self) -> Dict:
+        """The counters left by the last complete append to the newest
+        segment, or written by compaction if it has none yet"""
+        segments = {}
+        for segment in self.storage_path.glob("journal.*.log"):
+            generation = segment.name.split(".")[1]
+            if generation.isdigit():
+                segments[int(generation)] = segment
+        if segments:
+            generation = max(segments)
+            try:
+                stats, size = self._tail_stats(segments[generation])
+            except FileNotFoundError:
+                stats, size = None, None  # Compacted away meanwhile
+            if stats is not None:
+                return stats
+            if size == 0 and self.stats_file.exists():
+                stats = self._read_json(self.stats_file)
+                if stats.get("generation") == generation:
+                    return stats
+
+        # Journals written before stats records were kept
+        with self._mutex:
+            self._refresh()
+            return self._stats_document(self._index)
+
+    def _tail_stats(self, segment):
+        """Counters of the last complete append to ``segment``, widening the
+        read while records too long for it hide them, and the segment's size"""
+        with open(segment, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            tail = self.stats_tail_bytes
+            while True:
+                start = max(size - tail, 0)
+                f.seek(start)
+                data = f.read(size - start)
+                count_bytes(read=len(data))
+                # A writer may be midway through an append; skip its partial
+                # line, and the first one if the read started mid-record
+                lines = data[:data.rfind(b"\n") + 1].splitlines()
+                for line in reversed(lines[1:] if start else lines):
+                    if line.startswith(b'{"stats":'):
+                        return json.loads(line)["stats"], size
+                if not start:
+                    return None, size
+                tail *= 4
+
+    def _background_compact(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"Journal compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self) -> int:
+        """Fold the current journal segment into a new snapshot"""
+        with self._lock, self._mutex:
+            self._refresh()
+            old_generation = self._generation
+            new_generation = old_generation + 1
+
+            temp_file = self.snapshot_file.with_suffix('.tmp')
+            with open(temp_file, 'w') as f:
+                json.dump({
+                    "generation": new_generation,
+                    "jobs": self._jobs,
+                    "locks": self._locks,
+                    "limits": self._limits
+                }, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._write_json(self.stats_file, dict(self._stats_document(self._index), generation=new_generation))
+            os.replace(temp_file, self.snapshot_file)
+            # Only now may readers see the new segment and trust stats.json for
+            # it; until then the old segment's tail still holds these counters
+            open(self._segment_file(new_generation), 'wb').close()
+
+            stat = os.stat(self.snapshot_file)
+            self._snapshot_stat = (stat.st_ino, stat.st_mtime_ns)
+            self._generation = new_generation
+            self._offset = 0
+
+            for segment in self.storage_path.glob("journal.*.log"):
+                try:
+                    if int(segment.name.split(".")[1]) < new_generation:
+                        segment.unlink()
+                except (ValueError, OSError):
+                    pass
+
+            logger.info(f"Compacted journal generation {old_generation} into snapshot")
+            return new_generation
+
+    def save_job(self, job: Job) -> bool:
+        try:
+            return self._mutate(lambda: ([{"op": "put", "job": job.to_dict()}], True))
+        except Exception as e:
+            logger.error(f"Failed to save job {job.id}: {e}")
+            return False
+
+    def save_jobs(self, jobs: List[Job]) -> bool:
+        try:
+            return self._mutate(lambda: ([{"op": "put", "job": job.to_dict()} for job in jobs], True))
+        except Exception as e:
+            logger.error(f"Failed to save {len(jobs)} jobs: {e}")
+            return False
+
+    def add_jobs(self, jobs: List[Job]) -> Optional[List[Job]]:
+        try:
+            def build_records():
+                def existing(key):
+                    job_id = self._index.idempotent_job(key)
+                    return Job.from_dict(self._jobs[job_id]) if job_id else None
+
+                new_jobs, result = split_duplicates(jobs, existing)
+                return [{"op": "put", "job": job.to_dict()} for job in new_jobs], result
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to add {len(jobs)} jobs: {e}")
+            return None
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        try:
+            with self._mutex:
+                self._refresh()
+                job_data = self._jobs.get(job_id)
+                return Job.from_dict(job_data) if job_data else None
+        except Exception as e:
+            logger.error(f"Failed to get job {job_id}: {e}")
+            return None
+
+    def get_all_jobs(self, lazy: bool = False) -> Dict[str, Job]:
+        try:
+            load = LazyJob.from_dict if lazy else Job.from_dict
+            with self._mutex:
+                self._refresh()
+                return {job_id: load(job_data) for job_id, job_data in self._jobs.items()}
+        except Exception as e:
+            logger.error(f"Failed to get all jobs: {e}")
+            return {}
+
+    def get_jobs_by_state(self, state: JobState, lazy: bool = False) -> List[Job]:
+        try:
+            load = LazyJob.from_dict if lazy else Job.from_dict
+            with self._mutex:
+                self._refresh()
+                jobs = [load(self._jobs[job_id]) for job_id in self._index.ids(state)]
+            jobs.sort(key=lambda job: job.created_at)
+            return jobs
+        except Exception as e:
+            logger.error(f"Failed to get {state.value} jobs: {e}")
+            return []
+
+    def delete_job(self, job_id: str) -> bool:
+        try:
+            def build_records():
+                if job_id in self._jobs:
+                    return [{"op": "del", "id": job_id}], True
+                return [], False
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to delete job {job_id}: {e}")
+            return False
+
+    def delete_jobs(self, job_ids: List[str]) -> int:
+        try:
+            def build_records():
+                records = [{"op": "del", "id": job_id} for job_id in job_ids if job_id in self._jobs]
+                return records, len(records)
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to delete {len(job_ids)} jobs: {e}")
+            return 0
+
+    def delete_unchanged_jobs(self, jobs: List[Job],
+                              before_delete: Optional[Callable[[List[Job]], None]] = None) -> List[Job]:
+        try:
+            def build_records():
+                doomed = [job for job in jobs if unchanged(self._jobs.get(job.id), job)]
+                if doomed and before_delete:
+                    before_delete(doomed)
+                return [{"op": "del", "id": job.id} for job in doomed], doomed
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to delete {len(jobs)} jobs: {e}")
+            return []
+
+    def get_locks(self) -> Dict[str, Dict]:
+        try:
+            with self._mutex:
+                self._refresh()
+                return dict(self._locks)
+        except Exception as e:
+            logger.error(f"Failed to get locks: {e}")
+            return {}
+
+    def acquire_job_lock(self, job_id: str, worker_id: str, lease: float = DEFAULT_LEASE_SECONDS) -> bool:
+        try:
+            def build_records():
+                if job_id in self._locks:
+                    return [], False  # Already locked
+                now = time.time()
+                return [{"op": "lock", "id": job_id, "worker_id": worker_id, "locked_at": now,
+                         "expires_at": now + lease}], True
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to acquire lock for job {job_id}: {e}")
+            return False
+
+    def release_job_lock(self, job_id: str) -> bool:
+        try:
+            def build_records():
+                if job_id in self._locks:
+                    return [{"op": "unlock", "id": job_id}], True
+                return [], False
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to release lock for job {job_id}: {e}")
+            return False
+
+    def renew_leases(self, worker_id: str, job_ids: List[str], lease: float = DEFAULT_LEASE_SECONDS) -> int:
+        try:
+            def build_records():
+                expires_at = time.time() + lease
+                records = []
+                for job_id in job_ids:
+                    lock_info = self._locks.get(job_id)
+                    if lock_info and lock_info["worker_id"] == worker_id:
+                        # A renewal is the same lock record with a later expiry
+                        records.append({"op": "lock", "id": job_id, "worker_id": worker_id,
+                                        "locked_at": lock_info["locked_at"], "expires_at": expires_at})
+                return records, len(records)
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to renew leases for {worker_id}: {e}")
+            return 0
+
+    def reclaim_expired(self, reclaim: Callable[[Job], None], now: Optional[float] = None) -> List[Job]:
+        now = time.time() if now is None else now
+        try:
+            def build_records():
+                records, reclaimed = [], []
+                for job_id, lock_info in self._locks.items():
+                    if lease_expires_at(lock_info) > now:
+                        continue
+                    job_data = self._jobs.get(job_id)
+                    if job_data and job_data["state"] == JobState.PROCESSING.value:
+                        job = Job.from_dict(job_data)
+                        reclaim(job)
+                        records.append({"op": "put", "job": job.to_dict()})
+                        reclaimed.append(job)
+                    records.append({"op": "unlock", "id": job_id})
+                return records, reclaimed
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to reclaim expired leases: {e}")
+            return []
+
+    def claim_batch(self, worker_id: str, count: int, queues: Optional[List[str]] = None,
+                    weights: Optional[Dict[str, int]] = None,
+                    lease: float = DEFAULT_LEASE_SECONDS) -> List[Job]:
+        try:
+            def build_records():
+                records, claimed = [], []
+                now = time.time()
+                throttle = None
+                if self._limits:
+                    throttle = Throttle(self._limits, running_by_key(self._locks, self._jobs), now)
+
+                def accept(job_id):
+                    if job_id in self._locks:
+                        return False
+                    return throttle is None or throttle.admit(job_id, self._jobs[job_id].get("concurrency_key"))
+
+                job_ids = self._index.ready_pending(count, accept=accept, now=now, queues=queues, weights=weights)
+                for job_id in job_ids:
+                    job = Job.from_dict(self._jobs[job_id])
+                    job.mark_processing()
+                    records.append({"op": "lock", "id": job_id, "worker_id": worker_id, "locked_at": now,
+                                    "expires_at": now + lease})
+                    records.append({"op": "put", "job": job.to_dict()})
+                    claimed.append(job)
+                if throttle:
+                    throttle.settle(job_ids)
+                    records.extend({"op": "limit", "key": key, "limit": entry}
+                                   for key, entry in throttle.changes().items())
+                return records, claimed
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to claim jobs for {worker_id}: {e}")
+            return []
+
+    def get_limits(self) -> Dict[str, Dict]:
+        try:
+            with self._mutex:
+                self._refresh()
+                return dict(self._limits)
+        except Exception as e:
+            logger.error(f"Failed to read concurrency limits: {e}")
+            return {}
+
+    def save_limit(self, key: str, entry: Dict) -> bool:
+        try:
+            return self._mutate(lambda: ([{"op": "limit", "key": key, "limit": entry}], True))
+        except Exception as e:
+            logger.error(f"Failed to save limit for {key}: {e}")
+            return False
+
+    def delete_limit(self, key: str) -> bool:
+        try:
+            def build_records():
+                if key in self._limits:
+                    return [{"op": "unlimit", "key": key}], True
+                return [], False
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to delete limit for {key}: {e}")
+            return False
+
+    def finish_job(self, job: Job) -> bool:
+        try:
+            def build_records():
+                records = [{"op": "put", "job": job.to_dict()}]
+                if job.id in self._locks:
+                    records.append({"op": "unlock", "id": job.id})
+                return records, True
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to finish job {job.id}: {e}")
+            return False
+
+    def finish_jobs(self, jobs: List[Job]) -> bool:
+        try:
+            def build_records():
+                records = []
+                for job in jobs:
+                    records.append({"op": "put", "job": job.to_dict()})
+                    if job.id in self._locks:
+                        records.append({"op": "unlock", "id": job.id})
+                return records, True
+
+            return self._mutate(build_records)
+        except Exception as e:
+            logger.error(f"Failed to finish {len(jobs)} jobs: {e}")
+            return False
@@ -0,0 +1,370 @@
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from ..utils.filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets, plus +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Every metric, with its type and help text for the Prometheus exposition
+METRICS_HELP = {
+    "jobs_enqueued_total": ("counter", "Jobs added to the queue"),
+    "jobs_claimed_total": ("counter", "Jobs claimed by workers"),
+    "jobs_completed_total": ("counter", "Job runs that completed"),
+    "jobs_failed_total": ("counter", "Job runs that failed"),
+    "job_retries_total": ("counter", "Failed runs scheduled for a retry"),
+    "jobs_dead_total": ("counter", "Jobs moved to the dead letter queue"),
+    "job_wait_seconds": ("histogram", "Time from a job becoming runnable to its claim"),
+    "claim_seconds": ("histogram", "Latency of a worker's claim call"),
+    "job_run_seconds": ("histogram", "Job execution time, by outcome"),
+    "storage_op_seconds": ("histogram", "Latency of each JobStorage call"),
+    "storage_read_bytes_total": ("counter", "Bytes read by JobStorage calls"),
+    "storage_written_bytes_total": ("counter", "Bytes written by JobStorage calls"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """Counters and bucketed histograms of one process.
+
+    Updates take one lock and a bisect, so they are cheap enough for the
+    claim and storage hot paths; with ``enabled`` off they return at once.
+    Series are keyed by name and sorted labels. ``snapshot`` returns a
+    JSON-friendly copy that can be merged with other processes' snapshots.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.instance = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], list] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                # bucket counts (the last one is +Inf), sum
+                series = self._histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+            series[0][bisect_left(BUCKETS, value)] += 1
+            series[1] += value
+
+    def snapshot(self) -> Dict[str, list]:
+        with self._lock:
+            return {
+                "counters": [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                "histograms": [[name, dict(labels), list(counts), total]
+                               for (name, labels), (counts, total) in self._histograms.items()],
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+METRICS = MetricsRegistry()
+
+_current = threading.local()
+
+
+def count_bytes(read: int = 0, written: int = 0):
+    """Charge bytes read or written to the storage call running on this thread"""
+    op = getattr(_current, "op", None)
+    if op is None or not METRICS.enabled:
+        return
+    if read:
+        METRICS.inc("storage_read_bytes_total", read, backend=op[0], op=op[1])
+    if written:
+        METRICS.inc("storage_written_bytes_total", written, backend=op[0], op=op[1])
+
+
+def timed_storage_call(name: str, func):
+    """Wrap a storage method to time it and attribute its I/O to it.
+
+    Calls a storage method makes to another (``finish_job`` saving the
+    job, say) count towards the outer call only.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if getattr(_current, "op", None) is not None or not METRICS.enabled:
+            return func(self, *args, **kwargs)
+        _current.op = (self.backend_name, name)
+        started = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            _current.op = None
+            METRICS.observe("storage_op_seconds", time.perf_counter() - started,
+                            backend=self.backend_name, op=name)
+    return wrapper
+
+
+def merge_snapshots(snapshots: Iterable[Dict[str, list]]) -> Dict[str, list]:
+    counters: Dict[Tuple[str, Labels], float] = {}
+    histograms: Dict[Tuple[str, Labels], list] = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get("counters", []):
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total in snapshot.get("histograms", []):
+            key = (name, tuple(sorted(labels.items())))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+    return {
+        "counters": [[name, dict(labels), value] for (name, labels), value in sorted(counters.items())],
+        "histograms": [[name, dict(labels), counts, total]
+                       for (name, labels), (counts, total) in sorted(histograms.items())],
+    }
+
+
+def quantile(counts: List[int], q: float) -> Optional[float]:
+    """Estimate the ``q`` quantile of a histogram, interpolating within
+    the bucket it falls in (as Prometheus' histogram_quantile does)"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, count in enumerate(counts):
+        if seen + count >= rank and count:
+            if i == len(BUCKETS):
+                return BUCKETS[-1]  # beyond the last bound
+            lower = BUCKETS[i - 1] if i else 0.0
+            return lower + (BUCKETS[i] - lower) * (rank - seen) / count
+        seen += count
+    return BUCKETS[-1]
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = sorted(labels.items()) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + "}"
+
+
+def render_prometheus(snapshot: Dict[str, list]) -> str:
+    """The Prometheus text exposition format (version 0.0.4) of a snapshot"""
+    series: Dict[str, List[str]] = {}
+    for name, labels, value in snapshot["counters"]:
+        value = int(value) if value == int(value) else value
+        series.setdefault(name, []).append(f"queuectl_{name}{_format_labels(labels)} {value}")
+    for name, labels, counts, total in snapshot["histograms"]:
+        lines = series.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(list(BUCKETS) + ["+Inf"], counts):
+            cumulative += count
+            le = bound if isinstance(bound, str) else f"{bound:g}"
+            lines.append(f"queuectl_{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+        lines.append(f"queuectl_{name}_sum{_format_labels(labels)} {total:.6f}")
+        lines.append(f"queuectl_{name}_count{_format_labels(labels)} {cumulative}")
+
+    output = []
+    for name in sorted(series):
+        kind, description = METRICS_HELP.get(name, ("untyped", name))
+        output.append(f"# HELP queuectl_{name} {description}")
+        output.append(f"# TYPE queuectl_{name} {kind}")
+        output.extend(series[name])
+    return "\n".join(output) + "\n"
+
+
+def _process_alive(instance: str) -> bool:
+    """Whether the process that published snapshot ``instance`` still runs"""
+    pid = instance.split("-")[0]
+    if not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # someone else's process
+    return True
+
+
+class MetricsStore:
+    """Per-process metric snapshots in the ``metrics`` directory of the
+    storage, so ``queuectl metrics`` and the HTTP endpoint can add up every
+    worker process sharing it.
+
+    Each process overwrites its own file. Once its process has exited, a
+    snapshot is folded into ``retired.json`` the next time the store is
+    loaded, so counters keep their totals across restarts (until ``clear``)
+    without one file per process piling up. Short-lived processes such as
+    ``queuectl enqueue`` fold their snapshot in directly with ``retire``.
+    """
+
+    RETIRED = "retired"
+
+    def __init__(self, storage_path: Path):
+        self.root = Path(storage_path) / "metrics"
+        self.retired_file = self.root / f"{self.RETIRED}.json"
+        self.lock = FileLock(self.root / "metrics.lock")
+
+    def publish(self, registry: MetricsRegistry = METRICS):
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f"{registry.instance}.json"
+        temp_file = path.with_suffix(".tmp")
+        with open(temp_file, "w") as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(temp_file, path)
+
+    @staticmethod
+    def _read(path: Path) -> Optional[Dict[str, list]]:
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping metrics file {path}: {e}")
+            return None
+
+    def _fold(self, snapshots: List[Dict[str, list]]):
+        """Add ``snapshots`` to the retired totals; caller holds the lock"""
+        retired = self._read(self.retired_file)
+        merged = merge_snapshots(([retired] if retired else []) + snapshots)
+        temp_file = self.retired_file.with_suffix(".tmp")
+        with open(temp_file, "w") as f:
+            json.dump(merged, f)
+        os.replace(temp_file, self.retired_file)
+
+    def retire(self, registry: MetricsRegistry = METRICS):
+        """Fold this process's metrics into the retired totals, for a
+        process about to exit, and start its registry afresh"""
+        snapshot = registry.snapshot()
+        if not snapshot["counters"] and not snapshot["histograms"]:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            self._fold([snapshot])
+            # Its last published snapshot is part of what was just folded
+            (self.root / f"{registry.instance}.json").unlink(missing_ok=True)
+        registry.reset()
+
+    def load(self) -> Dict[str, list]:
+        """Every process's metrics added up, folding away exited processes'"""
+        if not self.root.is_dir():
+            return merge_snapshots([])
+        with self.lock:
+            live, exited = [], []
+            for path in sorted(self.root.glob("*.json")):
+                if path.stem == self.RETIRED:
+                    continue
+                snapshot = self._read(path)
+                if snapshot is None:
+                    continue
+                if _process_alive(path.stem):
+                    live.append(snapshot)
+                else:
+                    exited.append((path, snapshot))
+            if exited:
+                # Fold first: a crash in between counts twice, never loses a total
+                self._fold([snapshot for _, snapshot in exited])
+                for path, _ in exited:
+                    path.unlink()
+            retired = self._read(self.retired_file)
+            return merge_snapshots(live + ([retired] if retired else []))
+
+    def clear(self) -> int:
+        removed = 0
+        for path in self.root.glob("*.json"):
+            path.unlink()
+            removed += 1
+        METRICS.reset()
+        return removed
+
+
+class MetricsPublisher:
+    """Writes this process's snapshot every ``interval`` seconds and, with a
+    ``port``, serves the merged metrics as Prometheus text on localhost"""
+
+    def __init__(self, store: MetricsStore, interval: float = 5.0, port: Optional[int] = None):
+        self.store = store
+        self.interval = interval
+        self.port = port
+        self.server: Optional[ThreadingHTTPServer] = None
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        self._stop.clear()
+        thread = threading.Thread(target=self._publish_loop, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        if self.port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", self.port), self._handler())
+            self.server.daemon_threads = True
+            self.port = self.server.server_address[1]  # the one picked for port 0
+            thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            logger.info(f"Serving metrics on http://127.0.0.1:{self.port}/metrics")
+
+    def _handler(self):
+        store = self.store
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                store.publish()  # our own series, fresh
+                body = render_prometheus(store.load()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"metrics: {format % args}")
+
+        return Handler
+
+    def _publish_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.store.publish()
+            except Exception as e:
+                logger.error(f"Failed to publish metrics: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads.clear()
+        try:
+            self.store.publish()
+        except Exception as e:
+            logger.error(f"Failed to publish metrics: {e}")
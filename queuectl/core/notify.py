@@ -0,0 +1,102 @@
+import os
+import select
+import socket
+import logging
+import uuid
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WakeupListener:
+    """One idle worker's end of the wake-up channel: a bound datagram socket"""
+
+    def __init__(self, sock: socket.socket, path: Path):
+        self.sock = sock
+        self.path = path
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def wait(self, timeout: float) -> bool:
+        """Block until notified or ``timeout`` passes; True when notified"""
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if ready:
+            self.drain()
+        return bool(ready)
+
+    def drain(self):
+        # Several enqueues may have queued datagrams; one wake-up covers them
+        while True:
+            try:
+                self.sock.recv(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+
+    def close(self):
+        self.sock.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class JobNotifier:
+    """Wakes idle workers when new work is available.
+
+    Each listening worker binds a Unix datagram socket under ``root``;
+    ``notify`` sends a byte to every socket there. Sockets left behind by
+    dead processes refuse the datagram and are removed. Where Unix sockets
+    are unavailable, ``listen`` returns None and workers keep polling.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def listen(self) -> Optional[WakeupListener]:
+        if not hasattr(socket, "AF_UNIX"):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        path = self.root / f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            sock.bind(str(path))
+        except OSError as e:
+            # e.g. a storage path longer than sun_path allows
+            logger.warning(f"Wake-up socket unavailable, falling back to polling: {e}")
+            sock.close()
+            return None
+        sock.setblocking(False)
+        return WakeupListener(sock, path)
+
+    def notify(self) -> int:
+        """Wake every listening worker; returns how many were reached"""
+        if not hasattr(socket, "AF_UNIX"):
+            return 0
+        try:
+            paths = list(self.root.glob("*.sock"))
+        except OSError:
+            return 0
+        if not paths:
+            return 0
+
+        woken = 0
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            for path in paths:
+                try:
+                    sock.sendto(b"!", str(path))
+                    woken += 1
+                except BlockingIOError:
+                    woken += 1  # its buffer is full of wake-ups already
+                except (ConnectionRefusedError, FileNotFoundError):
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+                except OSError as e:
+                    logger.debug(f"Failed to wake {path}: {e}")
+        return woken
@@ -1,63 +1,388 @@
 import logging
+import random
 import time
-from typing import List, Optional, Dict, Any
-from datetime import datetime
-from .job import Job, JobState
-from .storage import JobStorage
+from typing import List, Optional, Dict, Any, Iterable, Tuple, Union
+from .job import Job, JobState, TASK
+from .storage import JobStorage, DEFAULT_LEASE_SECONDS
+from .blobs import BlobStore
+from .capture import StreamCapture
+from .executor import build_argv
+from .tasks import check_task_ref
+from .throttle import Throttle, check_limit, new_limit
+from .dag import ON_PARENT_FAILURE
+from .cache import ResultCache
+from .metrics import METRICS
+from .retention import RetentionPolicy, JobArchive
+from .notify import JobNotifier
+from ..utils.filelock import FileLock
+from ..utils.config import Config
 
 logger = logging.getLogger(__name__)
 
+# Optional job spec fields accepted by build_job and their types
+SPEC_FIELDS = {
+    "max_retries": int,
+    "timeout": (int, float),
+    "backoff_base": (int, float),
+    "delay": (int, float),
+    "run_at": (int, float),
+    "queue": str,
+    "priority": int,
+    "shell": bool,
+    "args": (list, dict),
+    "concurrency_key": str,
+    "after": list,
+    "on_parent_failure": str,
+    "idempotency_key": str,
+    "cache_ttl": (int, float),
+}
+
+# Characters of stderr kept inline in last_error; the rest is in the blob store
+ERROR_SUMMARY_CHARS = 500
+
+# Job output as handed to prepare_completion/prepare_failure
+Output = Union[str, bytes, StreamCapture, None]
+
 class JobQueue:
     def __init__(self, storage: JobStorage):
         self.storage = storage
+        self.config = Config(storage)
+        self.blobs = BlobStore(
+            storage.storage_path / "blobs",
+            compress=self.config.get("output_compress"),
+            max_bytes=self.config.get("output_max_bytes")
+        )
+        self.spool_output = bool(self.config.get("output_spool"))
+        self.tail_bytes = int(self.config.get("output_tail_bytes") or 0)
+        self.results = ResultCache(storage.storage_path, self.config.get("result_cache_entries"))
+        self.archive = JobArchive(storage.storage_path / "archive")
+        self.notifier = JobNotifier(storage.storage_path / "wake")
+        self.lease_seconds = float(self.config.get("lease_seconds") or DEFAULT_LEASE_SECONDS)
         self._running = False
 
     def enqueue(self, command: str, **kwargs) -> Optional[Job]:
+        """Enqueue a job; when its idempotency key is taken, the job holding
+        the key is returned instead"""
         try:
             job = Job(command, **kwargs)
-            if self.storage.save_job(job):
-                logger.info(f"Enqueued job {job.id}: {command}")
-                return job
-            return None
+            if not self._check_parents([job]):
+                return None
+            stored = self._add_jobs([job])
+            if stored is None:
+                return None
+            if stored[0] is not job:
+                logger.info(f"Job {stored[0].id} already holds idempotency key {job.idempotency_key}")
+                return stored[0]
+            logger.info(f"Enqueued job {job.id}: {command}")
+            if job.depends_on:
+                # Storage decided whether it waits, runs or was cancelled
+                return self.storage.get_job(job.id) or job
+            return job
         except Exception as e:
             logger.error(f"Error enqueueing job: {e}")
             return None
 
-    def get_next_pending_job(self, worker_id: str) -> Optional[Job]:
-        pending_jobs = self.storage.get_jobs_by_state(JobState.PENDING)
-        
-        for job in pending_jobs:
-            if self.storage.acquire_job_lock(job.id, worker_id):
-                current_job = self.storage.get_job(job.id)
-                if current_job and current_job.state == JobState.PENDING:
-                    current_job.mark_processing()
-                    if self.storage.save_job(current_job):
-                        return current_job
-                    else:
-                        self.storage.release_job_lock(job.id)
-                else:
-                    self.storage.release_job_lock(job.id)
-        
-        return None
+    def _add_jobs(self, jobs: List[Job]) -> Optional[List[Job]]:
+        """Insert jobs through the storage's idempotency index, completing
+        those the result cache can answer first (see ``storage.add_jobs``)"""
+        cached = {job.id for job in jobs if job.cache_ttl and not job.depends_on and self._serve_from_cache(job)}
+        stored = self.storage.add_jobs(jobs)
+        for index, job in enumerate(jobs):
+            if job.id in cached and (stored is None or stored[index] is not job):
+                self.blobs.delete(job.id)  # the copied output of a job never inserted
+        if stored:
+            added = [job for job, result in zip(jobs, stored) if result is job]
+            for job in added:
+                METRICS.inc("jobs_enqueued_total", queue=job.queue)
+            if any(job.id not in cached for job in added):
+                self.notifier.notify()
+        return stored
+
+    def _check_parents(self, jobs: List[Job]) -> List[Job]:
+        """The jobs whose parents all exist, in ``jobs`` itself, in storage
+        or in the archive; the others are logged and left out.
+
+        A parent archived after completing no longer holds its child back,
+        so it is dropped from ``depends_on``. One archived dead stays, and
+        storage treats it as failed (see dag.py).
+        """
+        valid = list(jobs)
+        while True:
+            known = {job.id for job in valid}
+            rejected = set()
+            for job in valid:
+                for parent_id in list(job.depends_on):
+                    if parent_id in known or self.storage.get_job(parent_id):
+                        continue
+                    archived = self.archive.find(parent_id)
+                    if archived is None:
+                        logger.error(f"Skipping invalid job spec: unknown parent job {parent_id}")
+                        rejected.add(job.id)
+                        break
+                    if archived.state == JobState.COMPLETED:
+                        job.depends_on.remove(parent_id)
+                        if not job.depends_on:
+                            job.state = JobState.PENDING
+            if not rejected:
+                return valid
+            # Children of a rejected job lose their parent in turn
+            valid = [job for job in valid if job.id not in rejected]
+
+    def _serve_from_cache(self, job: Job) -> bool:
+        """Complete ``job`` with the output of an identical job from the
+        result cache, copying its stdout blob"""
+        def serve(entry: Dict[str, Any]) -> bool:
+            if entry["output_ref"]:
+                spool = self.blobs.spool(job.id, "stdout")
+                try:
+                    with self.blobs.open(entry["output_ref"]) as f:
+                        for chunk in iter(lambda: f.read(65536), b""):
+                            spool.write(chunk)
+                except FileNotFoundError:
+                    spool.discard()
+                    return False  # archived along with its job
+                job.output_ref, job.output_bytes = spool.commit(), entry["output_bytes"]
+            job.mark_completed(entry["output"])
+            return True
+
+        if not self.results.lookup(job, serve):
+            return False
+        logger.info(f"Job {job.id} completed from the result cache")
+        return True
+
+    def build_job(self, spec: Union[str, Dict[str, Any]]) -> Job:
+        """Validate a job spec (a command string or a dict) and build its Job"""
+        if isinstance(spec, str):
+            spec = {"command": spec}
+        if not isinstance(spec, dict):
+            raise ValueError("expected a command string or a JSON object")
+
+        kwargs = {}
+        if "task" in spec:
+            if "command" in spec:
+                raise ValueError("give either 'command' or 'task', not both")
+            command = check_task_ref(spec["task"])
+            kwargs["kind"] = TASK
+        else:
+            command = spec.get("command")
+            if not isinstance(command, str) or not command.strip():
+                raise ValueError("'command' must be a non-empty string")
+            if "args" in spec:
+                raise ValueError("'args' only applies to a 'task'")
+
+        for key, value in spec.items():
+            if key in ("command", "task"):
+                continue
+            if key not in SPEC_FIELDS:
+                raise ValueError(f"unknown field '{key}'")
+            if key == "on_parent_failure":
+                if value not in ON_PARENT_FAILURE:
+                    raise ValueError(f"'on_parent_failure' must be one of {', '.join(ON_PARENT_FAILURE)}")
+            elif SPEC_FIELDS[key] is str:
+                if not isinstance(value, str) or not value.strip():
+                    raise ValueError(f"'{key}' must be a non-empty string")
+            elif SPEC_FIELDS[key] is bool:
+                if not isinstance(value, bool):
+                    raise ValueError(f"'{key}' must be true or false")
+            elif key == "args":
+                if not isinstance(value, (list, dict)):
+                    raise ValueError("'args' must be a JSON array or object")
+            elif key == "after":
+                if not isinstance(value, list) or not all(isinstance(job_id, str) and job_id for job_id in value):
+                    raise ValueError("'after' must be a list of job ids")
+                key = "depends_on"
+            elif key == "priority":
+                if isinstance(value, bool) or not isinstance(value, int):
+                    raise ValueError("'priority' must be an integer")
+            elif isinstance(value, bool) or not isinstance(value, SPEC_FIELDS[key]) or value < 0:
+                raise ValueError(f"'{key}' must be a non-negative number")
+            kwargs[key] = value
+        if "delay" in kwargs:
+            kwargs["next_run_at"] = time.time() + kwargs.pop("delay")
+        if "run_at" in kwargs:
+            kwargs["next_run_at"] = kwargs.pop("run_at")
+        if not kwargs.get("shell", True) and "kind" not in kwargs:
+            build_argv(command, shell=False)  # raises on unbalanced quotes
+        return Job(command, **kwargs)
+
+    def enqueue_many(self, specs: Iterable[Union[Job, str, Dict[str, Any]]], batch_size: int = 1000) -> int:
+        """Enqueue jobs in batches, committing each batch with one storage write.
+
+        Specs that fail validation, or name a parent that is neither stored
+        nor in their batch, are logged and skipped. Returns the
+        number of jobs enqueued, leaving out those whose idempotency key
+        was already taken.
+        """
+        enqueued = 0
+        batch: List[Job] = []
+
+        def flush():
+            nonlocal enqueued
+            batch[:] = self._check_parents(batch)
+            stored = self._add_jobs(batch) if batch else None
+            if stored:
+                enqueued += sum(1 for job, result in zip(batch, stored) if result is job)
+            batch.clear()
+
+        for spec in specs:
+            try:
+                batch.append(spec if isinstance(spec, Job) else self.build_job(spec))
+            except ValueError as e:
+                logger.error(f"Skipping invalid job spec: {e}")
+                continue
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+
+        logger.info(f"Enqueued {enqueued} job(s) in batches of {batch_size}")
+        return enqueued
+
+    def get_next_pending_job(self, worker_id: str, queues: Optional[List[str]] = None,
+                             weights: Optional[Dict[str, int]] = None) -> Optional[Job]:
+        jobs = self.claim_batch(worker_id, 1, queues, weights)
+        return jobs[0] if jobs else None
+
+    def claim_batch(self, worker_id: str, count: int, queues: Optional[List[str]] = None,
+                    weights: Optional[Dict[str, int]] = None) -> List[Job]:
+        started = time.perf_counter()
+        jobs = self.storage.claim_batch(worker_id, count, queues, weights, self.lease_seconds)
+        METRICS.observe("claim_seconds", time.perf_counter() - started)
+        for job in jobs:
+            METRICS.inc("jobs_claimed_total", queue=job.queue)
+            METRICS.observe("job_wait_seconds", max(job.started_at - job.runnable_at, 0), queue=job.queue)
+        return jobs
+
+    def renew_leases(self, worker_id: str, job_ids: List[str]) -> int:
+        """Heartbeat: keep the leases on a worker's claimed jobs alive"""
+        if not job_ids:
+            return 0
+        return self.storage.renew_leases(worker_id, job_ids, self.lease_seconds)
+
+    def reclaim_expired_leases(self, now: Optional[float] = None) -> List[Job]:
+        """Fail the jobs whose worker stopped renewing its lease.
+
+        The lost run counts as an attempt, so the job goes back to pending
+        after its retry backoff, or to the DLQ once retries run out.
+        """
+        def reclaim(job: Job):
+            self.prepare_failure(job, "Lease expired: worker stopped sending heartbeats")
+
+        reclaimed = self.storage.reclaim_expired(reclaim, now)
+        if reclaimed:
+            logger.warning(f"Reclaimed {len(reclaimed)} job(s) with expired leases")
+            self.notifier.notify()
+        return reclaimed
+
+    def open_capture(self, job: Job) -> Tuple[StreamCapture, StreamCapture]:
+        """Captures for a claimed job's stdout and stderr, spooling to the
+        blob store unless ``output_spool`` is off"""
+        def capture(stream: str) -> StreamCapture:
+            spool = self.blobs.spool(job.id, stream) if self.spool_output else None
+            return StreamCapture(self.tail_bytes, spool)
+        stdout = capture("stdout")
+        try:
+            return stdout, capture("stderr")
+        except Exception:
+            stdout.discard()
+            raise
 
-    def complete_job(self, job: Job, output: str = None) -> bool:
-        job.mark_completed(output)
-        success = self.storage.save_job(job)
-        if success:
-            self.storage.release_job_lock(job.id)
-        return success
+    def _store_stream(self, job: Job, stream: str, data: Output) -> Tuple[Optional[str], int]:
+        if isinstance(data, StreamCapture):
+            return data.close(), data.size
+        return self.blobs.write(job.id, stream, data)
 
-    def fail_job(self, job: Job, error: str = None) -> bool:
+    @staticmethod
+    def _text(data: Output) -> Optional[str]:
+        if isinstance(data, StreamCapture):
+            return data.text()
+        if isinstance(data, bytes):
+            return data.decode("utf-8", errors="replace")
+        return data
+
+    def _store_output(self, job: Job, stdout: Output = None, stderr: Output = None):
+        """Move captured streams into the blob store, keeping only references"""
+        if stdout:
+            job.output_ref, job.output_bytes = self._store_stream(job, "stdout", stdout)
+        if stderr:
+            job.error_ref, job.error_bytes = self._store_stream(job, "stderr", stderr)
+
+    def prepare_completion(self, job: Job, output: Output = None, stderr: Output = None):
+        """Store a finished job's output and mark it completed, without saving it"""
+        self._store_output(job, output, stderr)
+        inline = None
+        if output and not job.output_ref and self.tail_bytes:
+            # Without a blob, the tail of stdout stays in the record for 'logs'
+            inline = self._text(output)[-self.tail_bytes:]
+        job.mark_completed(inline)
+        METRICS.inc("jobs_completed_total", queue=job.queue)
+        if job.cache_ttl:
+            try:
+                self.results.store(job)
+            except Exception as e:
+                logger.error(f"Failed to cache the result of job {job.id}: {e}")
+
+    def prepare_failure(self, job: Job, error: str = None, stderr: Output = None, output: Output = None):
+        """Store a failed job's output and schedule its retry (or mark it dead),
+        without saving it"""
+        self._store_output(job, output, stderr)
+        if stderr:
+            # Keep enough of stderr in the record for 'dlq list'
+            error = f"{error}: {self._text(stderr)[-ERROR_SUMMARY_CHARS:]}"
         job.mark_failed(error)
+        METRICS.inc("jobs_failed_total", queue=job.queue)
         
         if job.is_expired():
             job.mark_dead()
+            METRICS.inc("jobs_dead_total", queue=job.queue)
             logger.warning(f"Job {job.id} moved to DLQ after {job.attempts} attempts")
-        
-        success = self.storage.save_job(job)
-        if success:
-            self.storage.release_job_lock(job.id)
-        return success
+        elif job.should_retry():
+            delay = self.retry_delay(job)
+            job.schedule_retry(delay)
+            METRICS.inc("job_retries_total", queue=job.queue)
+            logger.info(f"Job {job.id} will retry in {delay:.1f}s (attempt {job.attempts + 1})")
+
+    def retry_delay(self, job: Job) -> float:
+        """Exponential backoff, stretched by up to ``retry_jitter`` of itself"""
+        delay = job.get_retry_delay()
+        jitter = float(self.config.get("retry_jitter") or 0)
+        return delay * (1 + random.uniform(0, jitter)) if jitter else delay
+
+    def complete_job(self, job: Job, output: Output = None, stderr: Output = None) -> bool:
+        self.prepare_completion(job, output, stderr)
+        return self.storage.finish_job(job)
+
+    def fail_job(self, job: Job, error: str = None, stderr: Output = None, output: Output = None) -> bool:
+        self.prepare_failure(job, error, stderr, output)
+        return self.storage.finish_job(job)
+
+    def finish_jobs(self, jobs: List[Job]) -> bool:
+        """Save prepared jobs and release their locks in one storage commit"""
+        return self.storage.finish_jobs(jobs)
+
+    def requeue_job(self, job: Job) -> bool:
+        """Hand a claimed but unstarted job back to the pending queue"""
+        job.state = JobState.PENDING
+        job.attempts = max(job.attempts - 1, 0)
+        job.started_at = None
+        job.updated_at = time.time()
+        if not self.storage.finish_job(job):
+            return False
+        self.notifier.notify()
+        return True
+
+    def fail_worker_jobs(self, worker_prefix: str, error: str) -> int:
+        """Fail the jobs locked by workers whose id starts with ``worker_prefix``"""
+        failed = 0
+        for job_id, lock_info in self.storage.get_locks().items():
+            if not lock_info.get("worker_id", "").startswith(worker_prefix):
+                continue
+            job = self.storage.get_job(job_id)
+            if job is None or job.state != JobState.PROCESSING:
+                self.storage.release_job_lock(job_id)
+                continue
+            if self.fail_job(job, error):
+                failed += 1
+        return failed
 
     def retry_dlq_job(self, job_id: str) -> bool:
         job = self.storage.get_job(job_id)
@@ -69,49 +394,84 @@ class JobQueue:
         job.last_error = None
         job.started_at = None
         job.finished_at = None
-        job.updated_at = datetime.utcnow().isoformat()
+        job.next_run_at = None
+        job.updated_at = time.time()
         
-        return self.storage.save_job(job)
-
-    def get_stats(self) -> Dict[str, Any]:
-        all_jobs = self.storage.get_all_jobs()
-        stats = {
-            "total_jobs": len(all_jobs),
-            "pending": 0,
-            "processing": 0,
-            "completed": 0,
-            "failed": 0,
-            "dead": 0
+        if not self.storage.save_job(job):
+            return False
+        self.notifier.notify()
+        return True
+
+    def get_queue_stats(self) -> Dict[str, Dict[str, float]]:
+        return self.storage.queue_stats()
+
+    def set_limit(self, key: str, concurrency: Optional[int] = None, rate: Optional[str] = None) -> bool:
+        """Limit the jobs with concurrency ``key`` to ``concurrency`` running
+        at once and to ``rate`` starts (e.g. "50/m"), across every worker
+        on this storage. Raises ``ValueError`` for an invalid limit."""
+        check_limit(concurrency, rate)
+        entry = new_limit(concurrency, rate, self.storage.get_limits().get(key))
+        return self.storage.save_limit(key, entry)
+
+    def remove_limit(self, key: str) -> bool:
+        return self.storage.delete_limit(key)
+
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Result cache entries and hit, miss and eviction counters"""
+        return self.results.stats()
+
+    def get_limit_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Each limit with its running jobs, bucket tokens and throttle counters"""
+        limits = self.storage.get_limits()
+        if not limits:
+            return {}
+        running: Dict[str, int] = {}
+        for job in self.storage.get_jobs_by_state(JobState.PROCESSING, lazy=True):
+            if job.concurrency_key in limits:
+                running[job.concurrency_key] = running.get(job.concurrency_key, 0) + 1
+        throttle = Throttle(limits, running)
+        return {
+            key: dict(entry, running=running.get(key, 0), tokens=throttle.available(key))
+            for key, entry in limits.items()
         }
-        
-        for job in all_jobs.values():
-            stats[job.state.value] += 1
-        
-        return stats
 
-    def cleanup_orphaned_locks(self, max_age: float = 3600) -> int:
+    def get_stats(self, recount: bool = False) -> Dict[str, Any]:
+        if recount:
+            return self.storage.recount_stats()
+        return self.storage.get_stats()
+
+    def collect_garbage(self, policy: Optional[RetentionPolicy] = None, dry_run: bool = False,
+                        now: Optional[float] = None) -> List[Job]:
+        """Archive and remove finished jobs that fall outside the retention policy"""
+        policy = policy or RetentionPolicy.from_config(self.config)
+        if not policy.enabled:
+            return []
+        now = now or time.time()
+
+        # One sweeper at a time across processes, or jobs get archived twice
+        self.archive.root.mkdir(parents=True, exist_ok=True)
+        with FileLock(self.archive.root / ".lock"):
+            expired = []
+            for state in (JobState.COMPLETED, JobState.DEAD):
+                expired += policy.expired(self.storage.get_jobs_by_state(state), state, now)
+            if dry_run or not expired:
+                return expired
+
+            # Jobs retried or re-queued since they were read stay. The rest
+            # are archived before the delete commits: a crash in between
+            # leaves a duplicate, never a loss.
+            expired = self.storage.delete_unchanged_jobs(expired, before_delete=self.archive.write)
+            for job in expired:
+                self.blobs.delete(job.id)
+
+        logger.info(f"Archived {len(expired)} finished job(s)")
+        return expired
+
+    def cleanup_orphaned_locks(self, now: Optional[float] = None) -> int:
+        """Release every lock whose lease has expired and reclaim its job;
+        returns how many jobs were reclaimed"""
         try:
-            locks = self.storage.load_config().get('locks', {})
-            current_time = time.time()
-            orphaned_count = 0
-            
-            locks_to_remove = []
-            for job_id, lock_info in locks.items():
-                lock_age = current_time - lock_info.get('locked_at', 0)
-                if lock_age > max_age:
-                    locks_to_remove.append(job_id)
-                    orphaned_count += 1
-            
-            for job_id in locks_to_remove:
-                del locks[job_id]
-            
-            if locks_to_remove:
-                config = self.storage.load_config()
-                config['locks'] = locks
-                self.storage.save_config(config)
-            
-            return orphaned_count
-                
+            return len(self.reclaim_expired_leases(now))
         except Exception as e:
             logger.error(f"Failed to cleanup orphaned locks: {e}")
-            return 0
\ No newline at end of file
+            return 0
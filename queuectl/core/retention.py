@@ -0,0 +1,122 @@
+import gzip
+import json
+import os
+import time
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+from .job import Job, JobState
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """How long finished jobs stay in the live store.
+
+    ``*_seconds`` expires jobs that finished longer ago than that;
+    ``max_*`` keeps only the most recently finished N. ``None`` disables
+    a limit.
+    """
+
+    def __init__(self, completed_seconds: Optional[float] = None, max_completed: Optional[int] = None,
+                 dead_seconds: Optional[float] = None, max_dead: Optional[int] = None):
+        self.limits = {
+            JobState.COMPLETED: (completed_seconds, max_completed),
+            JobState.DEAD: (dead_seconds, max_dead),
+        }
+
+    @classmethod
+    def from_config(cls, config) -> 'RetentionPolicy':
+        # `queuectl config` may have stored the limits as strings
+        def limit(key, kind):
+            value = config.get(key)
+            return None if value is None else kind(value)
+
+        return cls(
+            completed_seconds=limit("retention.completed_seconds", float),
+            max_completed=limit("retention.max_completed", int),
+            dead_seconds=limit("retention.dead_seconds", float),
+            max_dead=limit("retention.max_dead", int),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return any(limit is not None for limits in self.limits.values() for limit in limits)
+
+    def expired(self, jobs: List[Job], state: JobState, now: float) -> List[Job]:
+        """Jobs in ``state`` (all given) that fall outside the policy"""
+        max_age, max_count = self.limits[state]
+        if max_age is None and max_count is None:
+            return []
+
+        # Newest first, so the count limit keeps the head of the list
+        jobs = sorted(jobs, key=lambda job: job.finished_at or job.updated_at, reverse=True)
+        expired = []
+        for position, job in enumerate(jobs):
+            too_old = max_age is not None and (job.finished_at or job.updated_at) < now - max_age
+            too_many = max_count is not None and position >= max_count
+            if too_old or too_many:
+                expired.append(job)
+        return expired
+
+
+class JobArchive:
+    """Gzipped JSONL segments of archived jobs, partitioned by finish day.
+
+    Layout: ``<root>/<YYYY-MM-DD>/<unix-ms>-<pid>-<count>.jsonl.gz``.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    @staticmethod
+    def _day(job: Job) -> str:
+        finished = job.finished_at or job.updated_at
+        return datetime.fromtimestamp(finished, timezone.utc).strftime("%Y-%m-%d")
+
+    def write(self, jobs: List[Job]) -> List[Path]:
+        """Append ``jobs`` as new segments and make them durable"""
+        by_day: Dict[str, List[Job]] = {}
+        for job in jobs:
+            by_day.setdefault(self._day(job), []).append(job)
+
+        segments = []
+        stamp = int(time.time() * 1000)
+        for day, day_jobs in sorted(by_day.items()):
+            directory = self.root / day
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"{stamp}-{os.getpid()}-{len(day_jobs)}.jsonl.gz"
+            temp_file = path.with_name(path.name + ".tmp")
+            with open(temp_file, "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                    for job in day_jobs:
+                        f.write(json.dumps(job.to_dict(), separators=(",", ":")).encode() + b"\n")
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(temp_file, path)
+            segments.append(path)
+        return segments
+
+    def segments(self, day: Optional[str] = None) -> List[Path]:
+        pattern = f"{day}/*.jsonl.gz" if day else "*/*.jsonl.gz"
+        return sorted(self.root.glob(pattern))
+
+    @staticmethod
+    def segment_count(path: Path) -> int:
+        return int(path.name.split(".")[0].rsplit("-", 1)[1])
+
+    def iter_jobs(self, day: Optional[str] = None, newest_first: bool = False) -> Iterator[Job]:
+        segments = self.segments(day)
+        if newest_first:
+            segments.reverse()
+        for path in segments:
+            with gzip.open(path, "rb") as f:
+                for line in f:
+                    yield Job.from_dict(json.loads(line))
+
+    def find(self, job_id: str, day: Optional[str] = None) -> Optional[Job]:
+        for job in self.iter_jobs(day, newest_first=True):
+            if job.id == job_id:
+                return job
+        return None
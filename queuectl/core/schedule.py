@@ -0,0 +1,222 @@
+import heapq
+import json
+import os
+import time
+import uuid
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+from ..utils.filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# (name, lowest, highest) of the five cron fields
+CRON_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day of month", 1, 31),
+    ("month", 1, 12),
+    ("day of week", 0, 6),
+)
+
+# Give up looking for a fire time this far ahead (e.g. "0 0 31 2 *")
+MAX_LOOKAHEAD_DAYS = 366 * 5
+
+
+def _parse_field(text: str, name: str, low: int, high: int) -> Set[int]:
+    if name == "day of week":
+        high = 7  # 7 is Sunday too
+    values = set()
+    for part in text.split(","):
+        base, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if step < 1:
+            raise ValueError(f"bad step in {name} field: {part!r}")
+        if base == "*":
+            start, end = low, high
+        elif "-" in base:
+            start, end = (int(value) for value in base.split("-", 1))
+        else:
+            start = int(base)
+            end = high if step_text else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"{name} field out of range: {part!r}")
+        values.update(range(start, end + 1, step))
+    if name == "day of week":
+        values = {value % 7 for value in values}
+    return values
+
+
+class CronExpression:
+    """A five-field cron expression (minute hour day-of-month month day-of-week).
+
+    Supports ``*``, numbers, ranges, lists and ``/`` steps, evaluated in
+    local time. As in cron, when both day fields are restricted a day
+    matching either one fires.
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"expected 5 cron fields, got {len(fields)}: {expression!r}")
+        try:
+            parsed = [_parse_field(text, *spec) for text, spec in zip(fields, CRON_FIELDS)]
+        except ValueError as e:
+            raise ValueError(f"invalid cron expression {expression!r}: {e}") from None
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        # cron counts Sunday as 0; datetime.weekday() counts Monday as 0
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, timestamp: float) -> float:
+        """First fire time strictly after ``timestamp`` (epoch seconds)"""
+        moment = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=MAX_LOOKAHEAD_DAYS)
+        while moment < limit:
+            if moment.month not in self.months:
+                year, month = divmod(moment.month, 12)
+                moment = moment.replace(year=moment.year + year, month=month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"cron expression {self.expression!r} never fires")
+
+
+class ScheduleRegistry:
+    """Recurring jobs, kept in ``schedules.json`` in the storage directory.
+
+    Each entry holds the cron expression, the job options and the next
+    fire time. Changes go through a lock file so several processes can
+    share the registry.
+    """
+
+    def __init__(self, storage_path: Path):
+        self.path = Path(storage_path) / "schedules.json"
+        self.lock = FileLock(Path(storage_path) / "schedules.lock")
+
+    def stat_key(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save(self, schedules: Dict[str, Dict]):
+        temp_file = self.path.with_suffix(".tmp")
+        with open(temp_file, "w") as f:
+            json.dump(schedules, f, indent=2)
+        os.replace(temp_file, self.path)
+
+    def add(self, cron: str, command: str, now: Optional[float] = None, **job_options) -> Dict:
+        expression = CronExpression(cron)  # validates
+        entry = {
+            "id": uuid.uuid4().hex[:8],
+            "cron": cron,
+            "command": command,
+            "options": job_options,
+            "next_run_at": expression.next_after(now or time.time()),
+            "last_run_at": None,
+        }
+        with self.lock:
+            schedules = self.load()
+            schedules[entry["id"]] = entry
+            self._save(schedules)
+        return entry
+
+    def remove(self, schedule_id: str) -> bool:
+        with self.lock:
+            schedules = self.load()
+            if schedules.pop(schedule_id, None) is None:
+                return False
+            self._save(schedules)
+            return True
+
+    def claim_due(self, schedule_id: str, now: float) -> Optional[Dict]:
+        """Advance a due schedule to its next fire time and return it.
+
+        Returns None when the schedule is gone or not yet due, e.g. because
+        another process already fired it, so each fire time yields at most
+        one job however many schedulers run.
+        """
+        with self.lock:
+            schedules = self.load()
+            entry = schedules.get(schedule_id)
+            if entry is None or entry["next_run_at"] > now:
+                return None
+            fired = dict(entry)
+            entry["last_run_at"] = now
+            # Missed fire times are skipped, not replayed
+            entry["next_run_at"] = CronExpression(entry["cron"]).next_after(now)
+            self._save(schedules)
+            return fired
+
+
+class Scheduler:
+    """Materializes recurring jobs from a ``ScheduleRegistry``.
+
+    Keeps a min-heap of ``(next_run_at, schedule_id)``, so each tick only
+    looks at the schedules that are due; the heap is rebuilt when the
+    registry file changes.
+    """
+
+    def __init__(self, queue, registry: Optional[ScheduleRegistry] = None):
+        self.queue = queue
+        self.registry = registry or ScheduleRegistry(queue.storage.storage_path)
+        self._heap: List[Tuple[float, str]] = []
+        self._registry_key = None
+        self.materialized = 0
+
+    def _refresh(self):
+        key = self.registry.stat_key()
+        if key == self._registry_key:
+            return
+        self._registry_key = key
+        self._heap = [(entry["next_run_at"], schedule_id)
+                      for schedule_id, entry in self.registry.load().items()]
+        heapq.heapify(self._heap)
+
+    def next_fire_time(self) -> Optional[float]:
+        self._refresh()
+        return self._heap[0][0] if self._heap else None
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """Enqueue one job for every schedule that is due; returns how many"""
+        now = now or time.time()
+        self._refresh()
+        fired = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, schedule_id = heapq.heappop(self._heap)
+            entry = self.registry.claim_due(schedule_id, now)
+            if entry is None:
+                continue
+            job = self.queue.enqueue(entry["command"], **entry.get("options", {}))
+            if job:
+                fired += 1
+                logger.info(f"Schedule {schedule_id} fired job {job.id}")
+        if fired:
+            self.materialized += fired
+            # Our own writes changed the registry; pick up the new fire times
+            self._registry_key = None
+            self._refresh()
+        return fired
@@ -0,0 +1,521 @@
+import json
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+from .job import Job, JobState, LazyJob, HEAVY_FIELDS, DEFAULT_QUEUE, to_epoch
+from .storage import JobStorage, DEFAULT_LEASE_SECONDS, split_duplicates, unchanged
+from .index import weighted_fair_merge
+from .throttle import Throttle
+from .dag import resolve_dependencies
+from .metrics import count_bytes
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    heavy TEXT,
+    run_at REAL,
+    queue TEXT NOT NULL DEFAULT 'default',
+    priority INTEGER NOT NULL DEFAULT 0,
+    concurrency_key TEXT,
+    idempotency_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS locks (
+    job_id TEXT PRIMARY KEY,
+    worker_id TEXT NOT NULL,
+    locked_at REAL NOT NULL,
+    expires_at REAL
+);
+CREATE TABLE IF NOT EXISTS limits (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+    state TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS jobs_stats_insert AFTER INSERT ON jobs BEGIN
+    INSERT INTO stats (state, count) VALUES (NEW.state, 1)
+        ON CONFLICT (state) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_stats_update AFTER UPDATE OF state ON jobs
+WHEN OLD.state != NEW.state BEGIN
+    UPDATE stats SET count = count - 1 WHERE state = OLD.state;
+    INSERT INTO stats (state, count) VALUES (NEW.state, 1)
+        ON CONFLICT (state) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_stats_delete AFTER DELETE ON jobs BEGIN
+    UPDATE stats SET count = count - 1 WHERE state = OLD.state;
+END;
+"""
+
+# An upsert rather than INSERT OR REPLACE: REPLACE deletes the old row
+# without firing the delete trigger, which would double count.
+UPSERT_JOB = (
+    "INSERT INTO jobs (id, state, created_at, data, heavy, run_at, queue, priority, concurrency_key, "
+    "idempotency_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (id) DO UPDATE SET state = excluded.state, "
+    "created_at = excluded.created_at, data = excluded.data, heavy = excluded.heavy, "
+    "run_at = excluded.run_at, queue = excluded.queue, priority = excluded.priority, "
+    "concurrency_key = excluded.concurrency_key, idempotency_key = excluded.idempotency_key"
+)
+
+
+def _job_row(job: Job) -> tuple:
+    """UPSERT_JOB parameters; heavy fields go in their own column so
+    listings can skip them"""
+    return _record_row(job.to_dict())
+
+
+def _record_row(data: Dict) -> tuple:
+    """UPSERT_JOB parameters for a serialized job (consumed)"""
+    heavy = json.dumps({name: data.pop(name) for name in HEAVY_FIELDS})
+    created_at = to_epoch(data["created_at"])
+    run_at = to_epoch(data.get("next_run_at")) or created_at
+    body = json.dumps(data)
+    count_bytes(written=len(body) + len(heavy))
+    return (data["id"], data["state"], created_at, body, heavy, run_at,
+            data.get("queue") or DEFAULT_QUEUE, data.get("priority") or 0, data.get("concurrency_key"),
+            data.get("idempotency_key"))
+
+
+def _marks(values) -> str:
+    return ", ".join("?" * len(values))
+
+
+def _job_from_row(data: str, heavy: Optional[str]) -> Job:
+    count_bytes(read=len(data) + len(heavy or ""))
+    job_data = json.loads(data)
+    if heavy:
+        job_data.update(json.loads(heavy))
+    return Job.from_dict(job_data)
+
+
+class SQLiteJobStorage(JobStorage):
+    """Job storage backed by a single SQLite database in WAL mode.
+
+    Jobs and locks live in ``queue.db`` inside the storage directory;
+    configuration stays in ``config.json`` so ``Config`` is unaffected.
+    """
+
+    backend_name = "sqlite"
+    db_name = "queue.db"
+
+    def __init__(self, storage_path: str = "queuectl_data"):
+        self._local = threading.local()
+        super().__init__(storage_path)
+        self.db_file = self.storage_path / self.db_name
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if "heavy" not in columns:
+            # Database created before heavy fields were split out
+            conn.execute("ALTER TABLE jobs ADD COLUMN heavy TEXT")
+        if "run_at" not in columns:
+            # Database created before retry scheduling
+            conn.execute("ALTER TABLE jobs ADD COLUMN run_at REAL")
+            conn.execute("UPDATE jobs SET run_at = created_at")
+        if "queue" not in columns:
+            # Database created before named queues
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN queue TEXT NOT NULL DEFAULT '{DEFAULT_QUEUE}'")
+            conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        if "concurrency_key" not in columns:
+            # Database created before concurrency limits; no job has a key yet
+            conn.execute("ALTER TABLE jobs ADD COLUMN concurrency_key TEXT")
+        if "idempotency_key" not in columns:
+            # Database created before idempotency keys
+            conn.execute("ALTER TABLE jobs ADD COLUMN idempotency_key TEXT")
+        if "expires_at" not in [row[1] for row in conn.execute("PRAGMA table_info(locks)")]:
+            # Database created before leases; existing locks get the default lease
+            conn.execute("ALTER TABLE locks ADD COLUMN expires_at REAL")
+            conn.execute("UPDATE locks SET expires_at = locked_at + ?", (DEFAULT_LEASE_SECONDS,))
+        # Claims walk each queue's pending jobs by priority, then ready time
+        conn.execute("DROP INDEX IF EXISTS idx_jobs_run_at")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (state, queue, priority DESC, run_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_concurrency_key ON jobs (concurrency_key, state) "
+                     "WHERE concurrency_key IS NOT NULL")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_idempotency_key ON jobs (idempotency_key) "
+                     "WHERE idempotency_key IS NOT NULL")
+        self._credit: Dict[tuple, Dict[str, int]] = {}
+        if conn.execute("SELECT 1 FROM stats LIMIT 1").fetchone() is None:
+            # Database created before counters existed
+            self.recount_stats()
+
+    def _initialize_files(self):
+        if not self.config_file.exists():
+            with open(self.config_file, 'w') as f:
+                json.dump({}, f)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads, and
+        # workers run one thread each.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_file), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Yield the thread's connection inside a write transaction"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _put_jobs(conn: sqlite3.Connection, jobs: List[Job]):
+        """Upsert jobs, with the dependency updates they cause (see dag.py)"""
+        def lookup(job_id):
+            row = conn.execute("SELECT data, heavy FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            record = json.loads(row[0])
+            if row[1]:
+                record.update(json.loads(row[1]))
+            return record
+
+        records = {job.id: job.to_dict() for job in jobs}
+        records.update(resolve_dependencies(records, lookup))
+        conn.executemany(UPSERT_JOB, [_record_row(record) for record in records.values()])
+
+    def _write(self, sql: str, params=()) -> int:
+        with self._transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def save_job(self, job: Job) -> bool:
+        try:
+            with self._transaction() as conn:
+                self._put_jobs(conn, [job])
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save job {job.id}: {e}")
+            return False
+
+    def save_jobs(self, jobs: List[Job]) -> bool:
+        """Insert or replace many jobs in a single transaction"""
+        try:
+            with self._transaction() as conn:
+                self._put_jobs(conn, jobs)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save {len(jobs)} jobs: {e}")
+            return False
+
+    def add_jobs(self, jobs: List[Job]) -> Optional[List[Job]]:
+        try:
+            with self._transaction() as conn:
+                def existing(key):
+                    row = conn.execute("SELECT data, heavy FROM jobs WHERE idempotency_key = ?", (key,)).fetchone()
+                    return _job_from_row(*row) if row else None
+
+                new_jobs, result = split_duplicates(jobs, existing)
+                if new_jobs:
+                    self._put_jobs(conn, new_jobs)
+            return result
+        except Exception as e:
+            logger.error(f"Failed to add {len(jobs)} jobs: {e}")
+            return None
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        try:
+            row = self._connection().execute(
+                "SELECT data, heavy FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            return _job_from_row(*row) if row else None
+        except Exception as e:
+            logger.error(f"Failed to get job {job_id}: {e}")
+            return None
+
+    def _load_heavy(self, job_id: str) -> Dict:
+        row = self._connection().execute("SELECT heavy FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def _jobs_from_rows(self, rows, lazy: bool) -> List[Job]:
+        if lazy:
+            rows = list(rows)
+            count_bytes(read=sum(len(data) for (data,) in rows))
+            return [LazyJob.from_dict(json.loads(data), self._load_heavy) for (data,) in rows]
+        return [_job_from_row(data, heavy) for data, heavy in rows]
+
+    def get_all_jobs(self, lazy: bool = False) -> Dict[str, Job]:
+        try:
+            columns = "data" if lazy else "data, heavy"
+            rows = self._connection().execute(f"SELECT {columns} FROM jobs ORDER BY created_at")
+            return {job.id: job for job in self._jobs_from_rows(rows, lazy)}
+        except Exception as e:
+            logger.error(f"Failed to get all jobs: {e}")
+            return {}
+
+    def get_jobs_by_state(self, state: JobState, lazy: bool = False) -> List[Job]:
+        try:
+            columns = "data" if lazy else "data, heavy"
+            rows = self._connection().execute(
+                f"SELECT {columns} FROM jobs WHERE state = ? ORDER BY created_at", (state.value,)
+            )
+            return self._jobs_from_rows(rows, lazy)
+        except Exception as e:
+            logger.error(f"Failed to get {state.value} jobs: {e}")
+            return []
+
+    def delete_job(self, job_id: str) -> bool:
+        try:
+            return self._write("DELETE FROM jobs WHERE id = ?", (job_id,)) > 0
+        except Exception as e:
+            logger.error(f"Failed to delete job {job_id}: {e}")
+            return False
+
+    def delete_jobs(self, job_ids: List[str]) -> int:
+        try:
+            with self._transaction() as conn:
+                return conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids]).rowcount
+        except Exception as e:
+            logger.error(f"Failed to delete {len(job_ids)} jobs: {e}")
+            return 0
+
+    def delete_unchanged_jobs(self, jobs: List[Job],
+                              before_delete: Optional[Callable[[List[Job]], None]] = None) -> List[Job]:
+        try:
+            with self._transaction() as conn:
+                doomed = []
+                for job in jobs:
+                    row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job.id,)).fetchone()
+                    if row and unchanged(json.loads(row[0]), job):
+                        doomed.append(job)
+                if doomed:
+                    if before_delete:
+                        before_delete(doomed)
+                    conn.executemany("DELETE FROM jobs WHERE id = ?", [(job.id,) for job in doomed])
+                return doomed
+        except Exception as e:
+            logger.error(f"Failed to delete {len(jobs)} jobs: {e}")
+            return []
+
+    def get_locks(self) -> Dict[str, Dict]:
+        try:
+            rows = self._connection().execute("SELECT job_id, worker_id, locked_at, expires_at FROM locks")
+            return {job_id: {"worker_id": worker_id, "locked_at": locked_at, "expires_at": expires_at}
+                    for job_id, worker_id, locked_at, expires_at in rows}
+        except Exception as e:
+            logger.error(f"Failed to get locks: {e}")
+            return {}
+
+    def acquire_job_lock(self, job_id: str, worker_id: str, lease: float = DEFAULT_LEASE_SECONDS) -> bool:
+        try:
+            now = time.time()
+            return self._write(
+                "INSERT OR IGNORE INTO locks (job_id, worker_id, locked_at, expires_at) VALUES (?, ?, ?, ?)",
+                (job_id, worker_id, now, now + lease)
+            ) == 1
+        except Exception as e:
+            logger.error(f"Failed to acquire lock for job {job_id}: {e}")
+            return False
+
+    def release_job_lock(self, job_id: str) -> bool:
+        try:
+            return self._write("DELETE FROM locks WHERE job_id = ?", (job_id,)) > 0
+        except Exception as e:
+            logger.error(f"Failed to release lock for job {job_id}: {e}")
+            return False
+
+    def renew_leases(self, worker_id: str, job_ids: List[str], lease: float = DEFAULT_LEASE_SECONDS) -> int:
+        try:
+            with self._transaction() as conn:
+                expires_at = time.time() + lease
+                return conn.executemany(
+                    "UPDATE locks SET expires_at = ? WHERE job_id = ? AND worker_id = ?",
+                    [(expires_at, job_id, worker_id) for job_id in job_ids]
+                ).rowcount
+        except Exception as e:
+            logger.error(f"Failed to renew leases for {worker_id}: {e}")
+            return 0
+
+    def reclaim_expired(self, reclaim: Callable[[Job], None], now: Optional[float] = None) -> List[Job]:
+        now = time.time() if now is None else now
+        try:
+            with self._transaction() as conn:
+                rows = conn.execute(
+                    "SELECT locks.job_id, jobs.state, jobs.data, jobs.heavy FROM locks "
+                    "LEFT JOIN jobs ON jobs.id = locks.job_id WHERE locks.expires_at <= ?",
+                    (now,)
+                ).fetchall()
+                reclaimed = []
+                for job_id, state, data, heavy in rows:
+                    if state == JobState.PROCESSING.value:
+                        job = _job_from_row(data, heavy)
+                        reclaim(job)
+                        reclaimed.append(job)
+                    conn.execute("DELETE FROM locks WHERE job_id = ?", (job_id,))
+                self._put_jobs(conn, reclaimed)
+                return reclaimed
+        except Exception as e:
+            logger.error(f"Failed to reclaim expired leases: {e}")
+            return []
+
+    def claim_batch(self, worker_id: str, count: int, queues: Optional[List[str]] = None,
+                    weights: Optional[Dict[str, int]] = None,
+                    lease: float = DEFAULT_LEASE_SECONDS) -> List[Job]:
+        try:
+            with self._transaction() as conn:
+                now = time.time()
+                names = list(queues) if queues else [row[0] for row in conn.execute(
+                    "SELECT DISTINCT queue FROM jobs WHERE state = ? ORDER BY queue", (JobState.PENDING.value,)
+                )]
+                throttle = self._throttle(conn, now)
+                if throttle:
+                    blocked = throttle.blocked_keys()
+                    if blocked:
+                        for (key,) in conn.execute(
+                                f"SELECT DISTINCT concurrency_key FROM jobs WHERE concurrency_key IN "
+                                f"({_marks(blocked)}) AND state = ? AND run_at <= ?",
+                                (*blocked, JobState.PENDING.value, now)):
+                            throttle.count_throttled(key, blocked[key])
+
+                sources = {name: self._ready_rows(conn, name, now, count, throttle) for name in names}
+                accept = (lambda row: throttle.admit(row[0], row[3])) if throttle else None
+                rows = weighted_fair_merge(sources, count, weights, self._credit.setdefault(tuple(names), {}),
+                                           accept)
+
+                claimed = []
+                for _, data, heavy, _ in rows:
+                    job = _job_from_row(data, heavy)
+                    job.mark_processing()
+                    conn.execute(UPSERT_JOB, _job_row(job))
+                    conn.execute(
+                        "INSERT INTO locks (job_id, worker_id, locked_at, expires_at) VALUES (?, ?, ?, ?)",
+                        (job.id, worker_id, now, now + lease)
+                    )
+                    claimed.append(job)
+                if throttle:
+                    throttle.settle(job.id for job in claimed)
+                    conn.executemany("UPDATE limits SET data = ? WHERE key = ?",
+                                     [(json.dumps(entry), key) for key, entry in throttle.changes().items()])
+                return claimed
+        except Exception as e:
+            logger.error(f"Failed to claim jobs for {worker_id}: {e}")
+            return []
+
+    @staticmethod
+    def _ready_rows(conn: sqlite3.Connection, queue: str, now: float, count: int,
+                    throttle: Optional[Throttle]) -> Iterator[tuple]:
+        """Due, unlocked jobs of ``queue`` in claim order, read ``count`` at
+        a time as the claim asks for more.
+
+        Jobs of keys at their limit are left out of the scan, so they never
+        hold up the jobs behind them; a key that fills up partway through
+        is left out of the follow-up scans. Admission itself is up to the
+        caller, for the rows it takes.
+        """
+        offered: List[str] = []
+        while True:
+            sql = ("SELECT id, data, heavy, concurrency_key FROM jobs WHERE state = ? AND queue = ? "
+                   "AND run_at <= ? AND id NOT IN (SELECT job_id FROM locks)")
+            params = [JobState.PENDING.value, queue, now]
+            blocked = throttle.blocked_keys() if throttle else {}
+            if blocked:
+                sql += f" AND (concurrency_key IS NULL OR concurrency_key NOT IN ({_marks(blocked)}))"
+                params += list(blocked)
+            if offered:
+                sql += f" AND id NOT IN ({_marks(offered)})"
+                params += offered
+            page = conn.execute(sql + " ORDER BY priority DESC, run_at LIMIT ?", (*params, count)).fetchall()
+            yield from page
+            if len(page) < count:
+                return  # the filters only tighten, so nothing more is waiting
+            offered += [row[0] for row in page]
+
+    @staticmethod
+    def _throttle(conn: sqlite3.Connection, now: float) -> Optional[Throttle]:
+        limits = {key: json.loads(data) for key, data in conn.execute("SELECT key, data FROM limits")}
+        if not limits:
+            return None
+        running = dict(conn.execute(
+            "SELECT jobs.concurrency_key, COUNT(*) FROM locks JOIN jobs ON jobs.id = locks.job_id "
+            "WHERE jobs.concurrency_key IS NOT NULL GROUP BY jobs.concurrency_key"
+        ))
+        return Throttle(limits, running, now)
+
+    def get_limits(self) -> Dict[str, Dict]:
+        try:
+            rows = self._connection().execute("SELECT key, data FROM limits")
+            return {key: json.loads(data) for key, data in rows}
+        except Exception as e:
+            logger.error(f"Failed to read concurrency limits: {e}")
+            return {}
+
+    def save_limit(self, key: str, entry: Dict) -> bool:
+        try:
+            self._write("INSERT INTO limits (key, data) VALUES (?, ?) "
+                        "ON CONFLICT (key) DO UPDATE SET data = excluded.data", (key, json.dumps(entry)))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save limit for {key}: {e}")
+            return False
+
+    def delete_limit(self, key: str) -> bool:
+        try:
+            return self._write("DELETE FROM limits WHERE key = ?", (key,)) > 0
+        except Exception as e:
+            logger.error(f"Failed to delete limit for {key}: {e}")
+            return False
+
+    def finish_job(self, job: Job) -> bool:
+        try:
+            with self._transaction() as conn:
+                self._put_jobs(conn, [job])
+                conn.execute("DELETE FROM locks WHERE job_id = ?", (job.id,))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to finish job {job.id}: {e}")
+            return False
+
+    def finish_jobs(self, jobs: List[Job]) -> bool:
+        try:
+            with self._transaction() as conn:
+                self._put_jobs(conn, jobs)
+                conn.executemany("DELETE FROM locks WHERE job_id = ?", [(job.id,) for job in jobs])
+            return True
+        except Exception as e:
+            logger.error(f"Failed to finish {len(jobs)} jobs: {e}")
+            return False
+
+    def queue_stats(self) -> Dict[str, Dict[str, float]]:
+        try:
+            rows = self._connection().execute(
+                "SELECT queue, COUNT(*), MIN(created_at) FROM jobs WHERE state = ? GROUP BY queue",
+                (JobState.PENDING.value,)
+            )
+            return {name: {"pending": count, "oldest_created_at": oldest} for name, count, oldest in rows}
+        except Exception as e:
+            logger.error(f"Failed to read queue stats: {e}")
+            return {}
+
+    def get_stats(self) -> Dict[str, int]:
+        try:
+            rows = self._connection().execute("SELECT state, count FROM stats")
+            return self._format_stats(dict(rows.fetchall()))
+        except Exception as e:
+            logger.error(f"Failed to read stats: {e}")
+            return self._format_stats({})
+
+    def recount_stats(self) -> Dict[str, int]:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM stats")
+            conn.execute("INSERT INTO stats (state, count) SELECT state, COUNT(*) FROM jobs GROUP BY state")
+            return self._format_stats(dict(conn.execute("SELECT state, count FROM stats").fetchall()))
@@ -1,19 +1,157 @@
 import json
 import os
 import time
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from pathlib import Path
 import logging
-from .job import Job, JobState
+import threading
+from .job import Job, JobState, LazyJob, to_epoch
+from .index import JobIndex
+from .throttle import Throttle
+from .dag import resolve_dependencies
+from .metrics import count_bytes, timed_storage_call
+from ..utils.filelock import FileLock
 
 logger = logging.getLogger(__name__)
 
+BACKENDS = ("json", "sqlite", "journal")
+
+# How long a claim stays valid without a heartbeat from its worker
+DEFAULT_LEASE_SECONDS = 15.0
+
+# Storage calls whose latency and I/O are recorded in the metrics, on every backend
+STORAGE_OPS = (
+    "save_job", "save_jobs", "add_jobs", "get_job", "get_all_jobs", "get_jobs_by_state",
+    "delete_job", "delete_jobs", "delete_unchanged_jobs", "get_locks", "acquire_job_lock", "release_job_lock",
+    "renew_leases", "reclaim_expired", "claim_batch", "get_limits", "save_limit",
+    "delete_limit", "finish_job", "finish_jobs", "queue_stats", "get_stats", "recount_stats",
+)
+
+
+def lease_expires_at(lock_info: Dict) -> float:
+    """When a lock's lease runs out; locks from before leases get the default"""
+    expires_at = lock_info.get("expires_at")
+    if expires_at is None:
+        return lock_info.get("locked_at", 0) + DEFAULT_LEASE_SECONDS
+    return expires_at
+
+
+def open_storage(storage_path: str = "queuectl_data", backend: Optional[str] = None) -> 'JobStorage':
+    """Open the storage backend for ``storage_path``.
+
+    The backend can be forced with a ``<backend>:`` prefix on the path
+    (``sqlite:queuectl_data``, ``journal:queuectl_data``) or the ``backend`` argument; otherwise the
+    ``storage_backend`` key of the directory's ``config.json`` decides,
+    falling back to whatever data is already present.
+    """
+    prefix, sep, rest = storage_path.partition(":")
+    if sep and prefix in BACKENDS:
+        backend, storage_path = prefix, rest
+
+    if backend is None:
+        config_file = Path(storage_path) / "config.json"
+        if config_file.exists():
+            try:
+                with open(config_file, 'r') as f:
+                    backend = json.load(f).get("storage_backend")
+            except (OSError, ValueError):
+                backend = None
+    if backend is None:
+        path = Path(storage_path)
+        if (path / "queue.db").exists():
+            backend = "sqlite"
+        elif (path / "snapshot.json").exists() or any(path.glob("journal.*.log")):
+            backend = "journal"
+        else:
+            backend = "json"
+
+    if backend == "sqlite":
+        from .sqlite_storage import SQLiteJobStorage
+        return SQLiteJobStorage(storage_path)
+    if backend == "journal":
+        from .journal_storage import JournalJobStorage
+        return JournalJobStorage(storage_path)
+    if backend == "json":
+        return JobStorage(storage_path)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def running_by_key(locked_ids, jobs_data: Dict[str, Dict]) -> Dict[str, int]:
+    """Locked jobs per concurrency key"""
+    running: Dict[str, int] = {}
+    for job_id in locked_ids:
+        key = (jobs_data.get(job_id) or {}).get("concurrency_key")
+        if key:
+            running[key] = running.get(key, 0) + 1
+    return running
+
+
+def unchanged(record: Optional[Dict], job: Job) -> bool:
+    """Whether a stored record is still at the state and update ``job`` was read at"""
+    if record is None or record["state"] != job.state.value:
+        return False
+    return (to_epoch(record.get("updated_at")) or to_epoch(record["created_at"])) == job.updated_at
+
+
+def split_duplicates(jobs: List[Job], existing: Callable[[str], Optional[Job]]) -> Tuple[List[Job], List[Job]]:
+    """Separate the jobs to insert from those whose idempotency key is taken.
+
+    Returns ``(new jobs, result)``: ``result`` follows ``jobs``, with each
+    duplicate replaced by the job holding its key, i.e. the stored job
+    ``existing(key)`` returns or an earlier job of the same batch.
+    """
+    holders: Dict[str, Job] = {}
+    new_jobs, result = [], []
+    for job in jobs:
+        key = job.idempotency_key
+        holder = (holders.get(key) or existing(key)) if key else None
+        if holder is None:
+            if key:
+                holders[key] = job
+            new_jobs.append(job)
+            holder = job
+        result.append(holder)
+    return new_jobs, result
+
+
+def migrate_storage(source: 'JobStorage', target: 'JobStorage') -> int:
+    """Copy every job, lock and concurrency limit from ``source`` into ``target``"""
+    jobs = list(source.get_all_jobs().values())
+    if not target.save_jobs(jobs):
+        raise RuntimeError(f"Failed to write {len(jobs)} jobs to {target.storage_path}")
+    for job_id, lock_info in source.get_locks().items():
+        target.acquire_job_lock(job_id, lock_info.get("worker_id", "migrated"),
+                                max(lease_expires_at(lock_info) - time.time(), 0))
+    for key, entry in source.get_limits().items():
+        target.save_limit(key, entry)
+    return len(jobs)
+
+
+def _instrument(cls):
+    for name in STORAGE_OPS:
+        if name in cls.__dict__:
+            setattr(cls, name, timed_storage_call(name, cls.__dict__[name]))
+
+
 class JobStorage:
+    backend_name = "json"
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _instrument(cls)
+
     def __init__(self, storage_path: str = "queuectl_data"):
         self.storage_path = Path(storage_path)
         self.jobs_file = self.storage_path / "jobs.json"
         self.locks_file = self.storage_path / "locks.json"
         self.config_file = self.storage_path / "config.json"
+        self.stats_file = self.storage_path / "stats.json"
+        self.limits_file = self.storage_path / "limits.json"
+        self._lock = FileLock(self.storage_path / "queue.lock")
+        self._cache: Dict[Path, tuple] = {}
+        self._index_mutex = threading.Lock()
+        self._index: Optional[JobIndex] = None
+        self._index_source: Optional[Dict] = None
         
         self._ensure_storage_dir()
         self._initialize_files()
@@ -22,49 +160,169 @@ class JobStorage:
         self.storage_path.mkdir(exist_ok=True)
 
     def _initialize_files(self):
-        for file_path in [self.jobs_file, self.locks_file, self.config_file]:
+        for file_path in [self.jobs_file, self.locks_file, self.config_file, self.limits_file]:
             if not file_path.exists():
                 with open(file_path, 'w') as f:
                     json.dump({}, f)
 
-    def _atomic_file_operation(self, file_path, operation):
-        """Simple atomic file operation using file moves"""
+    @staticmethod
+    def _stat_key(stat: os.stat_result) -> tuple:
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _read_json(self, file_path) -> Dict:
+        """Parsed contents of ``file_path``, shared with the cache.
+
+        The document is only re-parsed when its mtime, size or inode
+        changed since the last read, i.e. when another process (or another
+        storage instance) replaced it. Callers must not mutate the result.
+        """
+        try:
+            key = self._stat_key(os.stat(file_path))
+        except FileNotFoundError:
+            return {}
+
+        cached = self._cache.get(file_path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        with open(file_path, 'r') as f:
+            # Key the cache on the file actually read, which may already be
+            # newer than the one stat() saw
+            key = self._stat_key(os.fstat(f.fileno()))
+            data = json.load(f)
+        count_bytes(read=key[1])
+        self._cache[file_path] = (key, data)
+        return data
+
+    def _write_json(self, file_path, data: Dict):
         temp_file = file_path.with_suffix('.tmp')
         try:
-            # Read current data
-            if file_path.exists():
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-            else:
-                data = {}
-            
-            # Perform operation
-            result = operation(data)
-            
-            # Write to temp file
             with open(temp_file, 'w') as f:
-                json.dump(data, f, indent=2)
-            
+                if file_path == self.config_file:
+                    json.dump(data, f, indent=2)
+                else:
+                    # indent forces json's pure-Python encoder; job documents
+                    # are large and rewritten often, so keep them compact
+                    f.write(json.dumps(data, separators=(",", ":")))
+                count_bytes(written=f.tell())
+
             # Atomic replace
             os.replace(temp_file, file_path)
-            return result
-            
-        except Exception as e:
+            self._cache[file_path] = (self._stat_key(os.stat(file_path)), data)
+        except Exception:
+            self._cache.pop(file_path, None)
             if temp_file.exists():
                 temp_file.unlink()
-            raise e
+            raise
+
+    def _atomic_file_operation(self, file_path, operation):
+        """Simple atomic file operation using file moves"""
+        with self._lock:
+            # Copy so readers holding the cached document never see it change
+            data = dict(self._read_json(file_path))
+            result = operation(data)
+            self._write_json(file_path, data)
+            return result
+
+    def _read_operation(self, file_path, operation):
+        """Run ``operation`` on the current document without rewriting it"""
+        return operation(self._read_json(file_path))
+
+    def _jobs_index(self, jobs_data: Dict[str, Dict]) -> JobIndex:
+        """State index for ``jobs_data``; caller holds ``_index_mutex``.
+
+        The index is only rebuilt when the jobs document was re-parsed;
+        writes from this instance update it incrementally.
+        """
+        if self._index_source is not jobs_data:
+            self._index = JobIndex(jobs_data)
+            self._index_source = jobs_data
+        return self._index
+
+    def _update_jobs(self, changes: Dict[str, Optional[Dict]]):
+        """Write job changes (``None`` deletes) to jobs.json, with the
+        dependency updates they cause; caller holds the lock"""
+        current = self._read_json(self.jobs_file)
+        changes = dict(changes)
+        changes.update(resolve_dependencies(changes, current.get))
+        data = dict(current)
+        for job_id, job_data in changes.items():
+            if job_data is None:
+                data.pop(job_id, None)
+            else:
+                data[job_id] = job_data
+        self._write_json(self.jobs_file, data)
+
+        with self._index_mutex:
+            index = self._jobs_index(current)
+            for job_id, job_data in changes.items():
+                if job_data is None:
+                    index.remove(job_id)
+                else:
+                    index.put(job_data)
+            self._index_source = data
+            self._write_stats(index)
+
+    def _write_stats(self, index: JobIndex):
+        """Persist per-state counts and per-queue depths so status never has
+        to read job bodies"""
+        self._write_json(self.stats_file, self._stats_document(index))
+
+    @staticmethod
+    def _stats_document(index: JobIndex) -> Dict:
+        stats = {state.value: index.count(state) for state in JobState}
+        stats["queues"] = index.queue_stats()
+        return stats
+
+    @staticmethod
+    def _format_stats(counts: Dict[str, int]) -> Dict[str, int]:
+        stats = {"total_jobs": sum(counts.get(state.value, 0) for state in JobState)}
+        for state in JobState:
+            stats[state.value] = counts.get(state.value, 0)
+        return stats
 
     def save_job(self, job: Job) -> bool:
         try:
-            def update_data(data):
-                data[job.id] = job.to_dict()
+            with self._lock:
+                self._update_jobs({job.id: job.to_dict()})
                 return True
-            
-            return self._atomic_file_operation(self.jobs_file, update_data)
         except Exception as e:
             logger.error(f"Failed to save job {job.id}: {e}")
             return False
 
+    def save_jobs(self, jobs: List[Job]) -> bool:
+        try:
+            with self._lock:
+                self._update_jobs({job.id: job.to_dict() for job in jobs})
+                return True
+        except Exception as e:
+            logger.error(f"Failed to save {len(jobs)} jobs: {e}")
+            return False
+
+    def add_jobs(self, jobs: List[Job]) -> Optional[List[Job]]:
+        """Insert new jobs, skipping those whose idempotency key is taken.
+
+        Returns ``jobs`` with each skipped job replaced by the job already
+        holding its key, or None when the write failed.
+        """
+        try:
+            with self._lock:
+                current = self._read_json(self.jobs_file)
+                with self._index_mutex:
+                    index = self._jobs_index(current)
+
+                    def existing(key):
+                        job_id = index.idempotent_job(key)
+                        return Job.from_dict(current[job_id]) if job_id else None
+
+                    new_jobs, result = split_duplicates(jobs, existing)
+                if new_jobs:
+                    self._update_jobs({job.id: job.to_dict() for job in new_jobs})
+                return result
+        except Exception as e:
+            logger.error(f"Failed to add {len(jobs)} jobs: {e}")
+            return None
+
     def get_job(self, job_id: str) -> Optional[Job]:
         try:
             def read_data(data):
@@ -73,46 +331,101 @@ class JobStorage:
                     return Job.from_dict(job_data)
                 return None
             
-            return self._atomic_file_operation(self.jobs_file, read_data)
+            return self._read_operation(self.jobs_file, read_data)
         except Exception as e:
-            logger.error(f"Failed to get job {job.id}: {e}")
+            logger.error(f"Failed to get job {job_id}: {e}")
             return None
 
-    def get_all_jobs(self) -> Dict[str, Job]:
+    def get_all_jobs(self, lazy: bool = False) -> Dict[str, Job]:
         try:
+            load = LazyJob.from_dict if lazy else Job.from_dict
+
             def read_data(data):
-                return {job_id: Job.from_dict(job_data) for job_id, job_data in data.items()}
+                return {job_id: load(job_data) for job_id, job_data in data.items()}
             
-            return self._atomic_file_operation(self.jobs_file, read_data)
+            return self._read_operation(self.jobs_file, read_data)
         except Exception as e:
             logger.error(f"Failed to get all jobs: {e}")
             return {}
 
-    def get_jobs_by_state(self, state: JobState) -> List[Job]:
-        all_jobs = self.get_all_jobs()
-        return [job for job in all_jobs.values() if job.state == state]
+    def get_jobs_by_state(self, state: JobState, lazy: bool = False) -> List[Job]:
+        try:
+            jobs_data = self._read_json(self.jobs_file)
+            with self._index_mutex:
+                job_ids = list(self._jobs_index(jobs_data).ids(state))
+            load = LazyJob.from_dict if lazy else Job.from_dict
+            jobs = [load(jobs_data[job_id]) for job_id in job_ids]
+            jobs.sort(key=lambda job: job.created_at)
+            return jobs
+        except Exception as e:
+            logger.error(f"Failed to get {state.value} jobs: {e}")
+            return []
 
     def delete_job(self, job_id: str) -> bool:
         try:
-            def update_data(data):
-                if job_id in data:
-                    del data[job_id]
-                    return True
-                return False
-            
-            return self._atomic_file_operation(self.jobs_file, update_data)
+            with self._lock:
+                if job_id not in self._read_json(self.jobs_file):
+                    return False
+                self._update_jobs({job_id: None})
+                return True
         except Exception as e:
             logger.error(f"Failed to delete job {job_id}: {e}")
             return False
 
-    def acquire_job_lock(self, job_id: str, worker_id: str) -> bool:
+    def delete_jobs(self, job_ids: List[str]) -> int:
+        """Delete many jobs in one write; returns how many existed"""
+        try:
+            with self._lock:
+                jobs_data = self._read_json(self.jobs_file)
+                existing = [job_id for job_id in job_ids if job_id in jobs_data]
+                if existing:
+                    self._update_jobs({job_id: None for job_id in existing})
+                return len(existing)
+        except Exception as e:
+            logger.error(f"Failed to delete {len(job_ids)} jobs: {e}")
+            return 0
+
+    def delete_unchanged_jobs(self, jobs: List[Job],
+                              before_delete: Optional[Callable[[List[Job]], None]] = None) -> List[Job]:
+        """Delete the jobs still stored as given (same state and
+        ``updated_at``), skipping any that changed since they were read.
+
+        ``before_delete`` gets the jobs about to go while the write is
+        held, so nothing can change them in between. Returns them.
+        """
+        try:
+            with self._lock:
+                jobs_data = self._read_json(self.jobs_file)
+                doomed = [job for job in jobs if unchanged(jobs_data.get(job.id), job)]
+                if doomed:
+                    if before_delete:
+                        before_delete(doomed)
+                    self._update_jobs({job.id: None for job in doomed})
+                return doomed
+        except Exception as e:
+            logger.error(f"Failed to delete {len(jobs)} jobs: {e}")
+            return []
+
+    def get_locks(self) -> Dict[str, Dict]:
+        try:
+            def read_data(data):
+                return data.copy()
+
+            return self._read_operation(self.locks_file, read_data)
+        except Exception as e:
+            logger.error(f"Failed to get locks: {e}")
+            return {}
+
+    def acquire_job_lock(self, job_id: str, worker_id: str, lease: float = DEFAULT_LEASE_SECONDS) -> bool:
         try:
             def update_data(data):
                 if job_id in data:
                     return False  # Already locked
+                now = time.time()
                 data[job_id] = {
                     "worker_id": worker_id,
-                    "locked_at": time.time()
+                    "locked_at": now,
+                    "expires_at": now + lease
                 }
                 return True
             
@@ -134,11 +447,209 @@ class JobStorage:
             logger.error(f"Failed to release lock for job {job_id}: {e}")
             return False
 
+    def renew_leases(self, worker_id: str, job_ids: List[str], lease: float = DEFAULT_LEASE_SECONDS) -> int:
+        """Extend the leases ``worker_id`` holds on ``job_ids``; returns how many it still held"""
+        try:
+            def update_data(data):
+                expires_at = time.time() + lease
+                renewed = 0
+                for job_id in job_ids:
+                    lock_info = data.get(job_id)
+                    if lock_info and lock_info.get("worker_id") == worker_id:
+                        data[job_id] = dict(lock_info, expires_at=expires_at)
+                        renewed += 1
+                return renewed
+
+            return self._atomic_file_operation(self.locks_file, update_data)
+        except Exception as e:
+            logger.error(f"Failed to renew leases for {worker_id}: {e}")
+            return 0
+
+    def reclaim_expired(self, reclaim: Callable[[Job], None], now: Optional[float] = None) -> List[Job]:
+        """Release every lock whose lease ran out before ``now``.
+
+        Processing jobs under such a lock are passed to ``reclaim`` and
+        saved with the lock release in one step; they are returned.
+        """
+        now = time.time() if now is None else now
+        try:
+            with self._lock:
+                jobs_data = self._read_json(self.jobs_file)
+                locks_data = dict(self._read_json(self.locks_file))
+                expired = [job_id for job_id, lock_info in locks_data.items()
+                           if lease_expires_at(lock_info) <= now]
+                if not expired:
+                    return []
+
+                reclaimed, changes = [], {}
+                for job_id in expired:
+                    del locks_data[job_id]
+                    job_data = jobs_data.get(job_id)
+                    if job_data and job_data["state"] == JobState.PROCESSING.value:
+                        job = Job.from_dict(job_data)
+                        reclaim(job)
+                        changes[job_id] = job.to_dict()
+                        reclaimed.append(job)
+
+                if changes:
+                    self._update_jobs(changes)
+                self._write_json(self.locks_file, locks_data)
+                return reclaimed
+        except Exception as e:
+            logger.error(f"Failed to reclaim expired leases: {e}")
+            return []
+
+    def claim_next(self, worker_id: str, queues: Optional[List[str]] = None,
+                   weights: Optional[Dict[str, int]] = None,
+                   lease: float = DEFAULT_LEASE_SECONDS) -> Optional[Job]:
+        """Lock the next runnable job and mark it processing in one step"""
+        claimed = self.claim_batch(worker_id, 1, queues, weights, lease)
+        return claimed[0] if claimed else None
+
+    def claim_batch(self, worker_id: str, count: int, queues: Optional[List[str]] = None,
+                    weights: Optional[Dict[str, int]] = None,
+                    lease: float = DEFAULT_LEASE_SECONDS) -> List[Job]:
+        """Lock up to ``count`` runnable jobs and mark them processing in one step.
+
+        Jobs come from ``queues`` (default: all), highest priority first
+        within a queue and weighted round-robin across queues. Jobs whose
+        concurrency key is at its limit are skipped, not waited for. Each
+        lock is a lease that lapses ``lease`` seconds from now unless renewed.
+        """
+        try:
+            with self._lock:
+                now = time.time()
+                jobs_data = self._read_json(self.jobs_file)
+                locks_data = dict(self._read_json(self.locks_file))
+                limits = self._read_json(self.limits_file)
+                throttle = Throttle(limits, running_by_key(locks_data, jobs_data), now) if limits else None
+
+                def accept(job_id):
+                    if job_id in locks_data:
+                        return False
+                    return throttle is None or throttle.admit(job_id, jobs_data[job_id].get("concurrency_key"))
+
+                with self._index_mutex:
+                    job_ids = self._jobs_index(jobs_data).ready_pending(
+                        count, accept=accept, now=now, queues=queues, weights=weights
+                    )
+
+                claimed, changes = [], {}
+                for job_id in job_ids:
+                    job = Job.from_dict(jobs_data[job_id])
+                    job.mark_processing()
+                    changes[job_id] = job.to_dict()
+                    locks_data[job_id] = {
+                        "worker_id": worker_id,
+                        "locked_at": now,
+                        "expires_at": now + lease
+                    }
+                    claimed.append(job)
+
+                if claimed:
+                    self._update_jobs(changes)
+                    self._write_json(self.locks_file, locks_data)
+                if throttle:
+                    throttle.settle(job_ids)
+                    if throttle.changed:
+                        self._write_json(self.limits_file, dict(limits, **throttle.changes()))
+                return claimed
+        except Exception as e:
+            logger.error(f"Failed to claim jobs for {worker_id}: {e}")
+            return []
+
+    def get_limits(self) -> Dict[str, Dict]:
+        """The concurrency limits registry: key -> limits, bucket and counters"""
+        try:
+            return self._read_operation(self.limits_file, lambda data: data.copy())
+        except Exception as e:
+            logger.error(f"Failed to read concurrency limits: {e}")
+            return {}
+
+    def save_limit(self, key: str, entry: Dict) -> bool:
+        try:
+            def update_data(data):
+                data[key] = entry
+                return True
+
+            return self._atomic_file_operation(self.limits_file, update_data)
+        except Exception as e:
+            logger.error(f"Failed to save limit for {key}: {e}")
+            return False
+
+    def delete_limit(self, key: str) -> bool:
+        try:
+            def update_data(data):
+                return data.pop(key, None) is not None
+
+            return self._atomic_file_operation(self.limits_file, update_data)
+        except Exception as e:
+            logger.error(f"Failed to delete limit for {key}: {e}")
+            return False
+
+    def finish_job(self, job: Job) -> bool:
+        """Save a claimed job and release its lock in one step"""
+        with self._lock:
+            if not self.save_job(job):
+                return False
+            self.release_job_lock(job.id)
+            return True
+
+    def finish_jobs(self, jobs: List[Job]) -> bool:
+        """Save several claimed jobs and release their locks in one step"""
+        try:
+            with self._lock:
+                self._update_jobs({job.id: job.to_dict() for job in jobs})
+
+                def update_data(data):
+                    for job in jobs:
+                        data.pop(job.id, None)
+
+                self._atomic_file_operation(self.locks_file, update_data)
+                return True
+        except Exception as e:
+            logger.error(f"Failed to finish {len(jobs)} jobs: {e}")
+            return False
+
+    def queue_stats(self) -> Dict[str, Dict[str, float]]:
+        """Pending depth and oldest pending ``created_at`` per named queue,
+        from the persisted counters"""
+        try:
+            return {name: dict(entry) for name, entry in self._persisted_stats()["queues"].items()}
+        except Exception as e:
+            logger.error(f"Failed to read queue stats: {e}")
+            return {}
+
+    def get_stats(self) -> Dict[str, int]:
+        """Job counts per state from the persisted counters"""
+        try:
+            return self._format_stats(self._persisted_stats())
+        except Exception as e:
+            logger.error(f"Failed to read stats: {e}")
+            return self._format_stats({})
+
+    def _persisted_stats(self) -> Dict:
+        if not self.stats_file.exists() or "queues" not in self._read_json(self.stats_file):
+            # Missing, or counters from before per-queue depths were kept
+            self.recount_stats()
+        return self._read_json(self.stats_file)
+
+    def recount_stats(self) -> Dict[str, int]:
+        """Rebuild the persisted counters from the job records"""
+        with self._lock:
+            self._cache.pop(self.jobs_file, None)
+            jobs_data = self._read_json(self.jobs_file)
+            with self._index_mutex:
+                index = self._jobs_index(jobs_data)
+                self._write_stats(index)
+                return self._format_stats({state.value: index.count(state) for state in JobState})
+
     def save_config(self, config: Dict) -> bool:
         try:
             def update_data(data):
                 data.clear()
                 data.update(config)
+                data.setdefault("storage_backend", self.backend_name)
                 return True
             
             return self._atomic_file_operation(self.config_file, update_data)
@@ -151,7 +662,10 @@ class JobStorage:
             def read_data(data):
                 return data.copy()
             
-            return self._atomic_file_operation(self.config_file, read_data)
+            return self._read_operation(self.config_file, read_data)
         except Exception as e:
             logger.error(f"Failed to load config: {e}")
-            return {}
\ No newline at end of file
+            return {}
+
+
+_instrument(JobStorage)
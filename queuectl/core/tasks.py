@@ -0,0 +1,204 @@
+import importlib
+import json
+import os
+import queue as queue_module
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import traceback
+import logging
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Union
+from .executor import PACKAGE_ROOT
+
+logger = logging.getLogger(__name__)
+
+# "package.module:function", or "module:Class.method"
+TASK_REF = re.compile(r"^[A-Za-z_][\w.]*:[A-Za-z_][\w.]*$")
+
+
+class TaskError(Exception):
+    """A task raised; carries the traceback from the task process"""
+
+    def __init__(self, message: str, traceback_text: Optional[str] = None):
+        super().__init__(message)
+        self.traceback = traceback_text
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+def check_task_ref(ref: str) -> str:
+    if not isinstance(ref, str) or not TASK_REF.match(ref):
+        raise ValueError(f"task must look like 'module:function', got {ref!r}")
+    return ref
+
+
+def resolve_task(ref: str) -> Callable:
+    module_name, _, attribute = check_task_ref(ref).partition(":")
+    target = importlib.import_module(module_name)
+    for name in attribute.split("."):
+        target = getattr(target, name)
+    if not callable(target):
+        raise TypeError(f"{ref} is not callable")
+    return target
+
+
+def call_task(func: Callable, args: Union[List, Dict, None]) -> Any:
+    if args is None:
+        return func()
+    if isinstance(args, dict):
+        return func(**args)
+    return func(*args)
+
+
+class _TaskProcess:
+    """One warm interpreter of the pool, talking over a socketpair"""
+
+    def __init__(self, preload: List[str]):
+        parent, child = socket.socketpair()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get("PYTHONPATH")]))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "queuectl.core.tasks", str(child.fileno()), ",".join(preload)],
+            pass_fds=[child.fileno()],
+            stdin=subprocess.DEVNULL,
+            env=env,
+            start_new_session=True  # its own group, so a timeout can kill what the task started
+        )
+        child.close()
+        self.conn = Connection(parent.detach())
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+        self.conn.close()
+
+    def close(self):
+        self.conn.close()  # the process exits when it sees EOF
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.kill()
+
+
+class TaskPool:
+    """Runs ``module:function`` tasks in up to ``size`` long-lived Python
+    processes.
+
+    Processes start on first use and are reused, so each task pays for a
+    function call rather than an interpreter start and its imports. Tasks
+    import relative to the directory the workers run in. A process whose
+    task times out is killed and replaced by a fresh one.
+    """
+
+    def __init__(self, size: Optional[int] = None, preload: Optional[List[str]] = None):
+        self.size = max(size or os.cpu_count() or 1, 1)
+        self.preload = list(preload or [])
+        self._idle: "queue_module.LifoQueue[_TaskProcess]" = queue_module.LifoQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> _TaskProcess:
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue_module.Empty:
+                pass
+            with self._lock:
+                grow = self._started < self.size
+                if grow:
+                    self._started += 1
+            if grow:
+                try:
+                    return _TaskProcess(self.preload)
+                except Exception:
+                    with self._lock:
+                        self._started -= 1
+                    raise
+            try:
+                return self._idle.get(timeout=0.5)
+            except queue_module.Empty:
+                continue  # a timed-out process may have freed a slot
+
+    def _retire(self, process: _TaskProcess):
+        process.kill()
+        with self._lock:
+            self._started -= 1
+
+    def run(self, task: str, args: Union[List, Dict, None] = None, timeout: Optional[float] = None) -> str:
+        """Run a task and return its result as JSON text.
+
+        Raises ``TaskError`` when the task raises (or its process dies) and
+        ``TaskTimeout`` when it runs longer than ``timeout``.
+        """
+        process = self._acquire()
+        try:
+            process.conn.send_bytes(json.dumps({"task": task, "args": args}).encode())
+            if not process.conn.poll(timeout):
+                self._retire(process)
+                process = None
+                raise TaskTimeout(f"Timeout after {timeout}s")
+            reply = json.loads(process.conn.recv_bytes())
+        except (EOFError, OSError):
+            exitcode = process.process.poll() if process else None
+            if process:
+                self._retire(process)
+                process = None
+            raise TaskError(f"task process exited with code {exitcode}") from None
+        finally:
+            if process is not None:
+                self._idle.put(process)
+
+        if reply["ok"]:
+            return reply["result"]
+        raise TaskError(reply["error"], reply["traceback"])
+
+    def close(self):
+        while True:
+            try:
+                process = self._idle.get_nowait()
+            except queue_module.Empty:
+                break
+            process.close()
+            with self._lock:
+                self._started -= 1
+
+
+def _serve(conn: Connection, preload: List[str]):
+    """Task process main loop: run one request at a time until EOF"""
+    for module_name in preload:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            print(f"queuectl task pool: cannot preload {module_name}: {e}", file=sys.stderr)
+
+    functions: Dict[str, Callable] = {}
+    while True:
+        try:
+            request = json.loads(conn.recv_bytes())
+        except EOFError:
+            return
+        try:
+            func = functions.get(request["task"])
+            if func is None:
+                func = functions[request["task"]] = resolve_task(request["task"])
+            result = call_task(func, request["args"])
+            reply = {"ok": True, "result": json.dumps(result, default=repr)}
+        except Exception as e:
+            reply = {"ok": False, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+        conn.send_bytes(json.dumps(reply).encode())
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    sock.set_inheritable(False)
+    _serve(Connection(sock.detach()), [name for name in sys.argv[2].split(",") if name])
@@ -0,0 +1,136 @@
+import re
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+RATE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+RATE_PATTERN = re.compile(r"^(\d+)/(\d*)([smhd])$")
+
+
+def parse_rate(text: str) -> Tuple[int, float]:
+    """'50/m' -> (50, 60.0): at most 50 starts per 60 seconds. The unit may
+    carry a count, as in '5/10s'."""
+    match = RATE_PATTERN.match(text.strip()) if isinstance(text, str) else None
+    if not match or int(match.group(1)) < 1:
+        raise ValueError(f"rate must look like '50/m' or '5/10s', got {text!r}")
+    period = int(match.group(2) or 1) * RATE_UNITS[match.group(3)]
+    if period <= 0:
+        raise ValueError(f"rate period must be positive, got {text!r}")
+    return int(match.group(1)), float(period)
+
+
+def check_limit(concurrency: Optional[int], rate: Optional[str]):
+    if concurrency is not None and (isinstance(concurrency, bool) or not isinstance(concurrency, int)
+                                    or concurrency < 1):
+        raise ValueError("concurrency limit must be a positive integer")
+    if rate is not None:
+        parse_rate(rate)
+
+
+def new_limit(concurrency: Optional[int] = None, rate: Optional[str] = None,
+              previous: Optional[Dict] = None) -> Dict:
+    """A limits registry entry; bucket state and counters carry over from
+    ``previous``"""
+    entry = {"concurrency": concurrency, "rate": rate,
+             "throttled_concurrency": 0, "throttled_rate": 0}
+    if previous:
+        entry["throttled_concurrency"] = previous.get("throttled_concurrency", 0)
+        entry["throttled_rate"] = previous.get("throttled_rate", 0)
+        if rate and previous.get("rate") == rate:
+            entry["tokens"] = previous.get("tokens")
+            entry["updated_at"] = previous.get("updated_at")
+    return entry
+
+
+class Throttle:
+    """Admission control for one claim, over the per-key limits registry.
+
+    ``limits`` maps a concurrency key to its entry (concurrency limit,
+    rate, token bucket and throttle counters); ``running`` counts the
+    locked jobs of each key. A key's token bucket holds up to ``count``
+    starts and refills at ``count`` per period, so bursts are allowed up to
+    the rate. Entries that change are listed in ``changed`` for the
+    storage to write back in the same transaction as the claim.
+    """
+
+    def __init__(self, limits: Dict[str, Dict], running: Dict[str, int], now: Optional[float] = None):
+        self.limits = {key: dict(entry) for key, entry in limits.items()}
+        self.running = dict(running)
+        self.now = time.time() if now is None else now
+        self.changed: Set[str] = set()
+        self._admitted: Dict[str, str] = {}
+        self._counted: Set[Tuple[str, str]] = set()
+
+    def _tokens(self, entry: Dict) -> float:
+        count, period = parse_rate(entry["rate"])
+        tokens = entry.get("tokens")
+        if tokens is None:
+            return float(count)
+        elapsed = max(self.now - (entry.get("updated_at") or self.now), 0)
+        return min(float(count), tokens + elapsed * count / period)
+
+    def blocking(self, key: str) -> Optional[str]:
+        """Why ``key`` cannot start another job now ("concurrency" or
+        "rate"), or None"""
+        entry = self.limits.get(key)
+        if entry is None:
+            return None
+        if entry.get("concurrency") is not None and self.running.get(key, 0) >= entry["concurrency"]:
+            return "concurrency"
+        if entry.get("rate") and self._tokens(entry) < 1:
+            return "rate"
+        return None
+
+    def blocked_keys(self) -> Dict[str, str]:
+        """Keys that cannot start a job now, with the reason"""
+        blocked = {}
+        for key in self.limits:
+            reason = self.blocking(key)
+            if reason:
+                blocked[key] = reason
+        return blocked
+
+    def available(self, key: str) -> Optional[float]:
+        """Tokens left in ``key``'s bucket, or None without a rate"""
+        entry = self.limits.get(key)
+        if not entry or not entry.get("rate"):
+            return None
+        return self._tokens(entry)
+
+    def count_throttled(self, key: str, reason: str):
+        """Count a claim that held back ``key``'s jobs, once per claim"""
+        if (key, reason) not in self._counted:
+            self._counted.add((key, reason))
+            self.limits[key][f"throttled_{reason}"] = self.limits[key].get(f"throttled_{reason}", 0) + 1
+            self.changed.add(key)
+
+    def admit(self, job_id: str, key: Optional[str]) -> bool:
+        """Take a slot (and a token) for ``job_id``, or count it throttled"""
+        if not key or key not in self.limits:
+            return True
+        reason = self.blocking(key)
+        if reason:
+            self.count_throttled(key, reason)
+            return False
+        entry = self.limits[key]
+        if entry.get("rate"):
+            entry["tokens"] = self._tokens(entry) - 1
+            entry["updated_at"] = self.now
+            self.changed.add(key)
+        self.running[key] = self.running.get(key, 0) + 1
+        self._admitted[job_id] = key
+        return True
+
+    def settle(self, claimed_ids: Iterable[str]):
+        """Give back what was admitted for jobs that were not claimed after all"""
+        claimed = set(claimed_ids)
+        for job_id, key in self._admitted.items():
+            if job_id in claimed:
+                continue
+            self.running[key] -= 1
+            entry = self.limits[key]
+            if entry.get("rate"):
+                entry["tokens"] += 1
+        self._admitted = {job_id: key for job_id, key in self._admitted.items() if job_id in claimed}
+
+    def changes(self) -> Dict[str, Dict]:
+        return {key: self.limits[key] for key in self.changed}
@@ -1,28 +1,52 @@
 import subprocess
 import time
 import logging
+import multiprocessing
+import queue as queue_module
 import signal
 import sys
 import threading
-from typing import Optional, Dict
+from collections import deque
+from typing import Optional, Dict, List, Union
 from datetime import datetime
-from .job import Job
+from .job import Job, TASK
 from .queue import JobQueue
+from .storage import open_storage
+from .capture import run_captured
+from .executor import SpawnStats, make_launcher
+from .tasks import TaskPool, TaskError, TaskTimeout
+from .async_worker import AsyncJobWorker, IDLE_POLL_SECONDS
+from .schedule import Scheduler
+from .metrics import METRICS, MetricsPublisher, MetricsStore
 
 logger = logging.getLogger(__name__)
 
 class JobWorker:
-    def __init__(self, worker_id: str, queue: JobQueue):
+    def __init__(self, worker_id: str, queue: JobQueue, batch_size: int = 1, handle_signals: bool = True,
+                 queues: Optional[List[str]] = None, weights: Optional[Dict[str, int]] = None,
+                 launcher=None, tasks: Optional[TaskPool] = None):
         self.worker_id = worker_id
         self.queue = queue
+        self.queues = queues
+        self.weights = weights
+        self.launcher = launcher
+        # Pool for module:function jobs; a worker on its own gets one process
+        self._own_tasks = tasks is None
+        self.tasks = tasks or TaskPool(1)
+        self.spawn_stats = SpawnStats()
+        self.batch_size = max(batch_size, 1)
         self.running = False
         self.current_job: Optional[Job] = None
         self.processed_count = 0
         self.failed_count = 0
+        self._claimed = deque()
+        self._wakeup = None
+        self._heartbeat_stop = threading.Event()
         
-        # Setup signal handlers
-        signal.signal(signal.SIGINT, self._signal_handler)
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        # Setup signal handlers (only possible from the main thread)
+        if handle_signals and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self._signal_handler)
+            signal.signal(signal.SIGTERM, self._signal_handler)
 
     def _signal_handler(self, signum, frame):
         logger.info(f"Worker {self.worker_id} received shutdown signal")
@@ -30,55 +54,137 @@ class JobWorker:
 
     def start(self):
         self.running = True
+        self._wakeup = self.queue.notifier.listen()
+        self._heartbeat_stop.clear()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
         logger.info(f"Worker {self.worker_id} started")
         
         while self.running:
             try:
-                job = self.queue.get_next_pending_job(self.worker_id)
+                if not self._claimed:
+                    self._claimed.extend(self.queue.claim_batch(
+                        self.worker_id, self.batch_size, self.queues, self.weights))
                 
-                if job:
+                if self._claimed:
+                    job = self._claimed.popleft()
                     self.current_job = job
-                    self._process_job(job)
-                    self.current_job = None
+                    try:
+                        self._process_job(job)
+                    finally:
+                        # Stop renewing even if recording the result failed,
+                        # so the reaper can take the job back
+                        self.current_job = None
                 else:
-                    time.sleep(1)
+                    self._wait_for_work(IDLE_POLL_SECONDS)
                     
             except Exception as e:
                 logger.error(f"Worker {self.worker_id} error: {e}")
                 time.sleep(5)
         
+        self._requeue_claimed()
+        if self._own_tasks:
+            self.tasks.close()
+        self._heartbeat_stop.set()
+        heartbeat.join(timeout=5)
+        if self._wakeup:
+            self._wakeup.close()
+            self._wakeup = None
         logger.info(f"Worker {self.worker_id} stopped")
 
+    def _held_job_ids(self) -> List[str]:
+        job_ids = [job.id for job in tuple(self._claimed)]
+        current = self.current_job
+        if current:
+            job_ids.append(current.id)
+        return job_ids
+
+    def _heartbeat_loop(self):
+        # Renew well before the lease runs out, so one late beat costs nothing
+        while not self._heartbeat_stop.wait(self.queue.lease_seconds / 3):
+            try:
+                self.queue.renew_leases(self.worker_id, self._held_job_ids())
+            except Exception as e:
+                # e.g. the claimed deque changed mid-copy; the next beat retries
+                logger.debug(f"Worker {self.worker_id} heartbeat skipped: {e}")
+
+    def _wait_for_work(self, timeout: float):
+        # Enqueues wake us at once; the timeout is only a fallback poll
+        if self._wakeup:
+            self._wakeup.wait(timeout)
+        else:
+            time.sleep(timeout)
+
+    def _requeue_claimed(self):
+        while self._claimed:
+            job = self._claimed.popleft()
+            if self.queue.requeue_job(job):
+                logger.info(f"Worker {self.worker_id} returned unstarted job {job.id} to the queue")
+
     def _process_job(self, job: Job):
         logger.info(f"Worker {self.worker_id} processing job {job.id}: {job.command}")
-        
+        if job.kind == TASK:
+            self._process_task(job)
+            return
+        stdout = stderr = None
         try:
             start_time = time.time()
-            result = subprocess.run(
-                job.command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=job.timeout
-            )
+            stdout, stderr = self.queue.open_capture(job)
+            returncode = run_captured(job.command, job.timeout, stdout, stderr, shell=job.shell,
+                                      launcher=self.launcher, spawn_stats=self.spawn_stats)
             execution_time = time.time() - start_time
+            METRICS.observe("job_run_seconds", execution_time, queue=job.queue,
+                            outcome="completed" if returncode == 0 else "failed")
             
-            if result.returncode == 0:
-                self.queue.complete_job(job, result.stdout)
+            if returncode == 0:
+                self.queue.complete_job(job, stdout, stderr)
                 self.processed_count += 1
                 logger.info(f"Job {job.id} completed in {execution_time:.2f}s")
             else:
-                error_msg = f"Exit code {result.returncode}: {result.stderr}"
-                self.queue.fail_job(job, error_msg)
+                error_msg = f"Exit code {returncode}"
+                self.queue.fail_job(job, error_msg, stderr, stdout)
                 self.failed_count += 1
                 logger.warning(f"Job {job.id} failed: {error_msg}")
                 
         except subprocess.TimeoutExpired:
+            METRICS.observe("job_run_seconds", time.time() - start_time, queue=job.queue, outcome="timeout")
             error_msg = f"Timeout after {job.timeout}s"
-            self.queue.fail_job(job, error_msg)
+            self.queue.fail_job(job, error_msg, stderr, stdout)
             self.failed_count += 1
             logger.error(f"Job {job.id} timeout")
             
+        except Exception as e:
+            error_msg = f"System error: {str(e)}"
+            if stdout is not None:
+                stdout.discard()
+                stderr.discard()
+            self.queue.fail_job(job, error_msg)
+            self.failed_count += 1
+            logger.error(f"Job {job.id} system error: {error_msg}")
+
+    def _process_task(self, job: Job):
+        try:
+            start_time = time.time()
+            output = self.tasks.run(job.command, job.args, job.timeout)
+            execution_time = time.time() - start_time
+            METRICS.observe("job_run_seconds", execution_time, queue=job.queue, outcome="completed")
+            self.queue.complete_job(job, output)
+            self.processed_count += 1
+            logger.info(f"Job {job.id} completed in {execution_time:.2f}s")
+
+        except TaskTimeout:
+            METRICS.observe("job_run_seconds", time.time() - start_time, queue=job.queue, outcome="timeout")
+            self.queue.fail_job(job, f"Timeout after {job.timeout}s")
+            self.failed_count += 1
+            logger.error(f"Job {job.id} timeout")
+
+        except TaskError as e:
+            METRICS.observe("job_run_seconds", time.time() - start_time, queue=job.queue, outcome="failed")
+            error_msg = f"Task error: {e}"
+            self.queue.fail_job(job, error_msg, e.traceback)
+            self.failed_count += 1
+            logger.warning(f"Job {job.id} failed: {error_msg}")
+
         except Exception as e:
             error_msg = f"System error: {str(e)}"
             self.queue.fail_job(job, error_msg)
@@ -94,20 +200,145 @@ class JobWorker:
             "processed": self.processed_count,
             "failed": self.failed_count,
             "current_job": self.current_job.id if self.current_job else None,
-            "running": self.running
+            "running": self.running,
+            **self.spawn_stats.as_dict()
         }
 
 
+# How often a worker process checks whether it has new stats for its supervisor
+STATS_INTERVAL = 0.25
+# A worker process that dies sooner than this after starting counts as a crash loop
+CRASH_LOOP_SECONDS = 10.0
+
+
+def _run_worker_process(storage_path: str, backend: str, name: str, count: int,
+                        batch_size: int, concurrency: int, queues: Optional[List[str]],
+                        weights: Optional[Dict[str, int]], executor: Optional[str],
+                        stats_queue, log_level: int):
+    """Entry point of a supervised worker process"""
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    # The parent turns Ctrl+C into SIGTERM for every child, which then
+    # drains its own worker threads
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    manager = WorkerManager(JobQueue(open_storage(storage_path, backend=backend)), executor=executor)
+    manager.start_metrics()
+    manager.start_workers(count, batch_size=batch_size, prefix=f"{name}-worker",
+                          concurrency=concurrency, handle_signals=False,
+                          queues=queues, weights=weights)
+    workers = list(manager.workers.values())
+
+    last_report = None
+    while not stop.wait(STATS_INTERVAL):
+        stats = [worker.get_stats() for worker in workers]
+        if stats != last_report:
+            stats_queue.put((name, stats))
+            last_report = stats
+
+    manager.stop_workers()
+    stats_queue.put((name, [worker.get_stats() for worker in workers]))
+
+
+class WorkerProcess:
+    """Supervisor-side bookkeeping for one worker process"""
+
+    def __init__(self, name: str, worker_count: int):
+        self.name = name
+        self.worker_ids = [f"{name}-worker-{i + 1}" for i in range(worker_count)]
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.crash_streak = 0
+        self.restart_at: Optional[float] = None
+        self.stats: Dict[str, dict] = {}
+        # processed/failed counts from earlier incarnations, per worker id
+        self.carried: Dict[str, Dict[str, int]] = {}
+
+    def retire_stats(self):
+        for worker_id, stats in self.stats.items():
+            carried = self.carried.setdefault(worker_id, {"processed": 0, "failed": 0})
+            carried["processed"] += stats["processed"]
+            carried["failed"] += stats["failed"]
+        self.stats = {}
+
+    def get_stats(self) -> List[dict]:
+        result = []
+        for worker_id in self.worker_ids:
+            stats = dict(self.stats.get(worker_id) or {
+                "worker_id": worker_id, "processed": 0, "failed": 0,
+                "current_job": None, "running": False, **SpawnStats().as_dict()
+            })
+            carried = self.carried.get(worker_id, {})
+            stats["processed"] += carried.get("processed", 0)
+            stats["failed"] += carried.get("failed", 0)
+            stats["pid"] = self.process.pid if self.process else None
+            stats["restarts"] = self.restarts
+            result.append(stats)
+        return result
+
+
 class WorkerManager:
-    def __init__(self, queue: JobQueue):
+    def __init__(self, queue: JobQueue, executor: Optional[str] = None):
         self.queue = queue
-        self.workers: Dict[str, JobWorker] = {}
+        # "subprocess" or "forkserver"; one fork server is shared by this process's workers
+        self.executor = executor or queue.config.get("executor") or "subprocess"
+        self.launcher = make_launcher(self.executor) if self.executor != "subprocess" else None
+        # Warm interpreters for module:function jobs, shared by this process's workers
+        preload = [name.strip() for name in (queue.config.get("task_preload") or "").split(",") if name.strip()]
+        self.tasks = TaskPool(queue.config.get("task_processes"), preload)
+        self.workers: Dict[str, Union[JobWorker, AsyncJobWorker]] = {}
         self.threads: Dict[str, threading.Thread] = {}
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_stop = threading.Event()
+        self.processes: Dict[str, WorkerProcess] = {}
+        self._supervisor: Optional[threading.Thread] = None
+        self._supervisor_stop = threading.Event()
+        self._mp = multiprocessing.get_context("spawn")
+        self._stats_queue = None
+        self._process_args = None
+        self.scheduler: Optional[Scheduler] = None
+        self._scheduler_thread: Optional[threading.Thread] = None
+        self._scheduler_stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self._reaper_stop = threading.Event()
+        self.metrics: Optional[MetricsPublisher] = None
+
+    def start_metrics(self, port: Optional[int] = None):
+        """Publish this process's metrics to the storage directory and, with
+        a ``port``, serve everyone's as Prometheus text on localhost"""
+        METRICS.enabled = bool(self.queue.config.get("metrics_enabled"))
+        if not METRICS.enabled:
+            return
+        interval = float(self.queue.config.get("metrics_flush_seconds") or 5)
+        self.metrics = MetricsPublisher(MetricsStore(self.queue.storage.storage_path), interval, port)
+        self.metrics.start()
 
-    def start_workers(self, count: int = 1):
+    def start_workers(self, count: int = 1, batch_size: int = 1, prefix: str = "worker",
+                      concurrency: int = 0, handle_signals: bool = True,
+                      queues: Optional[List[str]] = None, weights: Optional[Dict[str, int]] = None):
+        """Start ``count`` worker threads; ``concurrency`` > 0 makes each an asyncio worker.
+
+        Workers take jobs from ``queues`` (default: all), sharing between
+        them by ``weights``.
+        """
+        if self.launcher:
+            self.launcher.start()
         for i in range(count):
-            worker_id = f"worker-{len(self.workers) + 1}"
-            worker = JobWorker(worker_id, self.queue)
+            worker_id = f"{prefix}-{len(self.workers) + 1}"
+            if concurrency:
+                worker = AsyncJobWorker(worker_id, self.queue, concurrency=concurrency,
+                                        batch_size=batch_size if batch_size > 1 else None,
+                                        queues=queues, weights=weights, launcher=self.launcher,
+                                        tasks=self.tasks)
+            else:
+                worker = JobWorker(worker_id, self.queue, batch_size=batch_size,
+                                   handle_signals=handle_signals, queues=queues, weights=weights,
+                                   launcher=self.launcher, tasks=self.tasks)
             self.workers[worker_id] = worker
             
             thread = threading.Thread(target=worker.start, daemon=True)
@@ -116,7 +347,178 @@ class WorkerManager:
             
             logger.info(f"Started {worker_id}")
 
+    def start_processes(self, count: int = 1, workers_per_process: int = 1, batch_size: int = 1,
+                        concurrency: int = 0, queues: Optional[List[str]] = None,
+                        weights: Optional[Dict[str, int]] = None):
+        """Run workers in ``count`` supervised child processes.
+
+        Children are restarted when they die, their in-flight jobs are
+        failed (and so retried or dead-lettered), and their per-worker
+        stats are reported back to this process.
+        """
+        storage = self.queue.storage
+        self._process_args = (str(storage.storage_path), storage.backend_name,
+                              workers_per_process, batch_size, concurrency, queues, weights, self.executor)
+        if self._stats_queue is None:
+            self._stats_queue = self._mp.Queue()
+
+        for i in range(count):
+            worker_process = WorkerProcess(f"proc-{len(self.processes) + 1}", workers_per_process)
+            self.processes[worker_process.name] = worker_process
+            self._spawn(worker_process)
+
+        if self._supervisor is None:
+            self._supervisor_stop.clear()
+            self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+            self._supervisor.start()
+
+    def _spawn(self, worker_process: WorkerProcess):
+        storage_path, backend, count, batch_size, concurrency, queues, weights, executor = self._process_args
+        worker_process.process = self._mp.Process(
+            target=_run_worker_process,
+            args=(storage_path, backend, worker_process.name, count, batch_size, concurrency,
+                  queues, weights, executor, self._stats_queue, logging.getLogger().level),
+            name=f"queuectl-{worker_process.name}",
+            daemon=True
+        )
+        worker_process.process.start()
+        worker_process.started_at = time.time()
+        worker_process.restart_at = None
+        logger.info(f"Started {worker_process.name} (pid {worker_process.process.pid})")
+
+    def _drain_stats(self):
+        while True:
+            try:
+                name, stats = self._stats_queue.get_nowait()
+            except (queue_module.Empty, OSError, ValueError):
+                return
+            worker_process = self.processes.get(name)
+            if worker_process:
+                worker_process.stats = {entry["worker_id"]: entry for entry in stats}
+
+    def _supervise(self):
+        while not self._supervisor_stop.wait(0.5):
+            self._drain_stats()
+            now = time.time()
+            for worker_process in self.processes.values():
+                if worker_process.restart_at is not None:
+                    if now >= worker_process.restart_at:
+                        self._spawn(worker_process)
+                    continue
+                if worker_process.process.is_alive() or self._supervisor_stop.is_set():
+                    continue
+
+                exitcode = worker_process.process.exitcode
+                logger.error(f"{worker_process.name} (pid {worker_process.process.pid}) exited with code {exitcode}")
+                self._recover(worker_process, f"Worker process exited with code {exitcode}")
+
+                if now - worker_process.started_at < CRASH_LOOP_SECONDS:
+                    worker_process.crash_streak += 1
+                else:
+                    worker_process.crash_streak = 0
+                delay = min(2 ** worker_process.crash_streak - 1, 30)
+                worker_process.restarts += 1
+                worker_process.restart_at = now + delay
+                logger.info(f"Restarting {worker_process.name} in {delay}s")
+
+    def _recover(self, worker_process: WorkerProcess, reason: str):
+        worker_process.retire_stats()
+        failed = self.queue.fail_worker_jobs(f"{worker_process.name}-worker-", reason)
+        if failed:
+            logger.warning(f"Failed {failed} job(s) left running by {worker_process.name}")
+
+    def _stop_processes(self):
+        self._supervisor_stop.set()
+        if self._supervisor:
+            self._supervisor.join(timeout=10)
+            self._supervisor = None
+
+        running = [wp for wp in self.processes.values() if wp.process and wp.process.is_alive()]
+        for worker_process in running:
+            worker_process.process.terminate()  # SIGTERM: finish the current job, then exit
+
+        for worker_process in running:
+            worker_process.process.join(timeout=30)
+            if worker_process.process.is_alive():
+                logger.warning(f"{worker_process.name} did not stop in time; killing it")
+                worker_process.process.kill()
+                worker_process.process.join(timeout=5)
+                self._recover(worker_process, "Worker process killed during shutdown")
+            logger.info(f"Stopped {worker_process.name}")
+
+        # Final reports arrive just before each child exits
+        time.sleep(0.1)
+        self._drain_stats()
+
+    def start_scheduler(self, tick: float = 1.0):
+        """Enqueue recurring jobs from the schedule registry as they fall due"""
+        self.scheduler = Scheduler(self.queue)
+        self._scheduler_stop.clear()
+        self._scheduler_thread = threading.Thread(target=self._schedule_loop, args=(tick,), daemon=True)
+        self._scheduler_thread.start()
+        logger.info("Started scheduler")
+
+    def _schedule_loop(self, tick: float):
+        while True:
+            try:
+                self.scheduler.tick()
+                next_fire = self.scheduler.next_fire_time()
+            except Exception as e:
+                logger.error(f"Scheduler tick failed: {e}")
+                next_fire = None
+            # Sleep until the next fire time, but re-check the registry every tick
+            timeout = tick if next_fire is None else min(max(next_fire - time.time(), 0), tick)
+            if self._scheduler_stop.wait(timeout):
+                return
+
+    def start_sweeper(self, interval: float):
+        """Periodically archive finished jobs per the retention policy"""
+        self._sweeper_stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, args=(interval,), daemon=True)
+        self._sweeper.start()
+        logger.info(f"Started retention sweeper (every {interval}s)")
+
+    def _sweep_loop(self, interval: float):
+        while not self._sweeper_stop.wait(interval):
+            try:
+                self.queue.collect_garbage()
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {e}")
+
+    def start_reaper(self, interval: Optional[float] = None):
+        """Periodically reclaim jobs whose worker stopped renewing its lease"""
+        interval = interval or self.queue.lease_seconds / 3
+        self._reaper_stop.clear()
+        self._reaper = threading.Thread(target=self._reap_loop, args=(interval,), daemon=True)
+        self._reaper.start()
+        logger.info(f"Started lease reaper (every {interval:g}s)")
+
+    def _reap_loop(self, interval: float):
+        while not self._reaper_stop.wait(interval):
+            try:
+                self.queue.reclaim_expired_leases()
+            except Exception as e:
+                logger.error(f"Lease reaper failed: {e}")
+
     def stop_workers(self):
+        if self._reaper:
+            self._reaper_stop.set()
+            self._reaper.join(timeout=10)
+            self._reaper = None
+
+        if self._scheduler_thread:
+            self._scheduler_stop.set()
+            self._scheduler_thread.join(timeout=10)
+            self._scheduler_thread = None
+
+        if self._sweeper:
+            self._sweeper_stop.set()
+            self._sweeper.join(timeout=10)
+            self._sweeper = None
+
+        if self.processes:
+            self._stop_processes()
+
         for worker_id, worker in self.workers.items():
             worker.stop()
             logger.info(f"Stopped {worker_id}")
@@ -124,9 +526,18 @@ class WorkerManager:
         # Wait for threads to finish
         for thread in self.threads.values():
             thread.join(timeout=10)
+        if self.launcher:
+            self.launcher.close()
+        self.tasks.close()
+        if self.metrics:
+            self.metrics.stop()
+            self.metrics = None
         
         self.workers.clear()
         self.threads.clear()
 
     def get_worker_stats(self) -> List[dict]:
-        return [worker.get_stats() for worker in self.workers.values()]
\ No newline at end of file
+        stats = [worker.get_stats() for worker in self.workers.values()]
+        for worker_process in self.processes.values():
+            stats.extend(worker_process.get_stats())
+        return stats
\ No newline at end of file
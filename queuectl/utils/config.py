@@ -5,10 +5,26 @@ class Config:
     _defaults = {
         "max_retries": 3,
         "backoff_base": 2,
+        "retry_jitter": 0.0,
         "job_timeout": 30,
+        "lease_seconds": 15,
         "worker_count": 1,
+        "executor": "subprocess",
+        "task_processes": None,
+        "task_preload": "",
         "storage_path": "queuectl_data",
-        "log_level": "INFO"
+        "log_level": "INFO",
+        "output_compress": False,
+        "output_max_bytes": 1024 * 1024,
+        "output_spool": True,
+        "output_tail_bytes": 4096,
+        "result_cache_entries": 1000,
+        "metrics_enabled": True,
+        "metrics_flush_seconds": 5,
+        "retention.completed_seconds": None,
+        "retention.max_completed": None,
+        "retention.dead_seconds": None,
+        "retention.max_dead": None
     }
     
     def __init__(self, storage):
@@ -4,6 +4,10 @@ import os
 import subprocess
 import shutil
 
+from queuectl.core.job import JobState
+from queuectl.core.storage import open_storage
+from queuectl.core.queue import JobQueue
+
 
 class TestQueueSystem(unittest.TestCase):
     def setUp(self):
@@ -54,6 +58,21 @@ class TestQueueSystem(unittest.TestCase):
         dlq_result = self._run_cli('dlq', 'list')
         self.assertIn('no jobs in dead letter queue', dlq_result.stdout.lower())
 
+    def test_config_parses_fractional_values(self):
+        """✅ Test fractional config values set through the CLI are stored as numbers"""
+        self._run_cli('config', '--key', 'retry_jitter', '--value', '0.2')
+        self._run_cli('config', '--key', 'executor', '--value', 'subprocess')
+
+        queue = JobQueue(open_storage(self.storage_path))
+        self.assertEqual(queue.config.get("retry_jitter"), 0.2)
+        self.assertEqual(queue.config.get("executor"), "subprocess")
+
+        job = queue.enqueue("false", max_retries=2, backoff_base=10)
+        queue.fail_job(queue.get_next_pending_job("worker-1"), "Exit code 1")
+        stored = queue.storage.get_job(job.id)
+        self.assertEqual(stored.state, JobState.PENDING)
+        self.assertTrue(10 <= stored.next_run_at - stored.updated_at <= 12)
+
 
 if __name__ == '__main__':
     unittest.main()
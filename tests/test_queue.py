@@ -0,0 +1,332 @@
+import unittest
+import tempfile
+import os
+import shutil
+import time
+import json
+import urllib.request
+from datetime import datetime
+
+from queuectl.core.job import Job, JobState
+from queuectl.core.storage import open_storage
+from queuectl.core.queue import JobQueue
+from queuectl.core.retention import RetentionPolicy
+from queuectl.core.dag import order_dag
+from queuectl.core.schedule import CronExpression, ScheduleRegistry, Scheduler
+from queuectl.core.bench import BenchmarkSuite, compare, parse_size
+from queuectl.core.metrics import METRICS, MetricsPublisher, MetricsStore, quantile
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        """Create an isolated temp directory for each test"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "test_data")
+        self.queue = JobQueue(open_storage(self.storage_path))
+
+    def tearDown(self):
+        """Clean up after test"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_enqueue_many_skips_invalid_specs(self):
+        """✅ Test bulk enqueue batches valid specs and skips bad ones"""
+        specs = [{"command": f"echo {i}", "max_retries": 1} for i in range(25)]
+        specs += ["echo plain", {"command": ""}, {"command": "echo", "bogus": 1}, 42]
+
+        self.assertEqual(self.queue.enqueue_many(specs, batch_size=10), 26)
+        self.assertEqual(self.queue.get_stats()["pending"], 26)
+        self.assertEqual(len(self.queue.storage.get_jobs_by_state(JobState.PENDING)), 26)
+
+    def test_build_job_validation(self):
+        """✅ Test job spec validation errors"""
+        job = self.queue.build_job({"command": "echo hi", "timeout": 5})
+        self.assertEqual((job.command, job.timeout), ("echo hi", 5))
+        job = self.queue.build_job({"command": "echo hi", "queue": "low", "priority": -1})
+        self.assertEqual((job.queue, job.priority), ("low", -1))
+        for spec in ({"command": "x", "timeout": "5"}, {"command": "x", "max_retries": -1}, [],
+                     {"command": "x", "queue": ""}, {"command": "x", "priority": 1.5},
+                     {"command": "x", "shell": "no"}, {"command": "echo 'x", "shell": False}):
+            with self.assertRaises(ValueError):
+                self.queue.build_job(spec)
+
+    def test_output_goes_to_blob_store(self):
+        """✅ Test job output is stored out of line and tail-readable"""
+        self.queue.enqueue("seq 1 5000")
+        job = self.queue.get_next_pending_job("worker-1")
+        output = "".join(f"{i}\n" for i in range(1, 5001))
+        self.queue.complete_job(job, output, "warning\n")
+
+        stored = self.queue.storage.get_job(job.id)
+        self.assertIsNone(stored.output)
+        self.assertEqual(stored.output_bytes, len(output))
+        self.assertEqual(self.queue.blobs.tail(stored.output_ref, 2), b"4999\n5000\n")
+        with self.queue.blobs.open(stored.error_ref) as f:
+            self.assertEqual(f.read(), b"warning\n")
+
+        self.queue.blobs.max_bytes = 100
+        self.queue.blobs.compress = True
+        ref, size = self.queue.blobs.write(job.id, "stdout", output)
+        self.assertEqual(size, len(output))
+        self.assertEqual(self.queue.blobs.tail(ref, 1), b"5000\n")
+        with self.queue.blobs.open(ref) as f:
+            self.assertLessEqual(len(f.read()), 100)
+
+    def test_collect_garbage_archives_expired_jobs(self):
+        """✅ Test retention archives old and surplus finished jobs"""
+        for i in range(4):
+            self.queue.enqueue(f"echo {i}")
+        finished = []
+        for i in range(4):
+            job = self.queue.get_next_pending_job("worker-1")
+            self.queue.complete_job(job, f"out {i}", "")
+            finished.append(self.queue.storage.get_job(job.id))
+        now = time.time()
+
+        policy = RetentionPolicy(max_completed=3)
+        self.assertEqual(len(self.queue.collect_garbage(policy, dry_run=True, now=now)), 1)
+        self.assertEqual(self.queue.get_stats()["completed"], 4)
+
+        expired = self.queue.collect_garbage(policy, now=now)
+        self.assertEqual(len(expired), 1)
+        self.assertIsNone(self.queue.storage.get_job(expired[0].id))
+        self.assertFalse((self.queue.blobs.root / expired[0].output_ref).exists())
+        self.assertEqual(self.queue.archive.find(expired[0].id).command, expired[0].command)
+
+        policy = RetentionPolicy.from_config({"retention.completed_seconds": "60.5"})
+        self.assertEqual(self.queue.collect_garbage(policy, now=now + 30), [])
+        self.assertEqual(len(self.queue.collect_garbage(policy, now=now + 120)), 3)
+        self.assertEqual(self.queue.get_stats()["total_jobs"], 0)
+        self.assertEqual(sum(self.queue.archive.segment_count(path) for path in self.queue.archive.segments()), 4)
+
+        # A dead job retried after the sweep read it is neither archived nor deleted
+        for backend in ("json", "journal", "sqlite"):
+            queue = JobQueue(open_storage(os.path.join(self.temp_dir, backend), backend=backend))
+            for command in ("false", "false"):
+                queue.enqueue(command, max_retries=0)
+            for job in queue.claim_batch("worker-1", 2):
+                queue.fail_job(job, "Exit code 1")
+            dead = queue.collect_garbage(RetentionPolicy.from_config({"retention.max_dead": "0"}), dry_run=True)
+            self.assertTrue(queue.retry_dlq_job(dead[0].id), backend)
+
+            archived = []
+            removed = queue.storage.delete_unchanged_jobs(dead, before_delete=archived.extend)
+            self.assertEqual([job.id for job in removed], [dead[1].id], backend)
+            self.assertEqual(archived, removed, backend)
+            self.assertEqual(queue.storage.get_job(dead[0].id).state, JobState.PENDING, backend)
+
+    def test_failed_jobs_retry_after_backoff(self):
+        """✅ Test failed jobs wait out their backoff before being claimed again"""
+        for backend in ("json", "journal", "sqlite"):
+            queue = JobQueue(open_storage(os.path.join(self.temp_dir, backend), backend=backend))
+            job = queue.enqueue("false", max_retries=2, backoff_base=0.3)
+            queue.fail_job(queue.get_next_pending_job("worker-1"), "Exit code 1")
+
+            stored = queue.storage.get_job(job.id)
+            self.assertEqual(stored.state, JobState.PENDING, backend)
+            self.assertAlmostEqual(stored.next_run_at - stored.updated_at, 0.3, places=3)
+            self.assertIsNone(queue.get_next_pending_job("worker-1"), backend)
+
+            time.sleep(0.35)
+            retried = queue.get_next_pending_job("worker-1")
+            self.assertEqual((retried.id, retried.attempts), (job.id, 2), backend)
+            queue.fail_job(retried, "Exit code 1")
+            self.assertEqual(queue.storage.get_job(job.id).state, JobState.DEAD, backend)
+
+    def test_expired_leases_are_reclaimed(self):
+        """✅ Test jobs of a worker that stops heartbeating go back to pending"""
+        for backend in ("json", "journal", "sqlite"):
+            queue = JobQueue(open_storage(os.path.join(self.temp_dir, backend), backend=backend))
+            queue.lease_seconds = 0.2
+            lost = queue.enqueue("sleep 60", backoff_base=1)
+            kept = queue.enqueue("sleep 60")
+            claimed = queue.claim_batch("worker-1", 2)
+            self.assertEqual(len(claimed), 2, backend)
+
+            time.sleep(0.25)
+            self.assertEqual(queue.renew_leases("worker-1", [kept.id]), 1, backend)
+            self.assertEqual(queue.renew_leases("worker-2", [lost.id]), 0, backend)
+            reclaimed = queue.reclaim_expired_leases()
+            self.assertEqual([job.id for job in reclaimed], [lost.id], backend)
+
+            stored = queue.storage.get_job(lost.id)
+            self.assertEqual((stored.state, stored.attempts), (JobState.PENDING, 1), backend)
+            self.assertIn("Lease expired", stored.last_error)
+            self.assertEqual(set(queue.storage.get_locks()), {kept.id}, backend)
+            self.assertEqual(queue.cleanup_orphaned_locks(now=time.time() + 1), 1, backend)
+            self.assertEqual(queue.storage.get_locks(), {}, backend)
+
+    def test_dependencies_release_and_cascade(self):
+        """✅ Test blocked jobs run once their parents complete and die with a dead parent"""
+        for backend in ("json", "journal", "sqlite"):
+            queue = JobQueue(open_storage(os.path.join(self.temp_dir, backend), backend=backend))
+            a = queue.enqueue("echo a")
+            b = queue.enqueue("echo b", max_retries=0)
+            c = queue.enqueue("echo c", depends_on=[a.id, b.id])
+            d = queue.enqueue("echo d", depends_on=[c.id])
+            e = queue.enqueue("echo e", depends_on=[b.id], on_parent_failure="run")
+            self.assertEqual((c.state, c.pending_parents), (JobState.BLOCKED, 2), backend)
+            self.assertEqual(queue.get_stats()["blocked"], 3, backend)
+
+            claimed = {job.id: job for job in queue.claim_batch("w", 10)}
+            self.assertEqual(set(claimed), {a.id, b.id}, backend)
+            queue.complete_job(claimed[a.id], "a")
+            self.assertEqual(queue.storage.get_job(c.id).pending_parents, 1, backend)
+            self.assertEqual(queue.claim_batch("w", 10), [], backend)
+
+            queue.fail_job(claimed[b.id], "Exit code 1")
+            states = {job_id: queue.storage.get_job(job_id).state for job_id in (c.id, d.id, e.id)}
+            self.assertEqual(states, {c.id: JobState.DEAD, d.id: JobState.DEAD, e.id: JobState.PENDING}, backend)
+            self.assertEqual(queue.storage.get_job(d.id).last_error, f"Cancelled: parent {c.id} failed")
+
+            # Parents that already finished count at once
+            self.assertEqual(queue.enqueue("echo f", depends_on=[a.id]).state, JobState.PENDING, backend)
+            self.assertEqual(queue.enqueue("echo g", depends_on=[b.id]).state, JobState.DEAD, backend)
+
+            # A graph stored in one batch links up regardless of order
+            child = queue.build_job({"command": "echo child", "after": [a.id]})
+            parent = queue.build_job("echo parent")
+            child.depends_on.append(parent.id)
+            queue.enqueue_many([child, parent])
+            self.assertEqual(queue.storage.get_job(child.id).pending_parents, 1, backend)
+            self.assertEqual(queue.storage.get_job(parent.id).dependents, [child.id], backend)
+
+            # Unknown parents are rejected; archived ones count with their final state
+            self.assertIsNone(queue.enqueue("echo h", depends_on=["no-such-job"]), backend)
+            self.assertEqual(queue.enqueue_many([{"command": "echo h", "after": ["no-such-job"]}]), 0, backend)
+            queue.archive.write([queue.storage.get_job(a.id), queue.storage.get_job(b.id)])
+            queue.storage.delete_jobs([a.id, b.id])
+            self.assertEqual(queue.enqueue("echo i", depends_on=[a.id]).state, JobState.PENDING, backend)
+            self.assertEqual(queue.enqueue("echo j", depends_on=[b.id]).state, JobState.DEAD, backend)
+
+        with self.assertRaises(ValueError):
+            order_dag({"a": ["b"], "b": ["a"]})
+        self.assertEqual(order_dag({"c": ["a", "b"], "b": ["a"], "a": []}), ["a", "b", "c"])
+
+    def test_idempotency_keys_and_result_cache(self):
+        """✅ Test duplicate keys return the existing job and cached outputs complete identical jobs"""
+        for backend in ("json", "journal", "sqlite"):
+            queue = JobQueue(open_storage(os.path.join(self.temp_dir, backend), backend=backend))
+            first = queue.enqueue("echo once", idempotency_key="order-1")
+            self.assertEqual(queue.enqueue("echo once", idempotency_key="order-1").id, first.id, backend)
+            specs = [{"command": "echo once", "idempotency_key": "order-1"},
+                     {"command": "echo twice", "idempotency_key": "order-2"},
+                     {"command": "echo twice", "idempotency_key": "order-2"}]
+            self.assertEqual(queue.enqueue_many(specs), 1, backend)
+            self.assertEqual(queue.get_stats()["pending"], 2, backend)
+
+            # The key is free again once its job is archived
+            queue.storage.delete_job(first.id)
+            self.assertNotEqual(queue.enqueue("echo once", idempotency_key="order-1").id, first.id, backend)
+
+            queue.results.max_entries = 2
+            job = queue.enqueue("echo cached", cache_ttl=60)
+            queue.complete_job(job, "x" * 10000)
+            copy = queue.enqueue("echo cached", cache_ttl=60)
+            self.assertEqual(copy.state, JobState.COMPLETED, backend)
+            self.assertNotEqual(copy.output_ref, job.output_ref, backend)
+            with queue.blobs.open(copy.output_ref) as f:
+                self.assertEqual(f.read(), b"x" * 10000, backend)
+
+            for i in range(3):
+                done = queue.enqueue(f"echo {i}", cache_ttl=60)
+                queue.complete_job(done, str(i))
+            self.assertEqual(queue.enqueue("echo cached", cache_ttl=60).state, JobState.PENDING, backend)
+            self.assertEqual(queue.get_cache_stats(), {"entries": 2, "hits": 1, "misses": 5, "evictions": 2},
+                             backend)
+
+    def test_metrics_count_jobs_and_time_storage_calls(self):
+        """✅ Test metrics record claims, retries and storage calls, and are served merged"""
+        METRICS.reset()
+        self.queue.enqueue("echo ok")
+        self.queue.enqueue("false", max_retries=2)
+        for job in self.queue.claim_batch("worker-1", 2):
+            if job.command == "false":
+                self.queue.fail_job(job, "Exit code 1")
+            else:
+                self.queue.complete_job(job, "ok")
+        Job("echo replayed").mark_processing()  # only claims observe wait time
+
+        snapshot = METRICS.snapshot()
+        counters = {(name, tuple(sorted(labels.items()))): value for name, labels, value in snapshot["counters"]}
+        for name in ("jobs_enqueued_total", "jobs_claimed_total", "jobs_completed_total", "jobs_failed_total",
+                     "job_retries_total"):
+            self.assertGreaterEqual(counters[(name, (("queue", "default"),))], 1, name)
+        self.assertEqual(counters[("jobs_claimed_total", (("queue", "default"),))], 2)
+        self.assertGreater(counters[("storage_written_bytes_total", (("backend", "json"), ("op", "claim_batch")))], 0)
+        histograms = {(name, labels.get("op")): counts for name, labels, counts, _ in snapshot["histograms"]}
+        self.assertEqual(sum(histograms[("storage_op_seconds", "finish_job")]), 2)
+        self.assertEqual(sum(histograms[("job_wait_seconds", None)]), 2)
+        self.assertAlmostEqual(quantile([0, 10] + [0] * 16, 0.5), 0.00075)
+
+        # Other processes' published snapshots add up with ours on the endpoint;
+        # those of exited processes are folded into the retired totals
+        store = MetricsStore(self.queue.storage.storage_path)
+        store.root.mkdir(parents=True)
+        for name, claimed in ((f"{os.getppid()}-live", 3), ("4194305-exited", 4)):
+            with open(store.root / f"{name}.json", "w") as f:
+                json.dump({"counters": [["jobs_claimed_total", {"queue": "default"}, claimed]], "histograms": []}, f)
+        publisher = MetricsPublisher(store, interval=60, port=0)
+        publisher.start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{publisher.port}/metrics") as response:
+                text = response.read().decode()
+        finally:
+            publisher.stop()
+        self.assertIn('queuectl_jobs_claimed_total{queue="default"} 9', text)
+        self.assertIn('queuectl_claim_seconds_bucket{le="+Inf"} 1', text)
+        self.assertFalse((store.root / "4194305-exited.json").exists())
+
+        # A short-lived process (the enqueue command) hands over its metrics on exit
+        self.queue.enqueue("echo later")
+        store.retire()
+        counters = {name: value for name, labels, value in store.load()["counters"] if labels == {"queue": "default"}}
+        self.assertEqual(counters["jobs_enqueued_total"], 3)
+        self.assertEqual(store.clear(), 2)
+
+    def test_bench_measures_each_backend_and_flags_regressions(self):
+        """✅ Test the benchmark suite records every metric and compares runs"""
+        self.assertEqual(parse_size("10k"), 10000)
+        suite = BenchmarkSuite(backends=["json", "sqlite"], sizes=[50], workers=[1], latency_jobs=5,
+                               latency_rate=0, repeat=2, work_dir=self.temp_dir)
+        results = suite.run()
+        for backend in ("json", "sqlite"):
+            for metric in ("enqueue_rate", "status_p50_ms", "list_p95_ms", "claim_complete_rate/w1",
+                           "e2e_p99_ms/w1"):
+                self.assertGreater(results["results"][f"{backend}/50/{metric}"]["value"], 0, metric)
+
+        slower = json.loads(json.dumps(results))
+        slower["results"]["json/50/enqueue_rate"]["value"] /= 2
+        regressions = {row["metric"] for row in compare(slower, results, threshold=0.2) if row["regression"]}
+        self.assertEqual(regressions, {"json/50/enqueue_rate"})
+        with self.assertRaises(ValueError):
+            compare(results, dict(results, version=0))
+
+    def test_delayed_and_scheduled_jobs(self):
+        """✅ Test delayed jobs wait and each cron fire time yields one job"""
+        self.queue.enqueue_many([{"command": "echo later", "delay": 60}])
+        self.assertIsNone(self.queue.get_next_pending_job("worker-1"))
+
+        every_5 = CronExpression("*/5 * * * *")
+        start = datetime(2026, 1, 5, 9, 2, 30).timestamp()
+        self.assertEqual(every_5.next_after(start), datetime(2026, 1, 5, 9, 5).timestamp())
+        weekdays = CronExpression("0 9 * * 1-5")
+        self.assertEqual(weekdays.next_after(datetime(2026, 1, 3, 12).timestamp()),  # a Saturday
+                         datetime(2026, 1, 5, 9).timestamp())
+        with self.assertRaises(ValueError):
+            CronExpression("60 * * * *")
+
+        registry = ScheduleRegistry(self.queue.storage.storage_path)
+        entry = registry.add("*/5 * * * *", "echo tick", now=start, timeout=5)
+        schedulers = [Scheduler(self.queue), Scheduler(self.queue)]
+        fire_time = entry["next_run_at"]
+        self.assertEqual(sum(s.tick(now=fire_time) for s in schedulers), 1)
+        self.assertEqual(sum(s.tick(now=fire_time + 1) for s in schedulers), 0)
+        self.assertEqual(schedulers[1].next_fire_time(), fire_time + 300)
+
+        jobs = self.queue.storage.get_jobs_by_state(JobState.PENDING)
+        self.assertEqual(sorted(job.command for job in jobs), ["echo later", "echo tick"])
+        self.assertEqual(next(job for job in jobs if job.command == "echo tick").timeout, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,321 @@
+import unittest
+import tempfile
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from queuectl.core.job import Job, JobState, LazyJob
+from queuectl.core.storage import JobStorage, open_storage, migrate_storage
+from queuectl.core.sqlite_storage import SQLiteJobStorage
+from queuectl.core.journal_storage import JournalJobStorage
+from queuectl.core.index import JobIndex
+from queuectl.core.queue import JobQueue
+
+
+class TestStorageBackends(unittest.TestCase):
+    def setUp(self):
+        """Create an isolated temp directory for each test"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "test_data")
+
+    def tearDown(self):
+        """Clean up after test"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_sqlite_roundtrip(self):
+        """✅ Test SQLite backend stores, filters and locks jobs"""
+        storage = open_storage("sqlite:" + self.storage_path)
+        self.assertIsInstance(storage, SQLiteJobStorage)
+
+        job = Job("echo sqlite")
+        self.assertTrue(storage.save_job(job))
+        self.assertEqual(storage.get_job(job.id).command, "echo sqlite")
+        self.assertEqual([j.id for j in storage.get_jobs_by_state(JobState.PENDING)], [job.id])
+
+        self.assertTrue(storage.acquire_job_lock(job.id, "worker-1"))
+        self.assertFalse(storage.acquire_job_lock(job.id, "worker-2"))
+        self.assertTrue(storage.release_job_lock(job.id))
+
+        # Reopening without the prefix detects the existing database
+        self.assertIsInstance(open_storage(self.storage_path), SQLiteJobStorage)
+
+    def test_migrate_json_to_sqlite(self):
+        """✅ Test jobs and locks survive a JSON -> SQLite migration"""
+        source = JobStorage(self.storage_path)
+        jobs = [Job(f"echo {i}") for i in range(5)]
+        source.save_jobs(jobs)
+        source.acquire_job_lock(jobs[0].id, "worker-1")
+
+        target = open_storage(self.storage_path, backend="sqlite")
+        self.assertEqual(migrate_storage(source, target), 5)
+        self.assertEqual(set(target.get_all_jobs()), {job.id for job in jobs})
+        self.assertEqual(target.get_locks()[jobs[0].id]["worker_id"], "worker-1")
+
+    def test_migrate_half_finished_dag(self):
+        """✅ Test a migration keeps blocked jobs waiting on parents that have not finished"""
+        source = JobQueue(open_storage(os.path.join(self.temp_dir, "json"), backend="json"))
+        a, b = source.enqueue("echo a"), source.enqueue("echo b")
+        c = source.enqueue("echo c", depends_on=[a.id, b.id])
+        claimed = source.claim_batch("worker-1", 1)
+        self.assertEqual([job.id for job in claimed], [a.id])
+        source.complete_job(claimed[0], "a")
+
+        for backend in ("sqlite", "journal"):
+            target = open_storage(os.path.join(self.temp_dir, backend), backend=backend)
+            migrate_storage(source.storage, target)
+            child = target.get_job(c.id)
+            self.assertEqual((child.state, child.pending_parents), (JobState.BLOCKED, 1), backend)
+            # Saving a finished parent again is no second completion either
+            target.save_jobs([target.get_job(a.id)])
+            self.assertEqual(target.get_job(c.id).pending_parents, 1, backend)
+
+    def test_journal_replay_and_compaction(self):
+        """✅ Test journal state is rebuilt from snapshot plus journal tail"""
+        writer = JournalJobStorage(self.storage_path, compact_threshold=10**9)
+        reader = JournalJobStorage(self.storage_path)
+
+        jobs = [Job(f"echo {i}") for i in range(3)]
+        writer.save_jobs(jobs)
+        writer.delete_job(jobs[0].id)
+        self.assertEqual(set(reader.get_all_jobs()), {jobs[1].id, jobs[2].id})
+
+        writer.compact()
+        writer.acquire_job_lock(jobs[1].id, "worker-1")
+        self.assertFalse(reader.acquire_job_lock(jobs[1].id, "worker-2"))
+        self.assertEqual(set(reader.get_all_jobs()), {jobs[1].id, jobs[2].id})
+        self.assertEqual(len(list(Path(self.storage_path).glob("journal.*.log"))), 1)
+
+        reopened = open_storage(self.storage_path)
+        self.assertIsInstance(reopened, JournalJobStorage)
+        self.assertEqual(reopened.get_locks()[jobs[1].id]["worker_id"], "worker-1")
+
+        # Counters come from the journal tail, not a stats.json rewrite per append
+        stats_file = Path(self.storage_path) / "stats.json"
+        written = stats_file.stat().st_mtime_ns
+        segment = next(Path(self.storage_path).glob("journal.*.log"))
+        lines = len(segment.read_bytes().splitlines())
+        writer.save_jobs([Job("echo more")])
+        self.assertEqual(stats_file.stat().st_mtime_ns, written)
+        self.assertEqual(len(segment.read_bytes().splitlines()), lines + 1)
+        self.assertEqual(JournalJobStorage(self.storage_path).get_stats()["pending"], 3)
+
+        # A record longer than the tail read does not hide the counters
+        writer.save_jobs([Job("echo " + "x" * 1000)])
+        narrow = JournalJobStorage(self.storage_path)
+        narrow.stats_tail_bytes = 16
+        self.assertEqual(narrow.get_stats()["pending"], 4)
+
+        writer.compact()
+        fresh = JournalJobStorage(self.storage_path)
+        self.assertEqual(fresh.get_stats()["pending"], 4)
+        self.assertEqual(fresh.queue_stats()["default"]["pending"], 4)
+        self.assertEqual(fresh.recount_stats()["pending"], 4)
+
+        # A compaction that dies before publishing its snapshot leaves no
+        # segment whose counters would come from its stats.json
+        replace = os.replace
+
+        def fail_snapshot(src, dst):
+            if Path(dst) == writer.snapshot_file:
+                raise OSError("disk full")
+            replace(src, dst)
+
+        with mock.patch("os.replace", side_effect=fail_snapshot):
+            self.assertRaises(OSError, writer.compact)
+        writer.save_jobs([Job("echo after")])
+        self.assertEqual(JournalJobStorage(self.storage_path).get_stats()["pending"], 5)
+
+    def test_claim_batch_is_exclusive(self):
+        """✅ Test concurrent claims never hand the same job out twice"""
+        for backend in ("json", "journal", "sqlite"):
+            storage = open_storage(os.path.join(self.temp_dir, backend), backend=backend)
+            jobs = [Job(f"echo {i}") for i in range(30)]
+            storage.save_jobs(jobs)
+
+            claimed = []
+            def claim(worker_id):
+                while True:
+                    batch = storage.claim_batch(worker_id, 4)
+                    if not batch:
+                        return
+                    claimed.extend(job.id for job in batch)
+
+            threads = [threading.Thread(target=claim, args=(f"worker-{i}",)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(sorted(claimed), sorted(job.id for job in jobs), backend)
+            self.assertEqual(len(storage.get_locks()), 30, backend)
+            self.assertEqual(len(storage.get_jobs_by_state(JobState.PROCESSING)), 30, backend)
+
+            job = storage.get_job(jobs[0].id)
+            job.mark_completed("done")
+            self.assertTrue(storage.finish_job(job), backend)
+            self.assertNotIn(job.id, storage.get_locks(), backend)
+            self.assertEqual(storage.get_job(job.id).state, JobState.COMPLETED, backend)
+
+    def test_json_reads_do_not_write(self):
+        """✅ Test JSON reads leave files alone and see other writers"""
+        storage = JobStorage(self.storage_path)
+        other = JobStorage(self.storage_path)
+        job = Job("echo cached")
+        storage.save_job(job)
+
+        before = os.stat(storage.jobs_file).st_ino, os.stat(storage.config_file).st_ino
+        storage.get_all_jobs()
+        storage.get_job(job.id)
+        storage.load_config()
+        after = os.stat(storage.jobs_file).st_ino, os.stat(storage.config_file).st_ino
+        self.assertEqual(before, after)
+
+        # A write through another instance invalidates the cached document
+        self.assertIsNotNone(storage.get_job(job.id))
+        other.delete_job(job.id)
+        self.assertIsNone(storage.get_job(job.id))
+
+    def test_index_pending_order(self):
+        """✅ Test the pending index hands out jobs oldest first"""
+        jobs = [Job(f"echo {i}", created_at=f"2025-01-01T00:00:0{i}") for i in range(5)]
+        index = JobIndex({job.id: job.to_dict() for job in reversed(jobs)})
+        self.assertEqual(index.ready_pending(2), [jobs[0].id, jobs[1].id])
+
+        jobs[0].mark_processing()
+        index.put(jobs[0].to_dict())
+        self.assertEqual(index.ready_pending(1), [jobs[1].id])
+        self.assertEqual(index.ids(JobState.PROCESSING), {jobs[0].id})
+
+        skip = {jobs[1].id, jobs[2].id}
+        self.assertEqual(index.ready_pending(1, accept=lambda job_id: job_id not in skip), [jobs[3].id])
+
+        index.remove(jobs[1].id)
+        self.assertEqual(index.ready_pending(10), [jobs[2].id, jobs[3].id, jobs[4].id])
+
+        # A job waiting on a retry delay is skipped until it is due
+        jobs[2].next_run_at = time.time() + 60
+        index.put(jobs[2].to_dict())
+        self.assertEqual(index.ready_pending(10), [jobs[3].id, jobs[4].id])
+        self.assertEqual(index.ready_pending(10, now=time.time() + 61), [jobs[3].id, jobs[4].id, jobs[2].id])
+
+    def test_queues_priorities_and_fair_share(self):
+        """✅ Test priority order within a queue and weighted sharing across queues"""
+        for backend in ("json", "journal", "sqlite"):
+            storage = open_storage(os.path.join(self.temp_dir, backend), backend=backend)
+            bulk = [Job(f"echo bulk {i}", queue="bulk") for i in range(6)]
+            high = [Job("echo high", queue="high"), Job("echo urgent", queue="high", priority=5)]
+            storage.save_jobs(bulk + high)
+
+            self.assertEqual([job.id for job in storage.claim_batch("w", 2, ["high"])],
+                             [high[1].id, high[0].id], backend)
+            storage.save_jobs([Job(f"echo high {i}", queue="high") for i in range(6)])
+
+            claimed = storage.claim_batch("w", 8, ["high", "bulk"], {"high": 3})
+            self.assertEqual([job.queue for job in claimed].count("high"), 6, backend)
+            self.assertEqual([job.command for job in claimed if job.queue == "bulk"],
+                             ["echo bulk 0", "echo bulk 1"], backend)
+
+            stats = storage.queue_stats()
+            self.assertEqual(stats["bulk"]["pending"], 4, backend)
+            self.assertNotIn("high", stats, backend)
+            self.assertEqual(storage.claim_batch("w", 10, ["default"]), [], backend)
+
+    def test_concurrency_keys_and_rate_limits(self):
+        """✅ Test claims skip jobs over their key's limits without blocking the rest"""
+        for backend in ("json", "journal", "sqlite"):
+            storage = open_storage(os.path.join(self.temp_dir, backend), backend=backend)
+            queue = JobQueue(storage)
+            self.assertTrue(queue.set_limit("db", concurrency=2))
+            self.assertTrue(queue.set_limit("api", rate="3/h"))
+            with self.assertRaises(ValueError):
+                queue.set_limit("api", rate="fast")
+
+            db = [Job(f"echo db {i}", concurrency_key="db", priority=5) for i in range(5)]
+            api = [Job(f"echo api {i}", concurrency_key="api", priority=5) for i in range(5)]
+            plain = [Job("echo plain") for _ in range(2)]
+            storage.save_jobs(db + api + plain)
+
+            claimed = storage.claim_batch("w", 10)
+            keys = [job.concurrency_key for job in claimed]
+            self.assertEqual((keys.count("db"), keys.count("api"), keys.count(None)), (2, 3, 2), backend)
+            self.assertEqual(storage.claim_batch("w", 10), [], backend)
+
+            finished = next(job for job in claimed if job.concurrency_key == "db")
+            finished.mark_completed()
+            storage.finish_job(finished)
+            self.assertEqual([job.concurrency_key for job in storage.claim_batch("w", 10)], ["db"], backend)
+
+            limits = queue.get_limit_stats()
+            self.assertEqual(limits["db"]["running"], 2, backend)
+            self.assertEqual(limits["db"]["throttled_concurrency"], 3, backend)
+            self.assertEqual(limits["api"]["throttled_rate"], 3, backend)
+            self.assertLess(limits["api"]["tokens"], 1, backend)
+
+            # Limits survive a migration, counters included
+            target = open_storage(os.path.join(self.temp_dir, f"{backend}-copy"), backend="sqlite")
+            migrate_storage(storage, target)
+            self.assertEqual(target.get_limits()["db"]["throttled_concurrency"], 3, backend)
+            self.assertTrue(queue.remove_limit("db"))
+            self.assertEqual(len(storage.claim_batch("w", 10)), 2, backend)
+
+            # Only jobs the claim takes use up a slot: a queue's extra candidates
+            # must not crowd out the same key on another queue
+            queue = JobQueue(open_storage(os.path.join(self.temp_dir, f"{backend}-fair"), backend=backend))
+            queue.set_limit("k", concurrency=2)
+            first = [Job(f"echo a {i}", queue="a", concurrency_key="k", priority=1) for i in range(2)]
+            second = [Job("echo b", queue="b", concurrency_key="k", priority=1), Job("echo plain", queue="b")]
+            queue.storage.save_jobs(first + second)
+            claimed = queue.storage.claim_batch("w", 2, ["a", "b"])
+            self.assertEqual([job.id for job in claimed], [first[0].id, second[0].id], backend)
+            self.assertEqual(queue.storage.get_limits()["k"]["throttled_concurrency"], 0, backend)
+
+    def test_state_counters(self):
+        """✅ Test counters follow transitions and can be rebuilt"""
+        for backend in ("json", "journal", "sqlite"):
+            path = os.path.join(self.temp_dir, backend)
+            storage = open_storage(path, backend=backend)
+            jobs = [Job(f"echo {i}") for i in range(4)]
+            storage.save_jobs(jobs)
+
+            job = storage.claim_next("worker-1")
+            job.mark_completed("ok")
+            storage.finish_job(job)
+            storage.claim_next("worker-1")
+            storage.delete_job(jobs[3].id)
+
+            expected = {"total_jobs": 3, "pending": 1, "processing": 1,
+                        "completed": 1, "failed": 0, "dead": 0, "blocked": 0}
+            self.assertEqual(storage.get_stats(), expected, backend)
+            self.assertEqual(open_storage(path).get_stats(), expected, backend)
+            self.assertEqual(storage.recount_stats(), expected, backend)
+
+            queues = {"default": {"pending": 1, "oldest_created_at": jobs[2].created_at}}
+            self.assertEqual(storage.queue_stats(), queues, backend)
+            reopened = open_storage(path)
+            self.assertEqual(reopened.queue_stats(), queues, backend)
+            if backend == "json":
+                # status reads only the counters, never jobs.json
+                self.assertNotIn(reopened.jobs_file, reopened._cache)
+
+    def test_legacy_timestamps_and_lazy_jobs(self):
+        """✅ Test ISO timestamps still load and lazy jobs defer heavy fields"""
+        legacy = {"id": "legacy-1", "command": "echo old", "state": "completed",
+                  "created_at": "2025-11-09T11:31:36.207484", "output": "old output"}
+        job = Job.from_dict(legacy)
+        self.assertAlmostEqual(job.created_at, 1762687896.207484, places=3)
+        self.assertIsInstance(job.to_dict()["created_at"], float)
+
+        storage = open_storage(self.storage_path, backend="sqlite")
+        job.last_error = "boom"
+        storage.save_job(job)
+        lazy = storage.get_all_jobs(lazy=True)["legacy-1"]
+        self.assertIsInstance(lazy, LazyJob)
+        lazy.output = "replaced"
+        self.assertEqual((lazy.output, lazy.last_error), ("replaced", "boom"))
+
+
+if __name__ == '__main__':
+    unittest.main()
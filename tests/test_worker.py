@@ -0,0 +1,247 @@
+import unittest
+import tempfile
+import os
+import shutil
+import signal
+import threading
+import time
+import json
+from unittest import mock
+
+from queuectl.core.job import JobState
+from queuectl.core.storage import open_storage
+from queuectl.core.queue import JobQueue
+from queuectl.core.worker import JobWorker, WorkerManager
+from queuectl.core.async_worker import AsyncJobWorker
+from queuectl.core.capture import TailBuffer
+
+
+class TestWorkerManager(unittest.TestCase):
+    def setUp(self):
+        """Create an isolated temp directory for each test"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.storage_path = os.path.join(self.temp_dir, "test_data")
+        self.queue = JobQueue(open_storage("sqlite:" + self.storage_path))
+
+    def tearDown(self):
+        """Clean up after test"""
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def wait_for(self, condition, timeout=20):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if condition():
+                return True
+            time.sleep(0.1)
+        return False
+
+    def test_worker_streams_output_with_bounded_memory(self):
+        """✅ Test large job output is spooled and counted, not buffered"""
+        tail = TailBuffer(8)
+        for chunk in (b"abc", b"defghij", b"klmnopqrstuvwxyz", b"!"):
+            tail.write(chunk)
+        self.assertEqual(tail.getvalue(), b"tuvwxyz!")
+
+        self.queue.blobs.max_bytes = 1000
+        job = self.queue.enqueue("seq 1 200000; echo oops >&2")
+        JobWorker("worker-1", self.queue, handle_signals=False)._process_job(
+            self.queue.get_next_pending_job("worker-1"))
+
+        stored = self.queue.storage.get_job(job.id)
+        self.assertEqual(stored.state, JobState.COMPLETED)
+        self.assertEqual(stored.output_bytes, sum(len(f"{i}\n") for i in range(1, 200001)))
+        self.assertEqual(stored.error_bytes, 5)
+        self.assertEqual(self.queue.blobs.tail(stored.output_ref, 1), b"200000\n")
+        with self.queue.blobs.open(stored.output_ref) as f:
+            self.assertLessEqual(len(f.read()), 1000)
+        self.assertEqual(list(self.queue.blobs.root.rglob("*.part")), [])
+
+        self.queue.spool_output = False
+        self.queue.tail_bytes = 7
+        job = self.queue.enqueue("seq 1 1000")
+        JobWorker("worker-1", self.queue, handle_signals=False)._process_job(
+            self.queue.get_next_pending_job("worker-1"))
+        stored = self.queue.storage.get_job(job.id)
+        self.assertEqual((stored.output_ref, stored.output), (None, "\n999\n1000\n"[-7:]))
+
+        # A capture that cannot be opened fails the job instead of pinning its lease
+        self.queue.spool_output = True
+        spool = self.queue.blobs.spool
+
+        def spool_stdout_only(job_id, stream):
+            if stream == "stderr":
+                raise OSError("No space left on device")
+            return spool(job_id, stream)
+
+        with mock.patch.object(self.queue.blobs, "spool", side_effect=spool_stdout_only):
+            for worker in (JobWorker("worker-2", self.queue, handle_signals=False),
+                           AsyncJobWorker("async-1", self.queue)):
+                job = self.queue.enqueue("echo hi", max_retries=0)
+                thread = threading.Thread(target=worker.start, daemon=True)
+                thread.start()
+                try:
+                    self.assertTrue(self.wait_for(
+                        lambda: self.queue.storage.get_job(job.id).state == JobState.DEAD, timeout=5))
+                finally:
+                    worker.stop()
+                    thread.join(timeout=5)
+                self.assertIn("No space left", self.queue.storage.get_job(job.id).last_error)
+                self.assertEqual(self.queue.storage.get_locks(), {})
+        self.assertEqual(list(self.queue.blobs.root.rglob("*.part")), [])
+
+    def test_process_pool_restarts_crashed_children(self):
+        """✅ Test worker processes drain the queue, restart on crash and report stats"""
+        self.queue.enqueue_many([{"command": "echo hi", "max_retries": 0} for _ in range(6)])
+        manager = WorkerManager(self.queue)
+        manager.start_processes(2)
+        try:
+            self.assertTrue(self.wait_for(lambda: self.queue.get_stats()["completed"] == 6))
+            self.assertTrue(self.wait_for(lambda: sum(s["processed"] for s in manager.get_worker_stats()) == 6))
+
+            self.queue.enqueue("sleep 30", max_retries=0)
+            self.assertTrue(self.wait_for(lambda: self.queue.get_stats()["processing"] == 1))
+            worker_id = next(iter(self.queue.storage.get_locks().values()))["worker_id"]
+            victim = manager.processes[worker_id.rsplit("-worker-", 1)[0]]
+            os.kill(victim.process.pid, signal.SIGKILL)
+
+            self.assertTrue(self.wait_for(lambda: victim.restarts == 1 and victim.process.is_alive()))
+            self.assertEqual(self.queue.get_stats()["dead"], 1)
+            self.assertEqual(self.queue.storage.get_locks(), {})
+        finally:
+            manager.stop_workers()
+
+        stats = manager.get_worker_stats()
+        self.assertEqual(len(stats), 2)
+        self.assertEqual(sum(s["processed"] for s in stats), 6)
+        self.assertEqual(len(self.queue.storage.get_jobs_by_state(JobState.PROCESSING)), 0)
+
+    def test_async_worker_runs_jobs_concurrently(self):
+        """✅ Test the asyncio worker overlaps jobs and kills timed-out ones"""
+        self.queue.enqueue_many([{"command": f"sleep 0.5; echo {i}"} for i in range(20)])
+        self.queue.enqueue("sleep 30", timeout=1, max_retries=0)
+        worker = AsyncJobWorker("async-1", self.queue, concurrency=25)
+        thread = threading.Thread(target=worker.start, daemon=True)
+
+        started = time.time()
+        thread.start()
+        try:
+            self.assertTrue(self.wait_for(lambda: self.queue.get_stats()["dead"] == 1, timeout=5))
+            self.assertTrue(self.wait_for(lambda: self.queue.get_stats()["completed"] == 20, timeout=5))
+            self.assertLess(time.time() - started, 4)
+        finally:
+            worker.stop()
+            thread.join(timeout=5)
+
+        self.assertEqual(worker.get_stats()["processed"], 20)
+        self.assertIn("Timeout", self.queue.storage.get_jobs_by_state(JobState.DEAD)[0].last_error)
+        self.assertEqual(self.queue.storage.get_locks(), {})
+
+        # Jobs still running at stop keep their leases while they drain
+        self.queue.lease_seconds = 0.6
+        job = self.queue.enqueue("sleep 1.5")
+        worker = AsyncJobWorker("async-2", self.queue, concurrency=2)
+        thread = threading.Thread(target=worker.start, daemon=True)
+        thread.start()
+        self.assertTrue(self.wait_for(lambda: self.queue.get_stats()["processing"] == 1, timeout=5))
+        worker.stop()
+        while thread.is_alive():
+            self.assertEqual(self.queue.reclaim_expired_leases(), [])
+            thread.join(timeout=0.2)
+        self.assertEqual(self.queue.storage.get_job(job.id).state, JobState.COMPLETED)
+
+    def test_no_shell_jobs_and_fork_server(self):
+        """✅ Test argv jobs skip the shell and the fork server launches jobs"""
+        for concurrency in (0, 4):
+            storage_path = os.path.join(self.temp_dir, f"fork-{concurrency}")
+            queue = JobQueue(open_storage(storage_path))
+            argv_job = queue.enqueue("echo 'a b' $HOME", shell=False)
+            shell_job = queue.enqueue("echo $((1 + 1)) >&2; exit 3", max_retries=0)
+            queue.enqueue("sleep 30", timeout=0.5, max_retries=0, shell=False)
+
+            manager = WorkerManager(queue, executor="forkserver")
+            manager.start_workers(1, concurrency=concurrency)
+            try:
+                self.assertTrue(self.wait_for(
+                    lambda: queue.get_stats()["completed"] + queue.get_stats()["dead"] == 3, timeout=10))
+                stats = manager.get_worker_stats()[0]
+            finally:
+                manager.stop_workers()
+
+            stored = queue.storage.get_job(argv_job.id)
+            with queue.blobs.open(stored.output_ref) as f:
+                self.assertEqual(f.read(), b"a b $HOME\n")
+            self.assertEqual(queue.storage.get_job(shell_job.id).last_error, "Exit code 3: 2\n")
+            self.assertEqual(len(queue.storage.get_jobs_by_state(JobState.DEAD)), 2)
+            self.assertEqual(stats["spawns"], 3)
+            self.assertGreater(stats["spawn_avg_ms"], 0)
+
+    def test_python_tasks_run_in_warm_pool(self):
+        """✅ Test module:function jobs return JSON output and fail like commands"""
+        with open(os.path.join(self.temp_dir, "sample_tasks.py"), "w") as f:
+            f.write("import os, time\n"
+                    "def add(a, b=0):\n    return {'sum': a + b, 'pid': os.getpid()}\n"
+                    "def boom():\n    raise RuntimeError('boom')\n"
+                    "def hang():\n    time.sleep(30)\n")
+        with mock.patch.dict(os.environ, {"PYTHONPATH": self.temp_dir}):
+            for concurrency in (0, 4):
+                queue = JobQueue(open_storage(os.path.join(self.temp_dir, f"tasks-{concurrency}")))
+                queue.config.set("task_processes", 1)
+                queue.enqueue_many([
+                    {"task": "sample_tasks:add", "args": [2, 3]},
+                    {"task": "sample_tasks:add", "args": {"a": 1, "b": 1}},
+                    {"task": "sample_tasks:boom", "max_retries": 0},
+                    {"task": "sample_tasks:hang", "timeout": 0.5, "max_retries": 0},
+                    {"task": "no_such_module:run", "max_retries": 0},
+                ])
+
+                manager = WorkerManager(queue)
+                manager.start_workers(1, concurrency=concurrency)
+                try:
+                    self.assertTrue(self.wait_for(
+                        lambda: queue.get_stats()["completed"] + queue.get_stats()["dead"] == 5, timeout=15))
+                finally:
+                    manager.stop_workers()
+
+                completed = queue.storage.get_jobs_by_state(JobState.COMPLETED)
+                outputs = []
+                for job in completed:
+                    with queue.blobs.open(job.output_ref) as f:
+                        outputs.append(json.loads(f.read()))
+                self.assertEqual(sorted(output["sum"] for output in outputs), [2, 5])
+                self.assertEqual(len({output["pid"] for output in outputs}), 1)  # one warm process
+
+                errors = sorted(job.last_error for job in queue.storage.get_jobs_by_state(JobState.DEAD))
+                self.assertTrue(errors[0].startswith("Task error: ModuleNotFoundError"))
+                self.assertTrue(errors[1].startswith("Task error: RuntimeError: boom"))
+                self.assertIn("Traceback", errors[1])
+                self.assertEqual(errors[2], "Timeout after 0.5s")
+                self.assertEqual(manager.tasks._started, 0)
+
+        with self.assertRaises(ValueError):
+            self.queue.build_job({"task": "not a ref"})
+        with self.assertRaises(ValueError):
+            self.queue.build_job({"command": "true", "args": [1]})
+
+    def test_enqueue_wakes_idle_workers(self):
+        """✅ Test idle workers pick up new jobs without waiting for the poll"""
+        stale = self.queue.notifier.listen()
+        stale.sock.close()  # as if its process had died
+        self.assertEqual(self.queue.notifier.notify(), 0)
+        self.assertFalse(stale.path.exists())
+
+        manager = WorkerManager(self.queue)
+        manager.start_workers(2)
+        try:
+            time.sleep(0.3)  # let both workers go idle
+            job = self.queue.enqueue("true")
+            self.assertTrue(self.wait_for(lambda: self.queue.storage.get_job(job.id).started_at))
+        finally:
+            manager.stop_workers()
+
+        stored = self.queue.storage.get_job(job.id)
+        self.assertLess(stored.started_at - stored.created_at, 0.5)
+        self.assertEqual(list(self.queue.notifier.root.glob("*.sock")), [])
+
+
+if __name__ == '__main__':
+    unittest.main()